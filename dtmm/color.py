@@ -26,7 +26,8 @@ Color conversion
 
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import FDTYPE, NUMBA_TARGET, NFDTYPE, NUMBA_CACHE, DATAPATH, CMF
+from dtmm.conf import NUMBA_TARGET, NFDTYPE, NUMBA_CACHE, DATAPATH, CMF, numba_signatures
+import dtmm.conf as conf
 
 import numpy as np
 import numba
@@ -48,7 +49,7 @@ SRGBSLOPE = 12.92
 SRGBLINPOINT = 0.0031308
 SRGBA = 0.055
 
-@numba.vectorize([NFDTYPE(NFDTYPE, NFDTYPE)], nopython = True, target = NUMBA_TARGET, cache = NUMBA_CACHE) 
+@numba.vectorize(numba_signatures([NFDTYPE(NFDTYPE, NFDTYPE)], scalars = True), nopython = True, target = NUMBA_TARGET, cache = NUMBA_CACHE) 
 def apply_gamma(value, gamma):
     """apply_gamma(value, gamma)
     
@@ -67,7 +68,7 @@ gamma : float
     else:
         return value**(1./gamma)
 
-@numba.vectorize([NFDTYPE(NFDTYPE)], nopython = True, target = NUMBA_TARGET, cache = NUMBA_CACHE) 
+@numba.vectorize(numba_signatures([NFDTYPE(NFDTYPE)], scalars = True), nopython = True, target = NUMBA_TARGET, cache = NUMBA_CACHE) 
 def apply_srgb_gamma(value):
     """apply_srgb_gamma(value)
 
@@ -83,7 +84,7 @@ Applies sRGB gamma function (transfer function) to the given (linear) data."""
         else:
             return (1+SRGBA)*value**SRGBIGAMMA-SRGBA
 
-@numba.guvectorize([(NFDTYPE[:], NFDTYPE[:])], '(n)->(n)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
+@numba.guvectorize(numba_signatures([(NFDTYPE[:], NFDTYPE[:])]), '(n)->(n)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def xyz2srgb(xyz, rgb):
     """xyz2srgb(xyz)
     
@@ -97,7 +98,7 @@ D65 reference white.
     for k in range(3):
         rgb[k] = XYZ2RGBD65[k,0] * xyz0 +  XYZ2RGBD65[k,1]* xyz1 +  XYZ2RGBD65[k,2]* xyz2
         
-@numba.guvectorize([(NFDTYPE[:], NFDTYPE[:])], '(n)->(n)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
+@numba.guvectorize(numba_signatures([(NFDTYPE[:], NFDTYPE[:])]), '(n)->(n)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def xyz2gray(xyz, gray):
     """xyz2gray(xyz)
     
@@ -107,7 +108,7 @@ Converts XYZ value to Gray color"""
     for k in range(3):
         gray[k] = y
                 
-@numba.guvectorize([(NFDTYPE[:],NFDTYPE[:,:],NFDTYPE[:])], '(n),(n,m)->(m)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
+@numba.guvectorize(numba_signatures([(NFDTYPE[:],NFDTYPE[:,:],NFDTYPE[:])]), '(n),(n,m)->(m)', target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def spec2xyz(spec,cmf,xyz):
     """spec2xyz(spec,cmf)
     
@@ -346,8 +347,8 @@ def cmf2tcmf(cmf, spec, norm = True, out = None):
     -----
     Numpy broadcasting rules apply to spec and cmf.
     """
-    cmf = np.asarray(cmf,FDTYPE)
-    spec = np.asarray(spec,FDTYPE)
+    cmf = np.asarray(cmf,conf.FDTYPE)
+    spec = np.asarray(spec,conf.FDTYPE)
     if norm == True:
         spec = normalize_specter(spec, cmf)
     return np.multiply(spec[:,np.newaxis],cmf, out = out) 
@@ -395,10 +396,10 @@ def load_specter(wavelengths = None, illuminant = "D65", retx = False):
         
     if wavelengths is not None:
         data = interpolate_data(wavelengths, data[:,0], data[:,1:])
-        data = np.ascontiguousarray(data[:,0], dtype = FDTYPE)
+        data = np.ascontiguousarray(data[:,0], dtype = conf.FDTYPE)
     else:
-        wavelengths = np.ascontiguousarray(data[:,0], dtype = FDTYPE)
-        data = np.ascontiguousarray(data[:,1], dtype = FDTYPE)
+        wavelengths = np.ascontiguousarray(data[:,0], dtype = conf.FDTYPE)
+        data = np.ascontiguousarray(data[:,1], dtype = conf.FDTYPE)
         
     if retx == True:
         return wavelengths, data
@@ -457,14 +458,14 @@ def load_cmf(wavelengths = None, cmf = CMF, retx = False, single_wavelength = Fa
         data = np.loadtxt(cmf)
     
     if data.shape[-1] == 4:
-        x, data = np.ascontiguousarray(data[:,0], dtype = FDTYPE),  np.ascontiguousarray(data[:,1:], dtype = FDTYPE)
+        x, data = np.ascontiguousarray(data[:,0], dtype = conf.FDTYPE),  np.ascontiguousarray(data[:,1:], dtype = conf.FDTYPE)
     elif data.shape[-1] == 2:
-        x, data = np.ascontiguousarray(data[:,0], dtype = FDTYPE),  np.ascontiguousarray(data[:,1], dtype = FDTYPE)
+        x, data = np.ascontiguousarray(data[:,0], dtype = conf.FDTYPE),  np.ascontiguousarray(data[:,1], dtype = conf.FDTYPE)
     else:
         raise ValueError("Not a valid cmf data!")
         
     if wavelengths is not None:
-        wavelengths = np.asarray(wavelengths, dtype = FDTYPE)
+        wavelengths = np.asarray(wavelengths, dtype = conf.FDTYPE)
         if wavelengths.ndim != 1:
             raise ValueError("Wavelengths has to be 1D array")
         if len(wavelengths) == 1:
@@ -487,7 +488,7 @@ def load_cmf(wavelengths = None, cmf = CMF, retx = False, single_wavelength = Fa
 #import scipy.interpolate as interpolate
 
 def interpolate_data(x, x0, data):
-    data = np.asarray(data, dtype = FDTYPE)
+    data = np.asarray(data, dtype = conf.FDTYPE)
     x0 = np.asarray(x0)
     x = np.asarray(x)
     if data.ndim in (1,2) and x0.ndim == 1 and x.ndim == 1: 
@@ -10,7 +10,9 @@ from __future__ import absolute_import, print_function, division
 
 import numpy as np
 from functools import wraps
-import os, warnings, shutil
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+import os, warnings, shutil, threading, itertools, hashlib, tempfile, weakref, mmap
 
 try:
     from configparser import ConfigParser
@@ -62,6 +64,11 @@ DTMM_CONFIG_DIR = os.path.join(HOMEDIR, ".dtmm")
 
 NUMBA_CACHE_DIR = os.path.join(DTMM_CONFIG_DIR, "numba_cache")
 
+#: file in which FFTW wisdom is stored between sessions (pyfftw backend)
+FFTW_WISDOM_FILE = os.path.join(DTMM_CONFIG_DIR, "fftw_wisdom.pickle")
+
+#: folder of the persistent (disk) results cache, see :func:`set_disk_cache`
+DISK_CACHE_DIR = os.path.join(DTMM_CONFIG_DIR, "result_cache")
 
 if not os.path.exists(DTMM_CONFIG_DIR):
     try:
@@ -69,6 +76,8 @@ if not os.path.exists(DTMM_CONFIG_DIR):
     except:
         warnings.warn("Could not create folder in user's home directory! Is it writeable?",stacklevel=2)
         NUMBA_CACHE_DIR = ""
+        FFTW_WISDOM_FILE = ""
+        DISK_CACHE_DIR = ""
 
 #FILE_LOCK = os.path.join(DTMM_CONFIG_DIR, "lock")        
 # if os.path.exists(NUMBA_CACHE_DIR):
@@ -122,6 +131,8 @@ def is_module_installed(name):
 NUMBA_INSTALLED = is_module_installed("numba")
 MKL_FFT_INSTALLED = is_module_installed("mkl_fft")
 SCIPY_INSTALLED = is_module_installed("scipy")
+SCIPY_FFT_INSTALLED = is_module_installed("scipy.fft")
+PYFFTW_INSTALLED = is_module_installed("pyfftw")
 
 BETAMAX = _readconfig(config.getfloat, "core", "betamax", 0.8)
 SMOOTH = _readconfig(config.getfloat, "core", "smooth", 0.1)
@@ -196,6 +207,128 @@ else:
 
 #reference to all cashed functions - for automatic cache clearing with clear_cache.
 _cache = set()
+#: lock for the global (all caches) eviction
+_cache_lock = threading.Lock()
+#: access counter, for finding the least recently used results across all caches.
+_cache_ticks = itertools.count()
+
+#: cache statistics, as returned by :func:`cache_info`
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize", "nbytes"])
+
+def _result_nbytes(result):
+    if isinstance(result, (tuple, list)):
+        return sum((_result_nbytes(r) for r in result))
+    return getattr(result, "nbytes", 0)
+
+class LRUCache(object):
+    """A least recently used results cache. 
+    
+    The cache is limited by the number of results and by the memory (sum of
+    the nbytes of the cached arrays). All caches together are also limited by
+    DTMMConfig.cache_memory, in which case least recently used results of all
+    caches are removed first, but the most recently stored result is kept.
+    
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of cached results. Defaults to DTMMConfig.cache_size.
+    maxbytes : int, optional
+        Maximum size of cached results in bytes. Unlimited by default.
+    """
+    def __init__(self, maxsize = None, maxbytes = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        #key -> (result, nbytes, tick)
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def _limits(self):
+        maxsize = DTMMConfig.cache_size if self.maxsize is None else self.maxsize
+        maxbytes = np.inf if self.maxbytes is None else self.maxbytes
+        return maxsize, maxbytes
+        
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                result, nbytes, tick = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._data[key] = result, nbytes, next(_cache_ticks)
+            self.hits += 1
+            return result
+    
+    def __setitem__(self, key, result):
+        nbytes = _result_nbytes(result)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._data[key] = result, nbytes, next(_cache_ticks)
+            self.nbytes += nbytes
+            maxsize, maxbytes = self._limits()
+            while len(self._data) > maxsize or self.nbytes > maxbytes:
+                self.popitem()
+        _evict_global(self)
+    
+    def full(self):
+        """Returns True if adding a new result removes an old one."""
+        return len(self._data) >= self._limits()[0]
+    
+    def oldest(self):
+        """Returns access tick of the least recently used result."""
+        with self._lock:
+            try:
+                return next(iter(self._data.values()))[2]
+            except StopIteration:
+                return np.inf
+    
+    def popitem(self):
+        """Removes and returns least recently used result."""
+        with self._lock:
+            key, (result, nbytes, tick) = self._data.popitem(last = False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+            return result
+        
+    def clear(self):
+        """Clears cached results."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            
+    def info(self):
+        """Returns cache statistics."""
+        return CacheInfo(self.hits, self.misses, self.evictions, self._limits()[0], len(self), self.nbytes)
+        
+def _evict_global(last = None):
+    """Removes least recently used results of all caches, until the global 
+    memory limit is met. The most recently stored result (in the last cache) 
+    is kept, even if it alone exceeds the limit."""
+    maxbytes = DTMMConfig.cache_memory * 1024**2
+    with _cache_lock:
+        caches = [func.cache for func in _cache]
+        nbytes = sum((cache.nbytes for cache in caches))
+        while nbytes > maxbytes:
+            cache = min(caches, key = lambda cache: cache.oldest())
+            #other threads may access the cache, so check and remove under its lock
+            with cache._lock:
+                if len(cache) == 0 or (cache is last and len(cache) == 1):
+                    #only the most recently stored result is left
+                    break
+                nbytes -= cache.nbytes
+                cache.popitem()
+                nbytes += cache.nbytes
 
 def clear_cache(func = None):
     """Clears compute cache.
@@ -213,9 +346,152 @@ def clear_cache(func = None):
     else:
         for func in _cache:
             func.cache.clear()
+            
+def cache_info(func = None):
+    """Returns cache statistics.
+    
+    Parameters
+    ----------
+    func : function, optional
+        A cached function of which cache statistics is returned. If not provided
+        (default), statistics summed over all cached functions is returned.
+        
+    Returns
+    -------
+    info : CacheInfo
+        A (hits, misses, evictions, maxsize, currsize, nbytes) named tuple. 
+    """
+    if func is not None:
+        return func.cache.info()
+    else:
+        infos = [func.cache.info() for func in _cache]
+        return CacheInfo(*(sum((getattr(info,name) for info in infos)) for name in CacheInfo._fields))
         
             
-def cached_function(f):
+#: arrays smaller than this (in bytes) are keyed by their data, larger are hashed.
+SMALL_ARRAY_NBYTES = 256
+
+#: memoized keys of frozen arrays, id -> (weakref, key)
+_array_keys = {}
+
+def _is_frozen(arr):
+    """Whether array data cannot change, that is, the array and all its 
+    base arrays are read-only and the data buffer is immutable (bytes or a 
+    read-only memory map). Read-only arrays that own their data are not frozen, 
+    because they can be made writeable again."""
+    while isinstance(arr, np.ndarray):
+        if arr.flags.writeable:
+            return False
+        arr = arr.base
+    if isinstance(arr, bytes):
+        return True
+    if isinstance(arr, mmap.mmap):
+        try:
+            return memoryview(arr).readonly
+        except ValueError:
+            #closed mmap
+            return False
+    return False
+
+def _array_key(arr):
+    """Returns a cache key of the array. Small arrays are keyed by their data, 
+    large arrays by a hash of their data. Hashes of frozen arrays, e.g. results
+    loaded from the disk cache, are computed only once and memoized by array 
+    identity."""
+    if arr.nbytes <= SMALL_ARRAY_NBYTES:
+        return (arr.shape, arr.dtype.str, arr.tobytes())
+    frozen = _is_frozen(arr)
+    if frozen:
+        item = _array_keys.get(id(arr))
+        if item is not None and item[0]() is arr:
+            return item[1]
+    from dtmm.hashing import hash_buffer 
+    key = (arr.shape, arr.dtype.str, hash_buffer(np.ascontiguousarray(arr)))
+    if frozen:
+        i = id(arr)
+        _array_keys[i] = (weakref.ref(arr, lambda ref : _array_keys.pop(i, None)), key)
+    return key
+
+def _to_key(arg, name = None):
+    if isinstance(arg, np.ndarray):
+        arg = _array_key(arg)
+    if name is None:
+        return arg
+    else:
+        return (name, arg)
+
+def _disk_cache_path(func, key):
+    """Returns the content-addressed folder of the cached result."""
+    from dtmm import __version__
+    name = "{}.{}".format(func.__module__, func.__name__)
+    digest = hashlib.sha1(repr((__version__, PRECISION, key)).encode()).hexdigest()
+    return os.path.join(DISK_CACHE_DIR, name, digest)
+
+def _disk_cache_load(path):
+    """Loads (memory-maps) cached result from the disk cache. Returns None 
+    if it does not exist."""
+    try:
+        fnames = sorted(os.listdir(path))
+        result = tuple((np.load(os.path.join(path, fname), mmap_mode = "r") for fname in fnames))
+        #mark as recently used
+        os.utime(path)
+    except (OSError, ValueError):
+        #not cached or removed by another process
+        return None
+    return result[0] if fnames == ["result.npy"] else result
+
+def _disk_cache_save(path, result):
+    """Saves result to the disk cache. Results are first written to a temporary 
+    folder and then atomically renamed, so concurrent processes never see 
+    partially written results."""
+    arrays = result if isinstance(result, tuple) else (result,)
+    if DISK_CACHE_DIR == "" or not all((isinstance(a, np.ndarray) for a in arrays)):
+        return
+    try:
+        root = os.path.dirname(path)
+        os.makedirs(root, exist_ok = True)
+        tmp = tempfile.mkdtemp(prefix = ".tmp", dir = root)
+        if isinstance(result, tuple):
+            for i, a in enumerate(result):
+                np.save(os.path.join(tmp, "{:03d}.npy".format(i)), a)
+        else:
+            np.save(os.path.join(tmp, "result.npy"), result)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #another process has already stored the result
+            shutil.rmtree(tmp, ignore_errors = True)
+        _disk_cache_evict()
+    except OSError:
+        warnings.warn("Could not write to disk cache {}".format(DISK_CACHE_DIR))
+
+def _disk_cache_evict():
+    """Removes least recently used results until disk cache size limit is met."""
+    entries = []
+    for root in os.scandir(DISK_CACHE_DIR):
+        if root.is_dir():
+            for entry in os.scandir(root.path):
+                if entry.is_dir() and not entry.name.startswith("."):
+                    try:
+                        size = sum((f.stat().st_size for f in os.scandir(entry.path)))
+                        entries.append((entry.stat().st_mtime, size, entry.path))
+                    except OSError:
+                        pass
+    entries.sort()
+    nbytes = sum((size for mtime, size, path in entries))
+    maxbytes = DTMMConfig.disk_cache_size * 1024**2
+    for mtime, size, path in entries:
+        if nbytes <= maxbytes:
+            break
+        shutil.rmtree(path, ignore_errors = True)
+        nbytes -= size
+        
+def clear_disk_cache():
+    """Removes all results from the disk cache."""
+    if DISK_CACHE_DIR != "":
+        shutil.rmtree(DISK_CACHE_DIR, ignore_errors = True)
+        
+def cached_function(f = None, disk = False):
     """A decorator that converts a function into a cached function. 
     
     The function needs to be a function that returns a numpy array as a result.
@@ -224,33 +500,19 @@ def cached_function(f):
     are small numpy arrays. The function can also take "out" keyword argument for
     an output array in which the resulting array is copied to.
     
+    Results are stored in a :class:`LRUCache`, see :func:`set_cache`. If disk 
+    is True, results are also stored in a persistent disk cache (when enabled,
+    see :func:`set_disk_cache`) and are shared between processes.
+    
     Notes
     -----
     When caching is enabled, cached numpy arrayes have a read-only attribute. 
     You need to copy first, or provide an output array if you need to write to 
     the result.
     """
+    if f is None:
+        return lambda f : cached_function(f, disk = disk)
     
-    def pop_fifo_result_from_cache(cache):
-        try:
-            return cache.pop(next(iter(cache.keys())))
-        except StopIteration:
-            return None   
-        
-    def add_result_to_cache(result, key, cache):
-        pop_fifo_result_from_cache(cache)   
-        cache[key] = result
-
-    def to_key(arg, name = None):
-        from dtmm.hashing import hash_buffer 
-        if isinstance(arg, np.ndarray):
-            arg = (arg.shape, arg.dtype, arg.strides, hash_buffer(arg))
-            #return (arg.shape, arg.dtype, tuple(arg.flat))
-        if name is None:
-            return arg
-        else:
-            return (name, arg)
-        
     def copy(result,out):
         if out is not None:
             if isinstance(result, tuple):
@@ -286,56 +548,51 @@ def cached_function(f):
     def _f(*args,**kwargs):
         try_read_from_cache = (kwargs.pop("cache",True) == True) and (DTMMConfig.cache != 0) and _f.cache is not None
         if try_read_from_cache:
-            key = tuple((to_key(arg) for arg in args)) + tuple((to_key(arg, name = key) for key,arg in kwargs.items()))
             out = kwargs.pop("out",None)    
+            reuse = kwargs.pop("reuse",False)
+            key = tuple((_to_key(arg) for arg in args)) + tuple((_to_key(arg, name = key) for key,arg in kwargs.items()))
             try:
                 result = _f.cache[key]
                 return copy(result,out)
             except KeyError:
-                if kwargs.pop("reuse",False):
-                    result = pop_fifo_result_from_cache(_f.cache)
-                    unset_readonly(result)
-                    kwargs["out"] = result 
-                result = f(*args,**kwargs)
+                path = _disk_cache_path(f, key) if disk and DTMMConfig.disk_cache else None
+                result = None if path is None else _disk_cache_load(path)
+                if result is None:
+                    if reuse and _f.cache.full():
+                        #reuse memory of the least recently used result
+                        result = _f.cache.popitem()
+                        try:
+                            unset_readonly(result)
+                            kwargs["out"] = result 
+                        except ValueError:
+                            #memory-mapped results cannot be reused
+                            pass
+                    result = f(*args,**kwargs)
+                    if path is not None:
+                        _disk_cache_save(path, result)
                 set_readonly(result)
-                add_result_to_cache(result,key, _f.cache)
+                _f.cache[key] = result
                 return copy(result,out)
         else:
             return f(*args,**kwargs)
-    _f.cache = {}
+    _f.cache = LRUCache()
+    _f.cache_info = _f.cache.info
     
     _cache.add(_f)
     #_f.delete = delete
     return _f    
  
-def cached_result(f):
+def cached_result(f = None, disk = False):
     """A decorator that converts a function into a cached result function. 
     
     The function needs to be a function that returns any result.
     Function arguments must all be hashable, or
-    are small numpy arrays. 
+    are small numpy arrays. If disk is True, array results are also stored 
+    in a persistent disk cache, see :func:`cached_function`.
     """
+    if f is None:
+        return lambda f : cached_result(f, disk = disk)
     
-    def pop_fifo_result_from_cache(cache):
-        try:
-            return cache.pop(next(iter(cache.keys())))
-        except StopIteration:
-            return None   
-        
-    def add_result_to_cache(result, key, cache):
-        pop_fifo_result_from_cache(cache)   
-        cache[key] = result
-
-    def to_key(arg, name = None):
-        from dtmm.hashing import hash_buffer 
-        if isinstance(arg, np.ndarray):
-            arg = (arg.shape, arg.dtype, arg.strides, hash_buffer(arg))
-            #return (arg.shape, arg.dtype, tuple(arg.flat))
-        if name is None:
-            return arg
-        else:
-            return (name, arg)
-
     def set_readonly(result):
         if isinstance(result, tuple):
             for a in result:
@@ -353,18 +610,24 @@ def cached_result(f):
     def _f(*args,**kwargs):
         try_read_from_cache = (kwargs.pop("cache",True) == True) and (DTMMConfig.cache != 0) and _f.cache is not None
         if try_read_from_cache:
-            key = tuple((to_key(arg) for arg in args)) + tuple((to_key(arg, name = key) for key,arg in kwargs.items()))  
+            key = tuple((_to_key(arg) for arg in args)) + tuple((_to_key(arg, name = key) for key,arg in kwargs.items()))  
             try:
                 result = _f.cache[key]
                 return result
             except KeyError:
-                result = f(*args,**kwargs)
+                path = _disk_cache_path(f, key) if disk and DTMMConfig.disk_cache else None
+                result = None if path is None else _disk_cache_load(path)
+                if result is None:
+                    result = f(*args,**kwargs)
+                    if path is not None:
+                        _disk_cache_save(path, result)
                 set_readonly(result)
-                add_result_to_cache(result,key, _f.cache)
+                _f.cache[key] = result
                 return result
         else:
             return f(*args,**kwargs)
-    _f.cache = {}
+    _f.cache = LRUCache()
+    _f.cache_info = _f.cache.info
     
     _cache.add(_f)
     #_f.delete = delete
@@ -441,8 +704,12 @@ class DTMMConfig(object):
     def __init__(self):
         
         
-        if MKL_FFT_INSTALLED:
+        if PYFFTW_INSTALLED:
+            self.fftlib = "pyfftw"
+        elif MKL_FFT_INSTALLED:
             self.fftlib = "mkl_fft"
+        elif SCIPY_FFT_INSTALLED:
+            self.fftlib = "scipy.fft"
         elif SCIPY_INSTALLED:
             self.fftlib = "scipy"
         else:
@@ -457,7 +724,13 @@ class DTMMConfig(object):
             self.cache = 1
         else:
             self.cache = 0
+        self.cache_size = _readconfig(config.getint, "core", "cache_size", 16)
+        self.cache_memory = _readconfig(config.getfloat, "core", "cache_memory", 512.)
+        self.disk_cache = _readconfig(config.getboolean, "core", "disk_cache", False)
+        self.disk_cache_size = _readconfig(config.getfloat, "core", "disk_cache_size", 1024.)
         self.verbose = 0
+        self.max_memory = _readconfig(config.getfloat, "core", "max_memory", 1024.)
+        self.precision = PRECISION
         
         self.gray =  _readconfig(config.getboolean, "viewer", "gray", False)
         self.show_ticks = _readconfig(config.getboolean, "viewer", "show_ticks", None)
@@ -481,6 +754,7 @@ class DTMMConfig(object):
         self.npass = _readconfig(config.getint, "transfer", "npass", 1)
         self.reflection = _readconfig(config.getint, "transfer", "reflection", None)
         self.eff_data = _readconfig(config.getint, "transfer", "eff_data", 0)
+        self.packed = _readconfig(config.getboolean, "transfer", "packed", False)
         
     def __getitem__(self, item):
         return self.__dict__[item]
@@ -526,15 +800,100 @@ def set_nthreads(num):
     DTMMConfig.nthreads = max(1,int(num))
     return out
    
-def set_cache(level):
-    """Sets compute cache level."""
+def set_cache(level, size = None, memory = None):
+    """Sets compute cache level. Returns previous setting of the level.
+    
+    Parameters
+    ----------
+    level : int
+        Cache level, 0 disables caching.
+    size : int, optional
+        If provided, it sets maximum number of cached results of each cached 
+        function.
+    memory : float, optional
+        If provided, it sets memory limit (in MB) of all cached results.
+    """
     out = DTMMConfig.cache
     level = max(int(level),0)
     if level > 1:
         warnings.warn("Cache levels higher than 1 not supported yet!")
     DTMMConfig.cache = level
+    if size is not None:
+        DTMMConfig.cache_size = max(int(size),0)
+    if memory is not None:
+        DTMMConfig.cache_memory = max(float(memory),0.)
+    return out
+
+def set_disk_cache(enabled, size = None):
+    """Enables or disables the persistent disk cache of the results. 
+    Returns previous setting.
+    
+    Parameters
+    ----------
+    enabled : bool
+        Whether matrices (e.g. diffraction and projection matrices) are stored 
+        to and loaded from the disk cache folder (DISK_CACHE_DIR).
+    size : float, optional
+        If provided, it sets the size limit (in MB) of the disk cache. Least 
+        recently used results are removed first.
+    """
+    out = DTMMConfig.disk_cache
+    DTMMConfig.disk_cache = bool(enabled)
+    if size is not None:
+        DTMMConfig.disk_cache_size = max(float(size),0.)
+    return out
+
+def set_max_memory(size):
+    """Sets memory budget (in MB) for batched computations. Returns previous setting."""
+    out = DTMMConfig.max_memory
+    DTMMConfig.max_memory = max(float(size),0.)
+    return out
+
+def set_precision(name = "double"):
+    """Sets floating point precision ("single", "mixed" or "double") of the 
+    arrays created by dtmm functions. Returns previous setting.
+    
+    Compiled functions are available in both precisions, so the precision can 
+    be changed at any time. In single precision, memory usage and bandwidth
+    are halved, at the cost of accuracy. In mixed precision, arrays are stored
+    in single precision, but eigensystems (see :func:`.tmm.alphaf`) and 
+    intensity normalization sums in :func:`.transfer.transfer_field` are computed
+    in double precision. Changing the precision clears the (in-memory) results 
+    cache. dtmm modules look up :data:`FDTYPE` and :data:`CDTYPE` in this 
+    module when called, so the setting takes effect immediately. See also 
+    :func:`precision`.
+    """
+    global FDTYPE, CDTYPE, PRECISION
+    out, name = PRECISION, str(name)
+    if name in ("single", "mixed"):
+        fdtype, cdtype = F32DTYPE, C64DTYPE
+    elif name == "double":
+        fdtype, cdtype = F64DTYPE, C128DTYPE
+    else:
+        raise ValueError("Unsupported precision, use 'single', 'mixed' or 'double'.")
+    FDTYPE, CDTYPE = fdtype, cdtype
+    if name != PRECISION:
+        #cached results are arrays of the previous precision
+        clear_cache()
+    PRECISION = name
+    DTMMConfig.precision = name
     return out
 
+@contextmanager
+def precision(name):
+    """A context manager for temporary change of the precision.
+    
+    Examples
+    --------
+    >>> with precision("single"):
+    ...     out = transfer_field(field_data, optical_data) #complex64 result
+    """
+    out = set_precision(name)
+    try:
+        yield
+    finally:
+        set_precision(out)
+
 def set_fftlib(name = "numpy.fft"):
     """Sets fft library. Returns previous setting."""
     out, name = DTMMConfig.fftlib, str(name) 
@@ -543,6 +902,16 @@ def set_fftlib(name = "numpy.fft"):
             DTMMConfig.fftlib = name
         else:
             warnings.warn("MKL FFT is not installed so it can not be used! Please install mkl_fft.")            
+    elif name == "pyfftw":
+        if PYFFTW_INSTALLED: 
+            DTMMConfig.fftlib = name
+        else:
+            warnings.warn("pyFFTW is not installed so it can not be used! Please install pyfftw.")  
+    elif name == "scipy.fft":
+        if SCIPY_FFT_INSTALLED:
+            DTMMConfig.fftlib = name
+        else:
+            warnings.warn("scipy.fft is not available so it can not be used! Please install scipy>=1.4.") 
     elif name == "scipy.fftpack" or name == "scipy":
         if SCIPY_INSTALLED:
             DTMMConfig.fftlib = "scipy"
@@ -573,5 +942,35 @@ else:
     NFDTYPE = NF32DTYPE
     NCDTYPE = NC64DTYPE
     NUDTYPE = NU32DTYPE
+
+_NUMBA_SINGLE = {NF64DTYPE : NF32DTYPE, NC128DTYPE : NC64DTYPE}
+_NUMBA_DOUBLE = {NF32DTYPE : NF64DTYPE, NC64DTYPE : NC128DTYPE}
+
+def _convert_numba_type(t, table, scalars):
+    if isinstance(t, numba.types.Array):
+        return t.copy(dtype = table.get(t.dtype, t.dtype))
+    return table.get(t, t) if scalars else t
+
+def _convert_numba_signature(sig, table, scalars):
+    if isinstance(sig, tuple):
+        return tuple((_convert_numba_type(t, table, scalars) for t in sig))
+    else:
+        args = (_convert_numba_type(t, table, scalars) for t in sig.args)
+        return _convert_numba_type(sig.return_type, table, scalars)(*args)
+
+def numba_signatures(signatures, scalars = False):
+    """Converts a list of numba signatures, written in terms of NFDTYPE and 
+    NCDTYPE, to a list of single and double precision signatures, so that 
+    compiled functions can be used in both precisions (see :func:`precision`).
+    
+    Single precision signatures come first, so that guvectorized functions 
+    do not cast single precision input to double precision. Only array types 
+    are converted, unless scalars is True (for vectorized functions). Scalar 
+    arguments are usually computed in double precision inside the kernels 
+    anyway, and single precision scalars are safely promoted.
+    """
+    single = [_convert_numba_signature(sig, _NUMBA_SINGLE, scalars) for sig in signatures]
+    double = [_convert_numba_signature(sig, _NUMBA_DOUBLE, scalars) for sig in signatures]
+    return single + [sig for sig in double if sig not in single]
   
     
@@ -49,14 +49,15 @@ import numpy as np
 import numba
 import sys
 
-from dtmm.conf import FDTYPE, CDTYPE, NFDTYPE, NCDTYPE, NUMBA_CACHE,\
-NF32DTYPE,NF64DTYPE,NC128DTYPE,NC64DTYPE, DTMMConfig
+from dtmm.conf import NFDTYPE, NCDTYPE, NUMBA_CACHE,\
+NF32DTYPE,NF64DTYPE,NC128DTYPE,NC64DTYPE, DTMMConfig, U32DTYPE
+import dtmm.conf as conf
 from dtmm.rotation import rotation_matrix_x,rotation_matrix_y,rotation_matrix_z, rotate_vector, rotation_angles, rotation_matrix, rotate_diagonal_tensor
 from dtmm.wave import betaphi, k0
-from dtmm.fft import fft2, ifft2
+from dtmm.fft import fft2, ifft2, rfft2, irfft2
 from dtmm.linalg import tensor_eig
 
-def read_director(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder, order = "zyxn", nvec = "xyz"):
+def read_director(file, shape, dtype = None,  sep = "", endian = sys.byteorder, order = "zyxn", nvec = "xyz"):
     """Reads raw director data from a binary or text file. 
     
     A convinient way to read director data from file. 
@@ -67,9 +68,10 @@ def read_director(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder
         Open file object or filename.
     shape : sequence of ints
         Shape of the data array, e.g., ``(50, 24, 34, 3)``
-    dtype : data-type
+    dtype : data-type, optional
         Data type of the raw data. It is used to determine the size of the items 
-        in the file.
+        in the file. Defaults to the current float dtype (see 
+        :func:`.conf.set_precision`).
     sep : str
         Separator between items if file is a text file.
         Empty ("") separator means the file should be treated as binary.
@@ -91,10 +93,11 @@ def read_director(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder
         i,j,k,c = shape
     except:
         raise TypeError("shape must be director data shape (z,y,x,n)")
+    dtype = conf.FDTYPE if dtype is None else dtype
     data = read_raw(file, shape, dtype, sep = sep, endian = endian)
     return raw2director(data, order, nvec)
 
-def read_tensor(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder, order = "zyxn"):
+def read_tensor(file, shape, dtype = None,  sep = "", endian = sys.byteorder, order = "zyxn"):
     """Reads raw tensor data from a binary or text file. 
     
     A convinient way to read tensor data from file.
@@ -106,9 +109,10 @@ def read_tensor(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder,
         Open file object or filename.
     shape : sequence of ints
         Shape of the data array, e.g., ``(50, 24, 34, 6)``
-    dtype : data-type
+    dtype : data-type, optional
         Data type of the raw data. It is used to determine the size of the items 
-        in the file.
+        in the file. Defaults to the current float dtype (see 
+        :func:`.conf.set_precision`).
     sep : str
         Separator between items if file is a text file.
         Empty ("") separator means the file should be treated as binary.
@@ -127,6 +131,7 @@ def read_tensor(file, shape, dtype = FDTYPE,  sep = "", endian = sys.byteorder,
         i,j,k,c = shape
     except:
         raise TypeError("shape must be 3D tensor data shape (z,y,x,n)")
+    dtype = conf.FDTYPE if dtype is None else dtype
     data = read_raw(file, shape, dtype, sep = sep, endian = endian)
     return raw2director(data, order) #no swapping of Q tensor elements, so we can use raw2director
 
@@ -297,7 +302,7 @@ def director2data(director, mask = None, no = 1.5, ne = 1.6, nhost = None,scale_
         A valid optical data tuple.
         
     """
-    material = np.empty(shape = director.shape, dtype = FDTYPE)
+    material = np.empty(shape = director.shape, dtype = conf.FDTYPE)
     material[...] = refind2eps([no,no,ne])[None,...] 
     material = uniaxial_order(director2order(director)/scale_factor, material, out = material)
     
@@ -493,8 +498,8 @@ def eps2epsva(eps):
     epsv, r = tensor_eig(eps)
     # r is in general complex for complex eps. But, if a complex tensor is a rotated diagonal,
     # the eigenvectors should be real. Test it here.
-    atol = 1e-8 if CDTYPE == "complex128" else 1e-8
-    rtol = 1e-5 if CDTYPE == "complex128" else 1e-5
+    atol = 1e-8 if conf.CDTYPE == "complex128" else 1e-8
+    rtol = 1e-5 if conf.CDTYPE == "complex128" else 1e-5
     if not np.allclose(r,r.real, atol = atol, rtol = rtol):
         import warnings
         warnings.warn("Input tensor is not normal because eigevectors are not real. Results are unpredictive!", stacklevel = 2)
@@ -520,6 +525,32 @@ def epsva2eps(epsv,epsa):
     r = rotation_matrix(epsa)
     return rotate_diagonal_tensor(r,epsv)
 
+
+def unique_epsva(shape, *args):
+    """Finds distinct materials in epsv and epsa arrays defined over a 2D 
+    grid of a given shape. 
+    
+    Parameters
+    ----------
+    shape : (int,int)
+        Shape of the grid.
+    args : (...,3) arrays
+        Epsilon eigenvalues and Euler angles arrays (and optionally any number 
+        of additional arrays), broadcastable to shape + (3,).
+
+    Returns
+    -------
+    values, index : tuple of ndarrays, ndarray
+        For each input array, an array of shape (nmat,3) holding values of
+        the distinct materials, and an integer array of a given shape that maps 
+        each pixel to the material.
+    """
+    shape = tuple(shape)
+    arrays = [np.broadcast_to(np.asarray(a), shape + (3,)).reshape(-1,3) for a in args]
+    table = np.concatenate([a.view(a.real.dtype) if np.iscomplexobj(a) else a for a in arrays], axis = -1)
+    _, first, index = np.unique(table, axis = 0, return_index = True, return_inverse = True)
+    values = tuple(a[first] for a in arrays)
+    return values, index.reshape(shape).astype(U32DTYPE)
         
 def validate_optical_data(data, homogeneous = False):
     """Validates optical data.
@@ -541,7 +572,7 @@ def validate_optical_data(data, homogeneous = False):
         Validated optical data tuple. 
     """
     thickness, material, angles = data
-    thickness = np.asarray(thickness, dtype = FDTYPE)
+    thickness = np.asarray(thickness, dtype = conf.FDTYPE)
     if thickness.ndim == 0:
         thickness = thickness[None] #make it 1D
     elif thickness.ndim != 1:
@@ -549,9 +580,9 @@ def validate_optical_data(data, homogeneous = False):
     n = len(thickness)
     material = np.asarray(material)
     if np.issubdtype(material.dtype, np.complexfloating):
-        material = np.asarray(material, dtype = CDTYPE)
+        material = np.asarray(material, dtype = conf.CDTYPE)
     else:
-        material = np.asarray(material, dtype = FDTYPE)
+        material = np.asarray(material, dtype = conf.FDTYPE)
     if (material.ndim == 1 and homogeneous) or (material.ndim==3 and not homogeneous):
         material = np.broadcast_to(material, (n,)+material.shape)# np.asarray([material for i in range(n)], dtype = material.dtype)
     if len(material) != n:
@@ -559,7 +590,7 @@ def validate_optical_data(data, homogeneous = False):
     if (material.ndim != 2 and homogeneous) or (material.ndim != 4 and not homogeneous):
         raise ValueError("Invalid dimensions of the material.")
 
-    angles = np.asarray(angles, dtype = FDTYPE)
+    angles = np.asarray(angles, dtype = conf.FDTYPE)
     if (angles.ndim == 1 and homogeneous) or (angles.ndim==3 and not homogeneous):
         angles = np.broadcast_to(angles, (n,)+angles.shape)
         #angles = np.asarray([angles for i in range(n)], dtype = angles.dtype)
@@ -709,7 +740,7 @@ def nematic_droplet_director(shape, radius, profile = "r", retmask = False):
     """
     
     nz, ny, nx = shape
-    out = np.zeros(shape = (nz,ny,nx,3), dtype = FDTYPE)
+    out = np.zeros(shape = (nz,ny,nx,3), dtype = conf.FDTYPE)
     xx, yy, zz = _r3(shape)
     
     r = (xx**2 + yy**2 + zz**2) ** 0.5 
@@ -767,7 +798,7 @@ def cholesteric_director(shape, pitch, hand = "left"):
         phi = 2*np.pi/pitch*np.arange(nz)
     else:
         raise ValueError("Unknown handedness '{}'".format(hand))
-    out = np.zeros(shape = (nz,ny,nx,3), dtype = FDTYPE)
+    out = np.zeros(shape = (nz,ny,nx,3), dtype = conf.FDTYPE)
 
     for i in range(nz):
         out[i,...,0] = np.cos(phi[i])
@@ -1130,11 +1161,18 @@ def filter_data(optical_data, wavelength, pixelsize, betamax = 1, symmetry = "is
        
 def filter_eps(eps, k, betamax = 1):
     eps = np.moveaxis(eps,-1,-3)
-    feps = fft2(eps)
-    beta, phi = betaphi(feps.shape[-2:],k)
+    shape = eps.shape[-2:]
+    beta, phi = betaphi(shape,k)
     mask = beta > betamax
-    feps[...,mask] = 0.
-    eps = ifft2(feps)
+    if np.isrealobj(eps) or not np.any(eps.imag):
+        #lossless material, transform the real part only - the half spectrum
+        feps = rfft2(eps.real)
+        feps[...,mask[...,:feps.shape[-1]]] = 0.
+        eps = irfft2(feps, s = shape).astype(conf.CDTYPE)
+    else:
+        feps = fft2(eps)
+        feps[...,mask] = 0.
+        eps = ifft2(feps)
     eps = np.moveaxis(eps,-3,-1)
     return eps
 
@@ -3,13 +3,13 @@ Field denoising functions.
 """
 
 import numpy as np
-from dtmm.conf import FDTYPE
+import dtmm.conf as conf
 from dtmm.wave import betaphi
 from dtmm.fft import fft2,ifft2
 
 def tukey_notch_filter(x,x0,alpha):
-    x = np.asarray(x, FDTYPE)
-    out = np.ones(x.shape, FDTYPE)
+    x = np.asarray(x, conf.FDTYPE)
+    out = np.ones(x.shape, conf.FDTYPE)
     alpha = alpha * x0
     mask = (x < x0 + alpha)
     mask = np.logical_and(mask, (x > x0 - alpha))
@@ -19,7 +19,7 @@ def tukey_notch_filter(x,x0,alpha):
     return out  
 
 def exp_notch_filter(x,x0,sigma):
-    return np.asarray((1 - 1*np.exp(-np.abs(x-x0).clip(0,x0)/sigma))/(1-1*np.exp(-x0/sigma)),FDTYPE)
+    return np.asarray((1 - 1*np.exp(-np.abs(x-x0).clip(0,x0)/sigma))/(1-1*np.exp(-x0/sigma)),conf.FDTYPE)
 
 def denoise_field(field, wavenumbers, beta , smooth = 1, filter_func = exp_notch_filter, out = None):
     """Denoises field by attenuating modes around the selected beta parameter.
@@ -5,11 +5,12 @@ Diffraction calculation functions.
 """
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import cached_function, BETAMAX, FDTYPE, CDTYPE
-from dtmm.wave import betaphi
+from dtmm.conf import cached_function, BETAMAX
+import dtmm.conf as conf
+from dtmm.wave import betaphi, radial_index
 from dtmm.data import refind2eps
 from dtmm.tmm import phase_mat,  alphaffi, alphaf,  alphaEEi, tr_mat, alphaE
-from dtmm.linalg import dotmdm, dotmf
+from dtmm.linalg import dotmdm, dotmf, dotrbf
 from dtmm.fft import fft2, ifft2
 
 
@@ -25,8 +26,8 @@ def diffraction_alphaf(shape, ks, epsv = (1.,1.,1.),
     ks = np.asarray(ks)
     ks = abs(ks)
     beta, phi = betaphi(shape,ks)
-    epsv = np.asarray(epsv, CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE)
     
     mask0 = (beta >= betamax)
     
@@ -111,7 +112,7 @@ def E_diffraction_alphaE(shape, ks, epsv = (1,1,1),
 
   
 def phase_matrix(alpha, kd, mode = None, mask = None, out = None):
-    kd = np.asarray(kd, dtype = FDTYPE)
+    kd = np.asarray(kd, dtype = conf.FDTYPE)
     out = phase_mat(alpha,kd[...,None,None], out = out)  
     if mode == "t" or mode == +1:
         out[...,1::2] = 0.
@@ -121,28 +122,178 @@ def phase_matrix(alpha, kd, mode = None, mask = None, out = None):
         out[mask] = 0.
     return out  
 
-@cached_function
+@cached_function(disk = True)
 def field_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.), mode = "b", betamax = BETAMAX, out = None):
     """Build field diffraction matrix. 
     """
     
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
     alpha, f, fi = diffraction_alphaffi(shape, ks, epsv = epsv, epsa = epsa, betamax = betamax)
     kd =ks * d
     pmat = phase_matrix(alpha, kd , mode = mode)
     
     return dotmdm(f,pmat,fi,out = out) 
 
+class CompactDiffractionMatrix(object):
+    """Compact (symmetry-reduced) field diffraction matrix of an isotropic medium.
+    
+    In an isotropic medium, the diffraction matrix of a plane wave is a rotation
+    (by the plane wave's phi angle) of a block diagonal matrix that depends on
+    beta only. Only the blocks of the distinct beta values within the betamax
+    cutoff are stored, and the matrix is applied on the fly in :func:`dotmf`
+    and :func:`diffract`, so it can be used in place of the dense matrix.
+    Use :func:`compact_field_diffraction_matrix` to create one.
+    
+    Parameters
+    ----------
+    shape : (int,int)
+        Shape of the field.
+    blocks : (...,nr,2,2,2) array
+        Diffraction matrix blocks for each of the distinct radial frequencies 
+        (for each wavenumber). First block must be zero.
+    index : (:,:) array
+        An uint32 array mapping plane waves to blocks. 
+    """
+    def __init__(self, shape, blocks, index):
+        self.blocks = blocks
+        self.index = index
+        ay, ax = map(lambda x : np.asarray(np.fft.fftfreq(x), dtype = conf.FDTYPE), shape[-2:])
+        self._ay, self._ax = ay, ax
+        
+    @property
+    def shape(self):
+        """Shape of the equivalent dense matrix"""
+        return self.blocks.shape[:-4] + self.index.shape + (4,4)
+    
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    @property
+    def dtype(self):
+        return self.blocks.dtype
+    
+    @property
+    def nbytes(self):
+        return self.blocks.nbytes + self.index.nbytes
+    
+    def dotmf(self, field, out = None):
+        """Computes a dot product of the matrix with a field array."""
+        field = np.asarray(field)
+        if field.shape[-2:] != self.index.shape:
+            raise ValueError("Field shape {} does not match matrix shape {}".format(field.shape[-2:], self.index.shape))
+        return dotrbf(self.blocks, self.index, self._ay, self._ax, field, out)
+    
+    def toarray(self):
+        """Returns the equivalent dense matrix."""
+        ny, nx = self.index.shape
+        out = np.zeros(self.shape, conf.CDTYPE)
+        b = self.blocks[...,self.index,:,:,:]
+        out[...,0:2,0:2] = b[...,0,:,:]
+        out[...,2:4,2:4] = b[...,1,:,:]
+        beta, phi = betaphi((ny,nx), 1.)
+        c, s = np.cos(phi), np.sin(phi)
+        r = np.zeros((ny,nx,4,4), conf.FDTYPE)
+        r[...,0,0] = c
+        r[...,0,2] = -s
+        r[...,1,1] = c
+        r[...,1,3] = s
+        r[...,2,0] = s
+        r[...,2,2] = c
+        r[...,3,1] = -s
+        r[...,3,3] = c
+        return np.matmul(np.matmul(r,out),np.swapaxes(r,-1,-2))
+    
+    def __array__(self, dtype = None, copy = None):
+        return np.asarray(self.toarray(), dtype = dtype)
+
+def _is_isotropic(epsv):
+    return np.all(epsv[...,0] == epsv[...,1]) and np.all(epsv[...,1] == epsv[...,2]) 
+
+@cached_function(disk = True)
+def compact_diffraction_blocks(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.), mode = "b", betamax = BETAMAX, out = None):
+    """Builds diffraction matrix blocks and the blocks index array of the
+    compact field diffraction matrix. See :class:`CompactDiffractionMatrix`.
+    """
+    ks = np.abs(np.asarray(ks, dtype = conf.FDTYPE))
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
+    r, rindex = radial_index(shape)
+    
+    #keep only radial frequencies that are within the cutoff for the largest wavenumber
+    nr = np.searchsorted(r, betamax * ks.max() / (2*np.pi), side = "left")
+    beta = 2 * np.pi * r[:nr] / ks[...,None]
+    alpha, f, fi = alphaffi(beta,0.,epsv,epsa)
+    mask0 = (beta >= betamax)
+    fi[mask0] = 0.
+    f[mask0] = 0.
+    alpha[mask0] = 0.
+    
+    kd = ks * d
+    pmat = phase_matrix(alpha[...,None,:], kd, mode = mode)[...,0,:]
+    dmat = dotmdm(f,pmat,fi) 
+    
+    if out is None:
+        blocks = np.zeros(ks.shape + (nr + 1,2,2,2), conf.CDTYPE)
+        index = np.empty(rindex.shape, "uint32")
+    else:
+        blocks, index = out
+        blocks[...,0,:,:,:] = 0.
+    blocks[...,1:,0,:,:] = dmat[...,0:2,0:2]
+    blocks[...,1:,1,:,:] = dmat[...,2:4,2:4]
+    
+    #first block is zero, masked out plane waves point to it
+    np.add(rindex, 1, out = index)
+    index[rindex >= nr] = 0
+    return blocks, index
+
+def compact_field_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.), mode = "b", betamax = BETAMAX):
+    """Build compact field diffraction matrix of an isotropic medium.
+    
+    This is a memory efficient alternative to :func:`field_diffraction_matrix`.
+    Instead of the dense (...,ny,nx,4,4) array it returns a 
+    :class:`CompactDiffractionMatrix` that stores the matrix blocks of the 
+    distinct beta values within the betamax cutoff only. It can be used as 
+    the dmat argument of :func:`diffract`.
+    
+    Parameters
+    ----------
+    shape : (int,int)
+        Shape of the field.
+    ks : float or array of floats
+        Wavenumbers.
+    d : float
+        Propagation distance.
+    epsv : (float,float,float)
+        Dielectric tensor eigenvalues. These must all be equal. 
+    epsa : (float,float,float)
+        Euler angles of the dielectric tensor. Not used for isotropic medium.
+    mode : str or int
+        Propagation mode, either "b", "t" (or +1) or "r" (or -1).
+    betamax : float
+        The beta cutoff parameter.
+        
+    Returns
+    -------
+    dmat : CompactDiffractionMatrix
+        Diffraction matrix.
+    """
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    if not _is_isotropic(epsv):
+        raise ValueError("Compact diffraction matrix requires an isotropic medium.")
+    blocks, index = compact_diffraction_blocks(shape, ks, d = d, epsv = epsv, epsa = epsa, mode = mode, betamax = betamax)
+    return CompactDiffractionMatrix(shape, blocks, index)
+
 #@cached_function
 def field_thick_cover_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.), d_cover = 0, epsv_cover = (1.,1.,1.), epsa_cover = (0.,0.,0.), mode = "b", betamax = BETAMAX, out = None):
     """Build field diffraction matrix. 
     """
     
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
     alpha, f, fi = diffraction_alphaffi(shape, ks, epsv = epsv, epsa = epsa, betamax = betamax)
     alpha0, f0 = diffraction_alphaf(shape, ks, epsv = epsv_cover ,epsa = epsa_cover, betamax = betamax)
     
@@ -171,21 +322,21 @@ def field_thick_cover_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), eps
 
 @cached_function
 def E_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.), mode = +1, betamax = BETAMAX, out = None):
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
     alpha, j, ji = E_diffraction_alphaEEi(shape, ks, epsv = epsv, epsa = epsa, mode = mode, betamax = betamax)
     kd =ks * d
     pmat = phase_matrix(alpha, kd)
     return dotmdm(j,pmat,ji,out = out) 
 
-@cached_function
+@cached_function(disk = True)
 def E_cover_diffraction_matrix(shape, ks,  n = 1., d_cover = 0, n_cover = 1.5, mode = +1, betamax = BETAMAX, out = None):
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(refind2eps((n,)*3),CDTYPE)
-    epsa = np.asarray((0.,0.,0.), dtype = FDTYPE)
-    epsv_cover = np.asarray(refind2eps((n_cover,)*3),CDTYPE)
-    epsa_cover = np.asarray((0.,0.,0.), dtype = FDTYPE)    
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(refind2eps((n,)*3),conf.CDTYPE)
+    epsa = np.asarray((0.,0.,0.), dtype = conf.FDTYPE)
+    epsv_cover = np.asarray(refind2eps((n_cover,)*3),conf.CDTYPE)
+    epsa_cover = np.asarray((0.,0.,0.), dtype = conf.FDTYPE)    
     alpha, j = E_diffraction_alphaE(shape, ks, epsv = epsv, epsa = epsa, mode = mode, betamax = betamax)
     alpha0, j0, j0i = E_diffraction_alphaEEi(shape, ks, epsv = epsv_cover, epsa = epsa_cover, mode = mode, betamax = betamax)
 
@@ -211,7 +362,7 @@ def E_cover_diffraction_matrix(shape, ks,  n = 1., d_cover = 0, n_cover = 1.5, m
 #    
 #    return transmission_mat(fin, fout, fini = fini, mode = mode, out = out)
 #
-@cached_function
+@cached_function(disk = True)
 def E_tr_matrix(shape, ks, epsv_in = (1.,1.,1.), epsa_in = (0.,0.,0.),
                             epsv_out = (1.,1.,1.), epsa_out = (0.,0.,0.), mode = +1, betamax = BETAMAX, out = None):
     
@@ -238,13 +389,13 @@ def E_tr_matrix(shape, ks, epsv_in = (1.,1.,1.), epsa_in = (0.,0.,0.),
 #    return t_mat(fin, fout, fini = fini, mode = mode, out = out)
         
 
-@cached_function
+@cached_function(disk = True)
 def projection_matrix(shape, ks, epsv = (1,1,1),epsa = (0,0,0.), mode = +1, betamax = BETAMAX, out = None):
     """Computes a reciprocial field projection matrix.
     """
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)    
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)    
     alpha, f, fi = diffraction_alphaffi(shape, ks, epsv = epsv, epsa = epsa, betamax = betamax)
     kd = np.zeros_like(ks)
     pmat = phase_matrix(alpha, kd , mode = mode)
@@ -258,8 +409,9 @@ def diffract(field, dmat, window = None, input_fft = False, output_fft = False,
     ----------
     field : (...,4,:,:) array
         Input field array.
-    dmat : array
-        Diffraction matrix. Use :func:`field_diffraction_matrix`to create one
+    dmat : array or CompactDiffractionMatrix
+        Diffraction matrix. Use :func:`field_diffraction_matrix` or 
+        :func:`compact_field_diffraction_matrix` to create one
     window : array, optional
         A window function applied to the result
     input_fft : bool
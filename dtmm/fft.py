@@ -3,19 +3,31 @@ Custom 2D FFT functions.
 
 numpy, scipy and mkl_fft do not have fft implemented such that output argument 
 can be provided. This implementation adds the output argument for fft2 and 
-ifft2 functions. 
+ifft2 functions, and for the real-to-complex rfft2 and irfft2 functions, which 
+are used for real-valued operands at half the cost and memory.
 
 Also, for mkl_fft and scipy, the computation can be performed in parallel using ThreadPool.
+The pool is created once and reused in subsequent calls, and the work partitioning
+(the transform plan) is cached for each array shape, dtype and transform direction.
+The scipy.fft backend uses its own threading (the workers argument) instead,
+and it computes inplace transforms without making temporary copies.
+
+With pyfftw, FFTW plans are created once for each array shape, dtype, axes and 
+number of threads and are reused in subsequent calls. FFTW wisdom is stored in
+the dtmm configuration directory, so that new sessions do not need to re-plan.
 
 """
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import DTMMConfig, CDTYPE, MKL_FFT_INSTALLED, SCIPY_INSTALLED
+from dtmm.conf import DTMMConfig, MKL_FFT_INSTALLED, SCIPY_INSTALLED, \
+    SCIPY_FFT_INSTALLED, PYFFTW_INSTALLED, FFTW_WISDOM_FILE
+import dtmm.conf as conf
 import numpy as np
 
 import numpy.fft as npfft
 
 from multiprocessing.pool import ThreadPool
+import threading, atexit, pickle, os, warnings
 
 from functools import reduce
 
@@ -24,6 +36,12 @@ if MKL_FFT_INSTALLED == True:
     
 if SCIPY_INSTALLED == True:
     import scipy.fftpack as spfft
+    
+if SCIPY_FFT_INSTALLED == True:
+    import scipy.fft as scfft
+
+if PYFFTW_INSTALLED == True:
+    import pyfftw
 
 def _set_out_mkl(a,out):
     if out is not a:
@@ -59,46 +77,138 @@ def _optimal_workers(size, nthreads):
         return nthreads
     else:
         return _optimal_workers(size, nthreads-1)
+
+#: persistent thread pool used for threaded fft, see :func:`get_pool`
+_pool = None
+_pool_nthreads = 0
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns a ThreadPool used for threaded fft computation.
+    
+    The pool is created on first use and it is kept alive for later calls. 
+    If the number of threads has changed (see :func:`.conf.set_nthreads`) a
+    new pool of the requested size replaces the old one.
     
-def _reshape(a):
-    shape = a.shape
-    newshape = reduce((lambda x,y: x*y), shape[:-2] or [1])
-    if DTMMConfig.nthreads > 1:
-        n = _optimal_workers(newshape,DTMMConfig.nthreads)
-        newshape = (n,newshape//n,) + shape[-2:]
+    Returns
+    -------
+    pool : ThreadPool
+        A thread pool with DTMMConfig.nthreads workers.
+    """
+    global _pool, _pool_nthreads
+    nthreads = DTMMConfig.nthreads
+    with _pool_lock:
+        if _pool is not None and _pool_nthreads != nthreads:
+            _pool.close()
+            _pool = None
+        if _pool is None:
+            _pool = ThreadPool(nthreads)
+            _pool_nthreads = nthreads
+        return _pool
+
+@atexit.register
+def close_pool():
+    """Shuts down the fft thread pool. A new one is created when needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+            _pool = None
+
+#: thread-local state, marks threads that execute :func:`pool_map` tasks 
+_worker = threading.local()
+
+def in_pool_worker():
+    """Returns True if called from a task that is run by :func:`pool_map`."""
+    return getattr(_worker, "active", False)
+
+def _run_in_worker(args):
+    func, arg = args
+    _worker.active = True
+    try:
+        return func(arg)
+    finally:
+        _worker.active = False
+
+def pool_map(func, iterable):
+    """Applies func to all elements of iterable using the thread pool (see 
+    :func:`get_pool`) and returns a list of results. 
+    
+    Computation is sequential if DTMMConfig.nthreads is 1, or if called from 
+    within a pool task; threaded fft functions called from pool tasks are 
+    also sequential, so that pool workers never wait for each other.
+    """
+    if DTMMConfig.nthreads > 1 and not in_pool_worker():
+        return get_pool().map(_run_in_worker, [(func, arg) for arg in iterable])
     else:
-        newshape = (newshape,) + shape[-2:]
-    a = a.reshape(newshape)
-    return shape, a    
+        return [func(arg) for arg in iterable]
+
+#: cached fft plans, see :func:`_get_plan`            
+_plans = {}
+
+def clear_plans():
+    """Clears all cached fft plans."""
+    _plans.clear()
+    _fftw_plans.clear()
 
-def __mkl_fft(fft,a,out):
+def _get_plan(shape, dtype, direction, libname, nthreads):
+    """Returns a cached transform plan for a given array shape, dtype, transform 
+    direction, fft library and number of threads. 
+    
+    The plan is a tuple of a 2D transform function and the shape of the 
+    reshaped input array. The input array is reshaped to (n, m, ny, nx) so
+    that the n workers each compute m 2D transforms, or to (m, ny, nx) for
+    single-threaded transform.
+    """
+    key = (shape, dtype, direction, libname, nthreads)
+    try:
+        return _plans[key]
+    except KeyError:
+        pass
+    if libname == "mkl_fft":
+        fft = mkl_fft.fft2 if direction == +1 else mkl_fft.ifft2
+    else:
+        fft = spfft.fft2 if direction == +1 else spfft.ifft2
+    size = reduce((lambda x,y: x*y), shape[:-2] or [1])
+    if nthreads > 1:
+        n = _optimal_workers(size,nthreads)
+        newshape = (n,size//n,) + shape[-2:]
+    else:
+        newshape = (size,) + shape[-2:]
+    plan = fft, newshape
+    _plans[key] = plan
+    return plan
+
+def __mkl_fft(direction,a,out):
     out = _set_out_mkl(a,out)
-    shape, out = _reshape(out)
-    if DTMMConfig.nthreads > 1:
-        pool = ThreadPool(DTMMConfig.nthreads)
+    nthreads = 1 if in_pool_worker() else DTMMConfig.nthreads
+    fft, newshape = _get_plan(a.shape, a.dtype, direction, "mkl_fft", nthreads)
+    shape, out = out.shape, out.reshape(newshape)
+    if nthreads > 1:
+        pool = get_pool()
         workers = [pool.apply_async(_sequential_inplace_fft, args = (fft,d)) for d in out] 
         results = [w.get() for w in workers]
-        pool.close()
     else:
         _sequential_inplace_fft(fft,out)
     return out.reshape(shape)    
 
 def _mkl_fft2(a,out = None):
-    return __mkl_fft(mkl_fft.fft2,a,out)
+    return __mkl_fft(+1,a,out)
 
 def _mkl_ifft2(a,out = None):
-    return __mkl_fft(mkl_fft.ifft2,a,out)
+    return __mkl_fft(-1,a,out)
 
 
-def __sp_fft(fft,a,out, overwrite_x = False):
+def __sp_fft(direction,a,out, overwrite_x = False):
     out = _set_out(a,out)
-    shape, a = _reshape(a)
-    shape, out = _reshape(out)
-    if DTMMConfig.nthreads > 1:
-        pool = ThreadPool(DTMMConfig.nthreads)
+    nthreads = 1 if in_pool_worker() else DTMMConfig.nthreads
+    fft, newshape = _get_plan(a.shape, a.dtype, direction, "scipy", nthreads)
+    shape, a, out = a.shape, a.reshape(newshape), out.reshape(newshape)
+    if nthreads > 1:
+        pool = get_pool()
         workers = [pool.apply_async(_sequential_fft, args = (fft,d,out[i],overwrite_x)) for i,d in enumerate(a)] 
         results = [w.get() for w in workers]
-        pool.close()
     else:
         _sequential_fft(fft,a,out,overwrite_x)
     return out.reshape(shape)   
@@ -118,10 +228,209 @@ def __sp_fft(fft,a,out, overwrite_x = False):
 #        return out
         
 def _sp_fft2(a, out = None):
-    return __sp_fft(spfft.fft2, a, out)
+    return __sp_fft(+1, a, out)
     
 def _sp_ifft2(a, out = None):
-    return __sp_fft(spfft.ifft2, a, out)        
+    return __sp_fft(-1, a, out)        
+
+def _same_buffer(x,y):
+    """Checks whether x and y are views of the same memory block."""
+    return x.__array_interface__["data"][0] == y.__array_interface__["data"][0] \
+        and x.strides == y.strides
+    
+def __scfft(fft,a,out):
+    if out is a:
+        result = fft(a, axes = (-2,-1), overwrite_x = True, workers = DTMMConfig.nthreads)
+        if not _same_buffer(result, out):
+            out[...] = result
+        return out
+    else:
+        result = fft(a, axes = (-2,-1), workers = DTMMConfig.nthreads)
+        if out is None:
+            return result
+        else:
+            out[...] = result
+            return out
+    
+def _scfft_fft2(a, out = None):
+    return __scfft(scfft.fft2, a, out)
+    
+def _scfft_ifft2(a, out = None):
+    return __scfft(scfft.ifft2, a, out)    
+
+#: cached FFTW objects, see :func:`_get_fftw_plan`
+_fftw_plans = {}
+_fftw_lock = threading.Lock()
+_fftw_wisdom_loaded = False
+
+#: FFTW planner effort used when creating new plans
+FFTW_PLANNER = "FFTW_MEASURE"
+
+def load_fftw_wisdom(fname = None):
+    """Imports FFTW wisdom from a file. By default, wisdom is read from 
+    the dtmm configuration directory.
+    
+    Parameters
+    ----------
+    fname : str, optional
+        Filename of the pickled wisdom. 
+        
+    Returns
+    -------
+    success : bool
+        Whether the wisdom was imported.
+    """
+    fname = FFTW_WISDOM_FILE if fname is None else fname
+    if not fname or not os.path.exists(fname):
+        return False
+    try:
+        with open(fname, "rb") as f:
+            wisdom = pickle.load(f)
+        pyfftw.import_wisdom(wisdom)
+        return True
+    except Exception:
+        warnings.warn("Could not load FFTW wisdom from {}.".format(fname))
+        return False
+
+@atexit.register
+def save_fftw_wisdom(fname = None):
+    """Exports FFTW wisdom to a file. By default, wisdom is written to 
+    the dtmm configuration directory. This is called automatically at exit.
+    
+    Parameters
+    ----------
+    fname : str, optional
+        Filename of the pickled wisdom. 
+    """
+    if not PYFFTW_INSTALLED or (fname is None and not _fftw_plans):
+        #nothing was planned in this session, no need to update the file
+        return
+    fname = FFTW_WISDOM_FILE if fname is None else fname
+    if not fname:
+        return
+    try:
+        with open(fname, "wb") as f:
+            pickle.dump(pyfftw.export_wisdom(), f)
+    except Exception:
+        warnings.warn("Could not save FFTW wisdom to {}.".format(fname))
+
+def _get_fftw_plan(shape, dtype, axes, direction, inplace, nthreads):
+    """Returns a cached FFTW object and a lock for a given array shape, dtype, 
+    transform axes, transform direction, inplaceness and number of threads.
+    
+    The FFTW object owns SIMD-aligned input and output arrays (the same array 
+    for inplace plans), which are used when user arrays are not aligned.
+    """
+    global _fftw_wisdom_loaded
+    key = (shape, dtype, axes, direction, inplace, nthreads)
+    try:
+        return _fftw_plans[key]
+    except KeyError:
+        pass
+    with _fftw_lock:
+        if not _fftw_wisdom_loaded:
+            load_fftw_wisdom()
+            _fftw_wisdom_loaded = True
+        a = pyfftw.empty_aligned(shape, dtype)
+        b = a if inplace else pyfftw.empty_aligned(shape, dtype)
+        fftw_direction = "FFTW_FORWARD" if direction == +1 else "FFTW_BACKWARD"
+        fftw = pyfftw.FFTW(a, b, axes = axes, direction = fftw_direction, 
+                           flags = (FFTW_PLANNER,), threads = nthreads)
+        plan = fftw, threading.Lock()
+        _fftw_plans[key] = plan
+        return plan
+
+def _get_fftw_rplan(shape, dtype, direction, nthreads):
+    """Returns a cached real-to-complex (direction = +1) or complex-to-real
+    (direction = -1) FFTW object and a lock for a given real array shape and 
+    complex dtype. The transform is over the last two axes.
+    """
+    global _fftw_wisdom_loaded
+    key = (shape, dtype, "real", direction, nthreads)
+    try:
+        return _fftw_plans[key]
+    except KeyError:
+        pass
+    with _fftw_lock:
+        if not _fftw_wisdom_loaded:
+            load_fftw_wisdom()
+            _fftw_wisdom_loaded = True
+        rdtype = np.empty((),dtype).real.dtype
+        r = pyfftw.empty_aligned(shape, rdtype)
+        c = pyfftw.empty_aligned(shape[:-1] + (shape[-1]//2+1,), dtype)
+        if direction == +1:
+            fftw = pyfftw.FFTW(r, c, axes = (-2,-1), direction = "FFTW_FORWARD", 
+                               flags = (FFTW_PLANNER,), threads = nthreads)
+        else:
+            fftw = pyfftw.FFTW(c, r, axes = (-2,-1), direction = "FFTW_BACKWARD", 
+                               flags = (FFTW_PLANNER,), threads = nthreads)
+        plan = fftw, threading.Lock()
+        _fftw_plans[key] = plan
+        return plan
+
+def _is_fftw_compatible(x, dtype):
+    return x.dtype == dtype and x.flags["C_CONTIGUOUS"] and \
+            pyfftw.is_byte_aligned(x, pyfftw.simd_alignment)
+
+def __fftw(direction, a, out, axes = (-2,-1)):
+    a = np.asarray(a)
+    dtype = np.result_type(a.dtype, np.complex64)
+    inplace = out is a
+    if inplace and a.dtype != dtype:
+        raise ValueError("Inplace transform requires a complex array.")
+    fftw, lock = _get_fftw_plan(a.shape, dtype, axes, direction, inplace, DTMMConfig.nthreads)
+    with lock:
+        if out is not None and _is_fftw_compatible(a, dtype) and _is_fftw_compatible(out, dtype):
+            #aligned user arrays, transform directly
+            input_array, output_array = fftw.input_array, fftw.output_array
+            fftw.update_arrays(a, out)
+            try:
+                fftw.execute()
+            finally:
+                fftw.update_arrays(input_array, output_array)
+        else:
+            fftw.input_array[...] = a
+            fftw.execute()
+            if out is None:
+                out = fftw.output_array.copy()
+            else:
+                out[...] = fftw.output_array
+    if direction == -1:
+        out *= 1./fftw.N
+    return out
+
+def _fftw_fft2(a, out = None):
+    return __fftw(+1, a, out)
+
+def _fftw_ifft2(a, out = None):
+    return __fftw(-1, a, out)
+
+def _fftw_rfft2(a, out = None):
+    fftw, lock = _get_fftw_rplan(a.shape, conf.CDTYPE, +1, DTMMConfig.nthreads)
+    with lock:
+        fftw.input_array[...] = a
+        fftw.execute()
+        if out is None:
+            out = fftw.output_array.copy()
+        else:
+            out[...] = fftw.output_array
+    return out
+
+def _fftw_irfft2(a, s, out = None):
+    fftw, lock = _get_fftw_rplan(a.shape[:-2] + s, conf.CDTYPE, -1, DTMMConfig.nthreads)
+    with lock:
+        #c2r transforms destroy input, so we always copy to the internal array
+        fftw.input_array[...] = a
+        fftw.execute()
+        if out is None:
+            out = fftw.output_array.copy()
+        else:
+            out[...] = fftw.output_array
+    out *= 1./fftw.N
+    return out
+
+def _fftw_overwrite(a, overwrite_x):
+    return a if overwrite_x and np.iscomplexobj(a) else None
 
 def __np_fft(fft,a,out):
     if out is None:
@@ -152,10 +461,14 @@ def fft2(a, out = None):
     out : complex ndarray
         Result of the transformation along the last two axes.
     """
-    a = np.asarray(a, dtype = CDTYPE)
+    a = np.asarray(a, dtype = conf.CDTYPE)
     libname = DTMMConfig["fftlib"]
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return _fftw_fft2(a, out)
+    elif libname == "mkl_fft":
         return _mkl_fft2(a, out)
+    elif libname == "scipy.fft":
+        return _scfft_fft2(a, out)
     elif libname == "scipy":
         return _sp_fft2(a, out)
     elif libname == "numpy":
@@ -179,11 +492,14 @@ def ifft2(a, out = None):
     out : complex ndarray
         Result of the transformation along the last two axes.
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return _fftw_ifft2(a, out)
+    elif libname == "mkl_fft":
         return _mkl_ifft2(a, out)
-    
+    elif libname == "scipy.fft":
+        return _scfft_ifft2(a, out)
     elif libname == "scipy":
         return _sp_ifft2(a, out)
     elif libname == "numpy":
@@ -191,6 +507,76 @@ def ifft2(a, out = None):
     else: #default implementation is numpy
         return _np_ifft2(a, out)   
 
+def __set_rout(result, out):
+    if out is None:
+        return result
+    else:
+        out[...] = result
+        return out
+
+def _rfft_shape(a, s):
+    if s is None:
+        return a.shape[-2], 2*(a.shape[-1]-1)
+    ny, nx = s
+    if ny != a.shape[-2] or nx//2 + 1 != a.shape[-1]:
+        raise ValueError("Shape `s` does not match the shape of the input array.")
+    return ny, nx
+
+def rfft2(a, out = None):
+    """Computes fft2 of the input real array.
+    
+    Only the non-negative frequency half of the last axis is returned, so the
+    output array is of shape (..., ny, nx//2+1). This is identical to 
+    np.fft.rfft2(a).
+    
+    Parameters
+    ----------
+    a : array_like
+        Input array (must be real).
+    out : array or None, optional
+        Complex output array of shape (..., ny, nx//2+1).
+       
+    Returns
+    -------
+    out : complex ndarray
+        Result of the transformation along the last two axes.
+    """
+    a = np.asarray(a, dtype = conf.FDTYPE)
+    libname = DTMMConfig["fftlib"]
+    if libname == "pyfftw":
+        return _fftw_rfft2(a, out)
+    elif libname == "scipy.fft":
+        return __set_rout(scfft.rfft2(a, axes = (-2,-1), workers = DTMMConfig.nthreads), out)
+    else: #mkl_fft and scipy.fftpack have no (or incompatible) rfft2, use numpy
+        return __set_rout(np.asarray(npfft.rfft2(a), conf.CDTYPE), out)
+
+def irfft2(a, s = None, out = None):
+    """Computes inverse of :func:`rfft2`.
+    
+    Parameters
+    ----------
+    a : array_like
+        Input half-spectrum array of shape (..., ny, nx//2+1).
+    s : (int,int), optional
+        Shape (ny, nx) of the output real array. By default, an even nx is 
+        assumed, as in np.fft.irfft2. 
+    out : array or None, optional
+        Real output array of shape (..., ny, nx).
+       
+    Returns
+    -------
+    out : real ndarray
+        Result of the transformation along the last two axes.
+    """
+    a = np.asarray(a, dtype = conf.CDTYPE)
+    s = _rfft_shape(a, s)
+    libname = DTMMConfig["fftlib"]
+    if libname == "pyfftw":
+        return _fftw_irfft2(a, s, out)
+    elif libname == "scipy.fft":
+        return __set_rout(scfft.irfft2(a, s = s, axes = (-2,-1), workers = DTMMConfig.nthreads), out)
+    else: #mkl_fft and scipy.fftpack have no (or incompatible) irfft2, use numpy
+        return __set_rout(np.asarray(npfft.irfft2(a, s = s), conf.FDTYPE), out)
   
 def mfft2(a, overwrite_x = False):
     """Computes matrix fft2 on a matrix of shape (..., n,n,4,4).
@@ -209,10 +595,14 @@ def mfft2(a, overwrite_x = False):
     out : complex ndarray
         Result of the transformation along the (-4,-3) axes.    
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]    
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return __fftw(+1, a, _fftw_overwrite(a, overwrite_x), axes = (-4,-3))
+    elif libname == "mkl_fft":
         return mkl_fft.fft2(a, axes = (-4,-3), overwrite_x = overwrite_x)
+    elif libname == "scipy.fft":
+        return scfft.fft2(a, axes = (-4,-3), overwrite_x = overwrite_x, workers = DTMMConfig.nthreads)
     elif libname == "scipy":
         return spfft.fft2(a, axes = (-4,-3), overwrite_x = overwrite_x)
     elif libname == "numpy":
@@ -237,10 +627,14 @@ def mifft2(a, overwrite_x = False):
     out : complex ndarray
         Result of the transformation along the (-4,-3) axes.    
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]    
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return __fftw(-1, a, _fftw_overwrite(a, overwrite_x), axes = (-4,-3))
+    elif libname == "mkl_fft":
         return mkl_fft.ifft2(a, axes = (-4,-3), overwrite_x = overwrite_x)
+    elif libname == "scipy.fft":
+        return scfft.ifft2(a, axes = (-4,-3), overwrite_x = overwrite_x, workers = DTMMConfig.nthreads)
     elif libname == "scipy":
         return spfft.ifft2(a, axes = (-4,-3), overwrite_x = overwrite_x)
     elif libname == "numpy":
@@ -265,10 +659,14 @@ def mfft(a, overwrite_x = False):
     out : complex ndarray
         Result of the transformation along the (-4,-3) axes.    
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]    
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return __fftw(+1, a, _fftw_overwrite(a, overwrite_x), axes = (-3,))
+    elif libname == "mkl_fft":
         return mkl_fft.fft(a, axis = -3, overwrite_x = overwrite_x)
+    elif libname == "scipy.fft":
+        return scfft.fft(a, axis = -3, overwrite_x = overwrite_x, workers = DTMMConfig.nthreads)
     elif libname == "scipy":
         return spfft.fft(a, axis = -3, overwrite_x = overwrite_x)
     elif libname == "numpy":
@@ -293,10 +691,14 @@ def fft(a, overwrite_x = False):
     out : complex ndarray
         Result of the transformation along the (-4,-3) axes.    
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]    
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return __fftw(+1, a, _fftw_overwrite(a, overwrite_x), axes = (-1,))
+    elif libname == "mkl_fft":
         return mkl_fft.fft(a, overwrite_x = overwrite_x)
+    elif libname == "scipy.fft":
+        return scfft.fft(a, overwrite_x = overwrite_x, workers = DTMMConfig.nthreads)
     elif libname == "scipy":
         return spfft.fft(a,  overwrite_x = overwrite_x)
     elif libname == "numpy":
@@ -321,10 +723,14 @@ def ifft(a, overwrite_x = False):
     out : complex ndarray
         Result of the transformation along the (-4,-3) axes.    
     """
-    a = np.asarray(a, dtype = CDTYPE)      
+    a = np.asarray(a, dtype = conf.CDTYPE)      
     libname = DTMMConfig["fftlib"]    
-    if libname == "mkl_fft":
+    if libname == "pyfftw":
+        return __fftw(-1, a, _fftw_overwrite(a, overwrite_x), axes = (-1,))
+    elif libname == "mkl_fft":
         return mkl_fft.ifft(a, overwrite_x = overwrite_x)
+    elif libname == "scipy.fft":
+        return scfft.ifft(a, overwrite_x = overwrite_x, workers = DTMMConfig.nthreads)
     elif libname == "scipy":
         return spfft.ifft(a,  overwrite_x = overwrite_x)
     elif libname == "numpy":
@@ -6,7 +6,8 @@ from __future__ import absolute_import, print_function, division
 
 import numpy as np
 
-from dtmm.conf import NCDTYPE,NFDTYPE, FDTYPE, CDTYPE, NUMBA_PARALLEL, NUMBA_TARGET, NUMBA_CACHE, BETAMAX , DTMMConfig, get_default_config_option
+from dtmm.conf import NCDTYPE,NFDTYPE, NC64DTYPE, NF64DTYPE, NUMBA_PARALLEL, NUMBA_TARGET, NUMBA_CACHE, BETAMAX , DTMMConfig, get_default_config_option, cached_function, numba_signatures
+import dtmm.conf as conf
 from dtmm.wave import planewave, betaphi, wave2eigenwave
 from dtmm.diffract import diffracted_field, diffraction_alphaf
 from dtmm.window import aperture
@@ -17,6 +18,7 @@ from dtmm.tmm import alphaf ,fvec2E, E2fvec
 from dtmm.tmm import fvec as field4
 from dtmm.data import refind2eps
 from dtmm.jones import jonesvec
+from dtmm.linalg import dotmf, dotmv
 
 import numba as nb
 from numba import prange
@@ -260,17 +262,17 @@ def modes2ffield(mask, modes, out = None):
 
     shape = mask.shape[-2:]
     if mask.ndim == 2:
-        shape = modes.shape[:-2] + (4,) + shape
+        shape = modes.shape[:-2] + modes.shape[-1:] + shape
         if out is None:
-            out = np.zeros(shape =shape, dtype = CDTYPE )
+            out = np.zeros(shape =shape, dtype = conf.CDTYPE )
         else:
             out[...] = 0.
         modes = np.moveaxis(modes,-1,-2)
         out[...,mask] = modes
     else:
-        shape = modes[0].shape[:-2] + (len(mask),4,) + shape
+        shape = modes[0].shape[:-2] + (len(mask),) + modes[0].shape[-1:] + shape
         if out is None:
-            out = np.zeros(shape =shape, dtype = CDTYPE )
+            out = np.zeros(shape =shape, dtype = conf.CDTYPE )
         else:
             out[...] = 0.
         for i,(mode, m) in enumerate(zip(modes,mask)):
@@ -282,6 +284,56 @@ def modes2ffield(mask, modes, out = None):
        
     return out
 
+@cached_function
+def mat2modes(mat, mask, out = None):
+    """Takes an array of (...,:,:,n,n) matrices of all Fourier modes and returns
+    the (...,nmodes,n,n) array of matrices of the modes selected by the mask. 
+    
+    The returned matrices act on the modes array, as returned by ffield2modes
+    with a single-wavelength mask. Use :func:`.linalg.dotmv` to apply them.
+    
+    Parameters
+    ----------
+    mat : ndarray
+        Matrix array, e.g. a diffraction matrix.
+    mask : ndarray
+        A 2D mask array, as returned by ffield2modes.
+    """
+    mat = np.asarray(mat)
+    shape = mat.shape[:-4] + mask.shape + mat.shape[-2:]
+    mat = np.broadcast_to(mat, shape)
+    if out is None:
+        return np.ascontiguousarray(mat[...,mask,:,:])
+    else:
+        out[...] = mat[...,mask,:,:]
+        return out
+
+def _dotmf(mat, fft_field, mask = None, out = None):
+    """Applies a Fourier space matrix to the fft field, or to the packed modes
+    if mask is given."""
+    if mask is None:
+        return dotmf(mat, fft_field, out = out)
+    else:
+        return dotmv(mat2modes(mat, mask), fft_field, out = out)
+
+def _unpack(fft_field, mask = None, out = None):
+    """Returns fft field from the packed modes if mask is given."""
+    if mask is None:
+        return fft_field
+    if out is None:
+        out = np.empty(fft_field.shape[:-2] + fft_field.shape[-1:] + mask.shape, fft_field.dtype)
+    return modes2ffield(mask, fft_field, out = out)
+
+def _pack(fft_field, mask = None, out = None):
+    """Packs fft field to modes if mask is given."""
+    if mask is None:
+        return fft_field
+    modes = np.moveaxis(fft_field[...,mask],-2,-1)
+    if out is None:
+        return modes
+    out[...] = modes
+    return out
+
 def modes2field(mask, modes, out = None):
     """Inverse of field2modes. Takes the output of field2modes and recunstructs
     the field array.
@@ -313,14 +365,14 @@ def modes2field1(mask, modes):
     shape = mask.shape[-1:]
     if mask.ndim == 1:
         shape = modes.shape[:-2] + (4,) + shape
-        out = np.zeros(shape =shape, dtype = CDTYPE )
+        out = np.zeros(shape =shape, dtype = conf.CDTYPE )
 
         modes = np.moveaxis(modes,-1,-2)
         out[...,mask] = modes
         return ifft(out, overwrite_x = True)
     else:
-        shape = modes[0].shape[:-2] + (len(mask),4,) + shape
-        out = np.zeros(shape =shape, dtype = CDTYPE )
+        shape = modes[0].shape[:-2] + (len(mask),) + modes[0].shape[-1:] + shape
+        out = np.zeros(shape =shape, dtype = conf.CDTYPE )
 
         for i,(mode, m) in enumerate(zip(modes,mask)):
             mode = np.moveaxis(mode,-1,-2)
@@ -343,7 +395,7 @@ def aperture2rays(diaphragm, betastep = 0.1, norm = True):
     intensity = diaphragm[mask]
     if norm == True:
         intensity = intensity/ intensity.sum() * len(intensity)
-    return np.asarray(beta[mask],FDTYPE), np.asarray(phi[mask],FDTYPE), np.asarray(intensity,FDTYPE)
+    return np.asarray(beta[mask],conf.FDTYPE), np.asarray(phi[mask],conf.FDTYPE), np.asarray(intensity,conf.FDTYPE)
 
 def illumination_aperture(diameter = 5., smooth = 0.1):
     n = int(round(diameter))
@@ -430,7 +482,7 @@ def illumination_eigenrays(shape, k0, NA = 0.2, scale = (1,1)):
 #    phi = np.arctan2(yy,xx)
 #    beta = np.sqrt(xx**2 + yy**2)/radius*NA
 #    mask = (beta <= NA)
-#    return np.asarray(beta[mask],FDTYPE), np.asarray(phi[mask],FDTYPE)
+#    return np.asarray(beta[mask],conf.FDTYPE), np.asarray(phi[mask],conf.FDTYPE)
 
 def illumination_waves(shape, k0, beta = 0., phi = 0., window = None, out = None):
     """Builds scalar illumination wave. 
@@ -492,10 +544,10 @@ def waves2field(waves, k0, beta = 0., phi = 0., n = 1., focus = 0.,
     
         
     if jones is None:
-        fieldv = np.zeros(beta.shape + (2,) + k0.shape + (4,) + waves.shape[-2:], dtype = CDTYPE)
+        fieldv = np.zeros(beta.shape + (2,) + k0.shape + (4,) + waves.shape[-2:], dtype = conf.CDTYPE)
     else:
         c,s = jones
-        fieldv = np.zeros(beta.shape + k0.shape + (4,) + waves.shape[-2:], dtype = CDTYPE)
+        fieldv = np.zeros(beta.shape + k0.shape + (4,) + waves.shape[-2:], dtype = conf.CDTYPE)
     
     if beta.ndim == 1: 
         for i,data in enumerate(fieldv):
@@ -630,9 +682,9 @@ def illumination_data(shape, wavelengths, pixelsize = 1., beta = 0., phi = 0., i
     #intensity = ((np.abs(waves)**2).sum((-2,-1)))* np.asarray(intensity)[...,None]#sum over pixels
     #intensity = intensity * intensity
     mode = -1 if backdir else +1
-    _beta = np.asarray(beta, FDTYPE)
-    _phi = np.asarray(phi, FDTYPE)
-    _intensity = np.asarray(intensity, FDTYPE)
+    _beta = np.asarray(beta, conf.FDTYPE)
+    _phi = np.asarray(phi, conf.FDTYPE)
+    _intensity = np.asarray(intensity, conf.FDTYPE)
 
     nrays = len(_beta) if _beta.ndim > 0 else 1
     
@@ -672,7 +724,7 @@ def illumination_data(shape, wavelengths, pixelsize = 1., beta = 0., phi = 0., i
         phi = _phi[...,None,None] 
     intensity = _intensity[...,None,None,None,None]   
     
-    epsa = np.asarray((0.,0.,0.),FDTYPE)
+    epsa = np.asarray((0.,0.,0.),conf.FDTYPE)
     alpha, fmat = alphaf(beta, phi, refind2eps([n]*3), epsa)
     field = waves2field2(waves, fmat, jones = jones, phi = phi, mode = mode)
     intensity1 = field2intensity(field)
@@ -744,7 +796,10 @@ def illumination_data(shape, wavelengths, pixelsize = 1., beta = 0., phi = 0., i
 #    return (field, wavelengths, pixelsize)
 
 
-@nb.njit([(NCDTYPE[:,:,:],NFDTYPE[:,:])], cache = NUMBA_CACHE)
+#: intensity of a single precision field in double precision (mixed precision)
+_MIXED_INTENSITY_DECL = [(NC64DTYPE[:,:,:],NF64DTYPE[:,:])]
+
+@nb.njit(numba_signatures([(NCDTYPE[:,:,:],NFDTYPE[:,:])]) + _MIXED_INTENSITY_DECL, cache = NUMBA_CACHE)
 def _field2intensity(field, out):
     for j in range(field.shape[1]):
         for k in range(field.shape[2]):
@@ -752,7 +807,7 @@ def _field2intensity(field, out):
             tmp2 = (field[2,j,k].real * field[3,j,k].real + field[2,j,k].imag * field[3,j,k].imag)
             out[j,k] = tmp1-tmp2 
 
-@nb.guvectorize([(NCDTYPE[:,:,:],NFDTYPE[:,:])],"(k,n,m)->(n,m)", target = NUMBA_TARGET, cache = NUMBA_CACHE)
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:,:],NFDTYPE[:,:])]) + _MIXED_INTENSITY_DECL,"(k,n,m)->(n,m)", target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def field2intensity(field, out):
     """field2intensity(field)
     
@@ -774,7 +829,7 @@ spec : ndarray
     assert len(field) == 4
     _field2intensity(field, out)
 
-@nb.njit([(NCDTYPE[:,:,:,:],NFDTYPE[:,:,:])], parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE)
+@nb.njit(numba_signatures([(NCDTYPE[:,:,:,:],NFDTYPE[:,:,:])]), parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE)
 def _field2specter(field, out):     
     for j in prange(field.shape[2]):
         for i in range(field.shape[0]):
@@ -783,7 +838,7 @@ def _field2specter(field, out):
                 tmp2 = (field[i,2,j,k].real * field[i,3,j,k].real + field[i,2,j,k].imag * field[i,3,j,k].imag)
                 out[j,k,i] = tmp1-tmp2 
 
-@nb.njit([(NCDTYPE[:,:,:,:,:],NFDTYPE[:,:,:])], parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE)
+@nb.njit(numba_signatures([(NCDTYPE[:,:,:,:,:],NFDTYPE[:,:,:])]), parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE)
 def _field2spectersum(field, out):
     for n in prange(field.shape[0]):
         for j in range(field.shape[3]):
@@ -796,7 +851,7 @@ def _field2spectersum(field, out):
                     else:
                         out[j,k,i] += (tmp1 -tmp2)
 
-@nb.guvectorize([(NCDTYPE[:,:,:,:],NFDTYPE[:,:,:])],"(w,k,n,m)->(n,m,w)", target = "cpu", cache = NUMBA_CACHE)
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:,:,:],NFDTYPE[:,:,:])]),"(w,k,n,m)->(n,m,w)", target = "cpu", cache = NUMBA_CACHE)
 def field2specter(field, out):
     """field2specter(field)
     
@@ -817,12 +872,12 @@ spec : ndarray
     Computed specter array""" 
     _field2specter(field, out)
 
-@nb.guvectorize([(NCDTYPE[:,:,:,:,:],NFDTYPE[:,:,:])],"(l,w,k,n,m)->(n,m,w)", target = "cpu", cache = NUMBA_CACHE)
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:,:,:,:],NFDTYPE[:,:,:])]),"(l,w,k,n,m)->(n,m,w)", target = "cpu", cache = NUMBA_CACHE)
 def field2spectersum(field, out):
     _field2spectersum(field, out)  
     
     
-@nb.guvectorize([(NCDTYPE[:,:,:],NFDTYPE[:,:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:])], "(k,n,m),(n,m),(n,m)->(),()", target = NUMBA_TARGET, cache = NUMBA_CACHE)
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:,:],NFDTYPE[:,:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:])]), "(k,n,m),(n,m),(n,m)->(),()", target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def _fft_betaphi(f, betax, betay, beta, phi):
 
     _betax = 0.
@@ -865,8 +920,8 @@ def validate_field_data(data):
         Validated field data tuple. 
     """
     field, wavelengths, pixelsize = data
-    field = np.asarray(field, dtype = CDTYPE)
-    wavelengths = np.asarray(wavelengths, dtype = FDTYPE)
+    field = np.asarray(field, dtype = conf.CDTYPE)
+    wavelengths = np.asarray(wavelengths, dtype = conf.FDTYPE)
     pixelsize = float(pixelsize)
     if field.ndim < 4:
         raise ValueError("Invald field dimensions")
@@ -913,13 +968,63 @@ def save_field(file, field_data):
             f.close()
 
 
-def load_field(file):
+def memmap_field(file, shape, wavelengths, pixelsize, dtype = None):
+    """Creates a memory-mapped field data file in ``.dtmf`` format.
+    
+    The field array is allocated on disk and is filled as it is written to,
+    so it can be much larger than the available memory. Use it as the output
+    array of :func:`.transfer.transfer_field` with `ret_bulk = True` and 
+    open the file later with :func:`load_field` with `mmap_mode = "r"`.
+    
+    Parameters
+    ----------
+    file : str
+        Filename of the file. A ``.dtmf`` extension will be appended to the 
+        file name if it does not already have one.
+    shape : tuple of ints
+        Shape of the field array.
+    wavelengths : array_like
+        Wavelengths array.
+    pixelsize : float
+        Pixel size.
+    dtype : dtype, optional
+        Field data type. Defaults to the complex data type of the current 
+        precision, see :func:`.conf.set_precision`.
+    
+    Returns
+    -------
+    field_data : tuple
+        A (field, wavelengths, pixelsize) tuple, where field is a `np.memmap`.
+    """
+    if not file.endswith('.dtmf'):
+        file = file + '.dtmf'
+    dtype = np.dtype(conf.CDTYPE if dtype is None else dtype)
+    shape = tuple(shape)
+    wavelengths = np.asarray(wavelengths, dtype = conf.FDTYPE)
+    header = {"descr" : np.lib.format.dtype_to_descr(dtype), "fortran_order" : False, "shape" : shape}
+    with open(file, "wb") as f:
+        f.write(MAGIC)
+        f.write(VERSION)
+        np.lib.format.write_array_header_2_0(f, header)
+        offset = f.tell()
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        #allocate (sparse) field data block
+        f.seek(offset + nbytes)
+        np.save(f,wavelengths)
+        np.save(f,pixelsize)
+    field = np.memmap(file, dtype = dtype, mode = "r+", offset = offset, shape = shape)
+    return field, wavelengths, float(pixelsize)
+
+def load_field(file, mmap_mode = None):
     """Load field data from file
     
     Parameters
     ----------
     file : file, str
         The file or filenam to read.
+    mmap_mode : {None, 'r+', 'r', 'w+', 'c'}, optional
+        If not None, the field array is memory-mapped using the given mode 
+        (see `np.memmap`) and it is loaded lazily. File must be a filename.
     """
     own_fid = False
     try:
@@ -932,7 +1037,19 @@ def load_field(file):
         if magic == MAGIC:
             if f.read(1) != VERSION:
                 raise OSError("This file was created with a more recent version of dtmm. Please upgrade your dtmm package!")
-            field = np.load(f)
+            if mmap_mode is None:
+                field = np.load(f)
+            else:
+                if not own_fid:
+                    raise ValueError("Memory mapping requires a filename.")
+                if np.lib.format.read_magic(f) == (1,0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+                field = np.memmap(file, dtype = dtype, mode = mmap_mode, offset = offset, shape = shape,
+                                  order = "F" if fortran_order else "C")
+                f.seek(offset + field.nbytes)
             wavelengths = np.load(f)
             pixelsize = float(np.load(f))
             return field, wavelengths, pixelsize
@@ -943,4 +1060,4 @@ def load_field(file):
             f.close()
 field2poynting = field2intensity
     
-__all__ = ["illumination_rays","load_field", "save_field", "validate_field_data","field2specter","field2intensity", "illumination_data"]
\ No newline at end of file
+__all__ = ["illumination_rays","load_field", "save_field", "memmap_field", "validate_field_data","field2specter","field2intensity", "illumination_data"]
\ No newline at end of file
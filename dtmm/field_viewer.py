@@ -33,12 +33,13 @@ import scipy.ndimage as nd
 
 #from dtmm.project import projection_matrix, project
 from dtmm.color import load_tcmf, specter2color
-from dtmm.diffract import diffract, field_diffraction_matrix, E_cover_diffraction_matrix, E_diffraction_matrix, E_tr_matrix
+from dtmm.diffract import diffract, field_diffraction_matrix, compact_field_diffraction_matrix, E_cover_diffraction_matrix, E_diffraction_matrix, E_tr_matrix
 from dtmm.jones4 import ray_jonesmat4x4, mode_jonesmat4x4, mode_jonesmat2x2, ray_jonesmat2x2
 from dtmm.field import field2specter, field2jones, jones2field
 from dtmm.wave import k0
 from dtmm.data import refind2eps
-from dtmm.conf import BETAMAX, CDTYPE, get_default_config_option, DTMMConfig
+from dtmm.conf import BETAMAX, get_default_config_option, DTMMConfig
+import dtmm.conf as conf
 from dtmm.jones import jonesvec
 from dtmm import jones
 
@@ -122,7 +123,7 @@ def calculate_pom_field(field, jvec = None, pmat = None, dmat = None, window = N
         elif pmat is not None and dmat is None and input_fft == True:
             tmat = pmat
         else:
-            tmat = np.asarray(np.diag((1,1,1,1)), CDTYPE) 
+            tmat = np.asarray(np.diag((1,1,1,1)), conf.CDTYPE) 
             
         diffract(field,tmat,window = window, input_fft = input_fft, output_fft = output_fft, out = out)
     else:
@@ -438,7 +439,7 @@ def pom_viewer(field_data, cmf=None, n = None, immersion = None, n_cover = None,
     return viewer
 
 def _as_field_array(field, options):
-    field = np.asarray(field, CDTYPE)
+    field = np.asarray(field, conf.CDTYPE)
     shape = options.shape
     nk = len(options.wavenumbers)
     if field.ndim >= 4 and field.shape[-3] == 4 and field.shape[-2:] == shape and field.shape[-4] == nk:
@@ -447,7 +448,7 @@ def _as_field_array(field, options):
         raise ValueError("Invalid field data shape.")
         
 def _as_jones_array(field, options):
-    field = np.asarray(field, CDTYPE)
+    field = np.asarray(field, conf.CDTYPE)
     shape = options.shape
     nk = len(options.wavenumbers)
     if field.ndim >= 4 and field.shape[-3] == 2 and field.shape[-2:] == shape and field.shape[-4] == nk:
@@ -473,7 +474,7 @@ def _jonesmatrix_type(value):
             angle = _float_or_none(value)
             return angle, _jmat_from_angle(angle)
         except TypeError:
-            jmat = np.asarray(value,CDTYPE)
+            jmat = np.asarray(value,conf.CDTYPE)
             if jmat.shape != (2,2):
                 raise ValueError("Not a valid jones matrix")
             return jmat, jmat
@@ -490,7 +491,7 @@ def _jonesvector_type(value):
             angle = _float_or_none(value)
             return angle, _jvec_from_angle(angle)
         except TypeError:
-            jvec = np.asarray(value,CDTYPE)
+            jvec = np.asarray(value,conf.CDTYPE)
             if jvec.shape != (2,):
                 raise ValueError("Not a valid jones vector")
             return jvec, jvec
@@ -953,7 +954,7 @@ class FieldViewer(object):
                 #if mode is selected, we need to project the filed using diffraction
                 d = 0 if self.focus is None else self.focus
                 epsv = vp.epsv
-                self._dmat = field_diffraction_matrix(vp.shape, vp.wavenumbers, d = d, 
+                self._dmat = compact_field_diffraction_matrix(vp.shape, vp.wavenumbers, d = d, 
                                           epsv = epsv, mode = vp.propagation_mode, betamax = vp.betamax) 
             else:
                 self._dmat = None
@@ -1345,12 +1346,18 @@ class BulkViewer(FieldViewer):
     
     @property
     def masked_ffield(self):
-        """Fourier transform of the field"""
+        """Fourier transform of the field. Only the field at the focus position
+        is transformed, so the bulk data can be a lazily loaded memmap, see
+        :func:`.field.load_field`."""
+        if self._ffield is not None:
+            ffield = self._ffield[self.focus]
+        else:
+            ffield = fft2(self.field[self.focus])
         if self.aperture is not None:
             mask = self.viewer_options.beta <= self.aperture
-            return self.ffield[self.focus,mask]
+            return ffield[mask]
         else:
-            return self.ffield[self.focus]
+            return ffield
         
 class POMViewer(FieldViewer):
     """Similar to FieldViewer, with the following differences:
@@ -8,6 +8,11 @@ import binascii
 import hashlib
 import sys
 
+import numpy as np
+import numba as nb
+
+from dtmm.conf import NUMBA_CACHE
+
 
 hashers = []  # In decreasing performance order
 
@@ -66,6 +71,87 @@ else:
     hashers.append(_hash_murmurhash)
 
 
+#: MurmurHash3 (x64, 128-bit) constants
+_C1 = np.uint64(0x87c37b91114253d5)
+_C2 = np.uint64(0x4cf5ad432745937f)
+_F1 = np.uint64(0xff51afd7ed558ccd)
+_F2 = np.uint64(0xc4ceb9fe1a85ec53)
+_N1 = np.uint64(0x52dce729)
+_N2 = np.uint64(0x38495ab5)
+_U5 = np.uint64(5)
+_U64 = np.uint64(64)
+_U33 = np.uint64(33)
+
+@nb.njit([nb.uint64(nb.uint64, nb.uint64)], cache = NUMBA_CACHE)
+def _rotl(x, r):
+    return (x << r) | (x >> (_U64 - r))
+
+@nb.njit([nb.uint64(nb.uint64)], cache = NUMBA_CACHE)
+def _fmix(k):
+    k ^= k >> _U33
+    k *= _F1
+    k ^= k >> _U33
+    k *= _F2
+    k ^= k >> _U33
+    return k
+
+@nb.njit([nb.void(nb.types.Array(nb.uint64, 1, "C", readonly = True), nb.types.Array(nb.uint8, 1, "C", readonly = True), 
+                  nb.uint64, nb.uint64[::1])], cache = NUMBA_CACHE)
+def _murmurhash3(blocks, tail, n, out):
+    h1 = out[0]
+    h2 = out[1]
+    for i in range(len(blocks)//2):
+        k1 = blocks[2*i] * _C1
+        k1 = _rotl(k1, np.uint64(31)) * _C2
+        h1 ^= k1
+        h1 = _rotl(h1, np.uint64(27)) + h2
+        h1 = h1 * _U5 + _N1
+        k2 = blocks[2*i+1] * _C2
+        k2 = _rotl(k2, _U33) * _C1
+        h2 ^= k2
+        h2 = _rotl(h2, np.uint64(31)) + h1
+        h2 = h2 * _U5 + _N2
+    k1 = np.uint64(0)
+    k2 = np.uint64(0)
+    for j in range(len(tail)):
+        if j < 8:
+            k1 ^= np.uint64(tail[j]) << np.uint64(8*j)
+        else:
+            k2 ^= np.uint64(tail[j]) << np.uint64(8*(j-8))
+    if len(tail) > 8:
+        k2 = _rotl(k2 * _C2, _U33) * _C1
+        h2 ^= k2
+    if len(tail) > 0:
+        k1 = _rotl(k1 * _C1, np.uint64(31)) * _C2
+        h1 ^= k1
+    h1 ^= n
+    h2 ^= n
+    h1 += h2
+    h2 += h1
+    h1 = _fmix(h1)
+    h2 = _fmix(h2)
+    h1 += h2
+    h2 += h1
+    out[0] = h1
+    out[1] = h2
+
+def _hash_murmurhash_numba(buf):
+    """
+    Produce a 16-bytes hash of *buf* using a numba implementation of MurmurHash3.
+    """
+    try:
+        data = np.frombuffer(buf, np.uint8)
+    except ValueError:
+        #not a contiguous buffer
+        raise TypeError("unsupported buffer")
+    data.setflags(write = False)
+    n = len(data) // 16 * 16
+    out = np.zeros((2,), np.uint64)
+    _murmurhash3(data[:n].view(np.uint64), data[n:], np.uint64(len(data)), out)
+    return out.tobytes()
+
+hashers.append(_hash_murmurhash_numba)
+
 def _hash_sha1(buf):
     """
     Produce a 20-bytes hash of *buf* using SHA1.
@@ -32,7 +32,7 @@ Examples
 >>> i = jones_intensity(j_out) #intensity
 """
 
-from dtmm.conf import CDTYPE,FDTYPE
+import dtmm.conf as conf
 import numpy as np
 from dtmm.rotation import rotation_matrix2
 from dtmm.linalg import dotmv, dotmm, multi_dot
@@ -90,13 +90,13 @@ def jonesvec(pol, phi = 0., out = None):
     True
     
     """
-    pol = np.asarray(pol, CDTYPE)
+    pol = np.asarray(pol, conf.CDTYPE)
     phi = np.asarray(phi)
     if pol.shape[-1] != 2:
         raise ValueError("Invalid input shape")
     norm = (pol[...,0] * pol[...,0].conj() + pol[...,1] * pol[...,1].conj())**0.5
     pol = pol/norm[...,np.newaxis]
-    pol = np.asarray(pol, CDTYPE)
+    pol = np.asarray(pol, conf.CDTYPE)
     r = rotation_matrix2(-phi)
     return dotmv(r, pol, out)
 
@@ -114,7 +114,7 @@ def mirror(out = None):
     mat : ndarray
         Output jones matrix.      
     """
-    m = np.array(((1,0),(0,-1)), dtype = CDTYPE)
+    m = np.array(((1,0),(0,-1)), dtype = conf.CDTYPE)
     if out is not None:
         out[...,:,:] = m
         m = out
@@ -156,7 +156,7 @@ def retarder(phase, phi = 0., out = None):
     
     shape = m00.shape + (2,2)
     if out is None:
-        out = np.empty(shape = shape, dtype = CDTYPE)
+        out = np.empty(shape = shape, dtype = conf.CDTYPE)
     else:
         assert out.shape == shape 
     
@@ -240,7 +240,7 @@ def polarizer(jones, out = None):
     assert jones.shape[-1] == 2
     shape = jones.shape + (2,)
     if out is None:
-        out = np.empty(shape = shape, dtype = CDTYPE)
+        out = np.empty(shape = shape, dtype = conf.CDTYPE)
     else:
         assert out.shape == shape 
     c,s = jones[...,0], jones[...,1]
@@ -272,7 +272,7 @@ def linear_polarizer(angle, out = None):
     angle = np.asarray(angle)
     shape = angle.shape + (2,2)
     if out is None:
-        out = np.empty(shape = shape, dtype = FDTYPE)
+        out = np.empty(shape = shape, dtype = conf.FDTYPE)
     else:
         assert out.shape == shape 
     c = np.cos(angle)
@@ -307,7 +307,7 @@ def circular_polarizer(hand, out = None):
     hand = np.asarray(hand)*0.5
     shape = hand.shape + (2,2)
     if out is None:
-        out = np.empty(shape = shape, dtype = CDTYPE)
+        out = np.empty(shape = shape, dtype = conf.CDTYPE)
     else:
         assert out.shape == shape 
     out[...,0,0] = 0.5
@@ -336,7 +336,7 @@ def rotated_matrix(jmat, phi):
         Rotated jones matrix.
     
     """
-    r = np.asarray(rotation_matrix2(phi),CDTYPE)
+    r = np.asarray(rotation_matrix2(phi),conf.CDTYPE)
     jmat = np.asarray(jmat)
     rT = np.swapaxes(r,-1,-2)
     return multi_dot([rT,jmat,r])
@@ -19,7 +19,8 @@ Convenience functions
 """
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import cached_result, BETAMAX, FDTYPE, CDTYPE
+from dtmm.conf import cached_result, BETAMAX
+import dtmm.conf as conf
 from dtmm.wave import betaphi
 from dtmm.tmm import alphaf,normalize_f, E2H_mat
 from dtmm.linalg import  dotmf, inv, dotmm
@@ -102,7 +103,7 @@ def jonesmat4x4(jmat, fmat, out = None):
     m = dotmm(fmat,dotmm(pmat,fmati, out = out), out = out)
     return m
 
-@cached_result
+@cached_result(disk = True)
 def mode_jonesmat4x4(shape, k, jmat, epsv = (1.,1.,1.), 
                             epsa = (0.,0.,0.), betamax = BETAMAX):
     """Returns a mode polarizer for fft of the field data in the laboratory frame.
@@ -136,10 +137,10 @@ def mode_jonesmat4x4(shape, k, jmat, epsv = (1.,1.,1.),
     ray_jonesmat4x4 : for applying the jones matrix in the real space.
     jonesmat4x4 : for applying the jones matrix in the eigenframe.
     """
-    ks = np.asarray(k, FDTYPE)
+    ks = np.asarray(k, conf.FDTYPE)
     ks = abs(ks)
-    epsv = np.asarray(epsv, CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE)
     beta, phi = betaphi(shape,ks)
     alpha, f = diffraction_alphaf(shape, ks, epsv = epsv, 
                             epsa = epsa, betamax = betamax)
@@ -186,10 +187,10 @@ def mode_jonesmat2x2(shape, k, jmat, epsv = (1.,1.,1.),
     --------
     ray_jonesmat2x2 : for applying the jones matrix in the real space.
     """
-    ks = np.asarray(k, FDTYPE)
+    ks = np.asarray(k, conf.FDTYPE)
     ks = abs(ks)
-    epsv = np.asarray(epsv, CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE)
     beta, phi = betaphi(shape,ks)
     alpha, f = diffraction_alphaf(shape, ks, epsv = epsv, 
                             epsa = epsa, betamax = betamax)
@@ -233,10 +234,10 @@ def ray_jonesmat4x4(jmat, beta = 0, phi = 0, epsv = (1.,1.,1.),
     mode_jonesmat4x4 : for applying the jones matrix in the fft space.
     jonesmat4x4 : for applying the jones matrix in the eigenframe.
     """
-    epsv = np.asarray(epsv, CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE)
-    beta = np.asarray(beta, FDTYPE)
-    phi = np.asarray(phi, FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE)
+    beta = np.asarray(beta, conf.FDTYPE)
+    phi = np.asarray(phi, conf.FDTYPE)
     
     alpha, f = alphaf(beta, phi, epsv, epsa)
     
@@ -277,10 +278,10 @@ def ray_jonesmat2x2(jmat, beta = 0, phi = 0, epsv = (1.,1.,1.),
     mode_jonesmat2x2 : for applying the jones matrix in the fft space.
     jonesmat2x2 : for applying the jones matrix in the eigenframe.
     """
-    epsv = np.asarray(epsv, CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE)
-    beta = np.asarray(beta, FDTYPE)
-    phi = np.asarray(phi, FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE)
+    beta = np.asarray(beta, conf.FDTYPE)
+    phi = np.asarray(phi, conf.FDTYPE)
     
     alpha, f = alphaf(beta, phi, epsv, epsa)
     
@@ -3,15 +3,20 @@ Numba optimized linear algebra functions for 4x4 matrices and 2x2 matrices.
 """
 
 from __future__ import absolute_import, print_function, division
-from dtmm.conf import NCDTYPE, NFDTYPE, NUMBA_TARGET,NUMBA_PARALLEL, NUMBA_CACHE, NUMBA_FASTMATH, CDTYPE, FDTYPE
+from dtmm.conf import NCDTYPE, NFDTYPE, NU32DTYPE, NUMBA_TARGET,NUMBA_PARALLEL, NUMBA_CACHE, NUMBA_FASTMATH, U32DTYPE, numba_signatures
+import dtmm.conf as conf
+from dtmm.conf import DTMMConfig, _result_nbytes
+from dtmm.fft import pool_map
 from numba import njit, prange, guvectorize, boolean
+from functools import reduce
+import itertools
 import numpy as np
 
 if not NUMBA_PARALLEL:
     prange = range
     
 
-@njit([NFDTYPE(NFDTYPE[:]),NFDTYPE(NCDTYPE[:])], cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
+@njit(numba_signatures([NFDTYPE(NFDTYPE[:]),NFDTYPE(NCDTYPE[:])]), cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
 def _vecabs2(v):
     """Computes vec.(vec.conj)"""
     out = 0.
@@ -19,12 +24,12 @@ def _vecabs2(v):
         out = out + v[i].real**2 + v[i].imag**2
     return out
 
-@njit([NFDTYPE(NFDTYPE[:]),NCDTYPE(NCDTYPE[:])], cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
+@njit(numba_signatures([NFDTYPE(NFDTYPE[:]),NCDTYPE(NCDTYPE[:])]), cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
 def _vnorm2(v):
     """Computes vec.vec"""
     return v[0]*v[0] + v[1]*v[1] + v[2]*v[2]
 
-@njit([NFDTYPE[:](NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),NCDTYPE[:](NCDTYPE[:],NCDTYPE[:],NCDTYPE[:]), ], cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
+@njit(numba_signatures([NFDTYPE[:](NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),NCDTYPE[:](NCDTYPE[:],NCDTYPE[:],NCDTYPE[:]), ]), cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)        
 def _cross(v1,v2,v3):
     """performs vector cross product"""
     v30 = v1[1] * v2[2] - v1[2] * v2[1]
@@ -35,10 +40,10 @@ def _cross(v1,v2,v3):
     v3[2] = v32
     return v3
 
-_eigvec0_decl = [
+_eigvec0_decl = numba_signatures([
                  (NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),
                  (NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE[:],NCDTYPE[:],NCDTYPE[:],NCDTYPE[:])
-                 ]
+                 ])
 
 @njit(_eigvec0_decl, cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)            
 def _eigvec0(a00,a11,a22,a01,a02,a12,eval0,vec0, tmp1, tmp2, tmp3):
@@ -88,7 +93,7 @@ def _eigvec0(a00,a11,a22,a01,a02,a12,eval0,vec0, tmp1, tmp2, tmp3):
         
     vec0 *= norm
 
-@njit([(NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),(NCDTYPE[:],NCDTYPE[:],NCDTYPE[:])], cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH) 
+@njit(numba_signatures([(NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),(NCDTYPE[:],NCDTYPE[:],NCDTYPE[:])]), cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH) 
 def _orthogonal_basis(w,u,v):
     """build an orthogonal basis based on normalized input vector w"""
     if abs(w[0]) > abs(w[1]):
@@ -106,10 +111,10 @@ def _orthogonal_basis(w,u,v):
     _cross(w,u,v)
 
     
-_eigvec1_decl = [
+_eigvec1_decl = numba_signatures([
                  (NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE,NFDTYPE[:],NFDTYPE,NFDTYPE[:],NFDTYPE[:],NFDTYPE[:]),
                  (NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE,NCDTYPE[:],NCDTYPE,NCDTYPE[:],NCDTYPE[:],NCDTYPE[:])
-                 ]   
+                 ])   
 
 @njit(_eigvec1_decl, cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)            
 def _eigvec1(a00,a11,a22,a01,a02,a12,vec0,eval1, vec1, tmp1, tmp2):
@@ -168,7 +173,7 @@ def _eigvec1(a00,a11,a22,a01,a02,a12,vec0,eval1, vec1, tmp1, tmp2):
                 vec1[i] = m11* u[i] - m01 * v[i]   
  
     
-@njit([(NFDTYPE[:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:,:]),(NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath=NUMBA_FASTMATH)
+@njit(numba_signatures([(NFDTYPE[:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:,:]),(NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath=NUMBA_FASTMATH)
 def _sort_eigvec(eps,r, epsout, rout):
     """Eigen modes sorting based on eigenvalues. Finds extraordinary axis,
     performs cyclic permutation of axes to move the extraordinary axis to 3"""
@@ -219,7 +224,7 @@ def _sort_eigvec(eps,r, epsout, rout):
     epsout[2] = eps2
         
     
-_EIG_DECL = [(NFDTYPE[:,:],boolean[:],NFDTYPE[:],NFDTYPE[:,:]), (NCDTYPE[:,:],boolean[:],NCDTYPE[:], NCDTYPE[:,:])]         
+_EIG_DECL = numba_signatures([(NFDTYPE[:,:],boolean[:],NFDTYPE[:],NFDTYPE[:,:]), (NCDTYPE[:,:],boolean[:],NCDTYPE[:], NCDTYPE[:,:])])         
 
 @guvectorize(_EIG_DECL, '(m,m),()->(m),(m,m)', target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)   
 def _tensor_eig(tensor, is_real, eig,vec):
@@ -319,7 +324,7 @@ def _tensor_eig(tensor, is_real, eig,vec):
         
         _sort_eigvec(eig,vec,eig,vec)
 
-_EIG_DECL = [(NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:,:]), (NCDTYPE[:,:],NCDTYPE[:], NCDTYPE[:,:])]         
+_EIG_DECL = numba_signatures([(NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:,:]), (NCDTYPE[:,:],NCDTYPE[:], NCDTYPE[:,:])])         
 
 
 @guvectorize(_EIG_DECL, '(m,m)->(m),(m,m)', target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)   
@@ -421,7 +426,7 @@ def tensor_eig(tensor, overwrite_x = False):
     return eig, np.swapaxes(vec, -1,-2) #as returned by np.linalg.eig, eigenvectors are in columns, not rows
     
 
-@njit([(NCDTYPE[:, :], NCDTYPE[:, :])], cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:, :], NCDTYPE[:, :])]), cache=NUMBA_CACHE, fastmath=NUMBA_FASTMATH)
 def _inv2x2(src, dst):
     """
 
@@ -453,7 +458,7 @@ def _inv2x2(src, dst):
     dst[1, 0] = -c * det
     dst[1, 1] =  a * det
 
-@njit([NCDTYPE[:,:](NCDTYPE[:,:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([NCDTYPE[:,:](NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _inv4x4(src,dst):
     
     #calculate pairs for first 8 elements (cofactors)
@@ -515,7 +520,7 @@ def _inv4x4(src,dst):
     return dst
 
 
-@guvectorize([(NCDTYPE[:,:], NCDTYPE[:,:])], '(n,n)->(n,n)', target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:], NCDTYPE[:,:])]), '(n,n)->(n,n)', target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def inv(mat, out):
     """inv(mat), gufunc
     
@@ -547,7 +552,7 @@ def inv(mat, out):
         out[...] = inv
 
 
-@njit([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotmm4(a,b,out):
     a0 = a[0,0]*b[0,0]+a[0,1]*b[1,0]+a[0,2]*b[2,0]+a[0,3]*b[3,0]
     a1 = a[0,0]*b[0,1]+a[0,1]*b[1,1]+a[0,2]*b[2,1]+a[0,3]*b[3,1]
@@ -589,7 +594,7 @@ def _dotmm4(a,b,out):
     out[3,2] = d2
     out[3,3] = d3 
     
-@njit([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotmm2(a,b,out):
     a0 = a[0,0]*b[0,0]+a[0,1]*b[1,0]
     a1 = a[0,0]*b[0,1]+a[0,1]*b[1,1]
@@ -603,7 +608,7 @@ def _dotmm2(a,b,out):
     out[1,0] = b0
     out[1,1] = b1
  
-@njit([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotmm(a,b,out):
     tmp = np.zeros_like(out)
     for i in range(a.shape[0]):
@@ -615,7 +620,7 @@ def _dotmm(a,b,out):
     out[...] = tmp
 
 
-@njit([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotmv(a,b,out):
     tmp = np.zeros_like(out)
     for i in range(a.shape[0]):
@@ -667,7 +672,7 @@ def _dotmv(a,b,out):
 #    out[3,3] = d3 
 #    
     
-@njit([(NFDTYPE[:],NCDTYPE[:,:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NFDTYPE[:],NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotr2m(r,a,out):
     a0 = a[0,0]*r[0]-a[2,0]*r[1]
     a1 = a[0,1]*r[0]-a[2,1]*r[1]
@@ -710,7 +715,7 @@ def _dotr2m(r,a,out):
     out[3,3] = d3 
     
     
-@njit([(NFDTYPE[:],NCDTYPE[:],NCDTYPE[:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
+@njit(numba_signatures([(NFDTYPE[:],NCDTYPE[:],NCDTYPE[:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)    
 def _dotr2v(r,a,out):
     out[0]= a[0]*r[0]-a[2]*r[1]
     out[1]= a[1]*r[0]+a[3]*r[1]
@@ -718,7 +723,7 @@ def _dotr2v(r,a,out):
     out[3]= -a[1]*r[1]+a[3]*r[0]
 
     
-@njit([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmv4(a, b, out):
     out0 = a[0,0] * b[0] + a[0,1] * b[1] + a[0,2] * b[2] +a[0,3] * b[3]
     out1 = a[1,0] * b[0] + a[1,1] * b[1] + a[1,2] * b[2] +a[1,3] * b[3]
@@ -729,7 +734,7 @@ def _dotmv4(a, b, out):
     out[2]= out2
     out[3]= out3
     
-@njit([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmv2(a, b, out):
     out0 = a[0,0] * b[0] + a[0,1] * b[1] 
     out1 = a[1,0] * b[0] + a[1,1] * b[1]
@@ -738,7 +743,7 @@ def _dotmv2(a, b, out):
     
 
     
-@njit([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmd4(a, b, out):
     a0 = a[0,0]*b[0]
     a1 = a[0,1]*b[1]
@@ -780,7 +785,7 @@ def _dotmd4(a, b, out):
     out[3,2] = a2
     out[3,3] = a3
     
-@njit([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmd2(a, b, out):
     a0 = a[0,0]*b[0]
     a1 = a[0,1]*b[1]
@@ -826,7 +831,7 @@ def _dotmd2(a, b, out):
 #            out[0,i,j]= out0
 #            out[1,i,j]= out1
 #            
-@njit([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmf4(a, b, out):
     for i in prange(b.shape[1]):
         for j in range(b.shape[2]):
@@ -845,7 +850,7 @@ def _dotmf4(a, b, out):
             out[2,i,j]= out2
             out[3,i,j]= out3  
             
-@njit([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmf2(a, b, out):
     for i in prange(b.shape[1]):
         for j in range(b.shape[2]):
@@ -898,7 +903,7 @@ def _dotmf2(a, b, out):
 #    out[1]= a[1,0] * b0 + a[1,1] * b1 
  
             
-@njit([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmdmf4(a, d, b, f,out):
     for i in prange(f.shape[1]):
         for j in range(f.shape[2]):
@@ -922,7 +927,7 @@ def _dotmdmf4(a, d, b, f,out):
             out[2,i,j]= a[i,j,2,0] * b0 + a[i,j,2,1] * b1 + a[i,j,2,2] * b2 +a[i,j,2,3] * b3
             out[3,i,j]= a[i,j,3,0] * b0 + a[i,j,3,1] * b1 + a[i,j,3,2] * b2 +a[i,j,3,3] * b3   
 
-@njit([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmdmf2(a, d, b, f,out):
     for i in prange(f.shape[1]):
         for j in range(f.shape[2]):
@@ -947,7 +952,7 @@ def _dotmdmf2(a, d, b, f,out):
 #        assert a.shape[0] >= 4 #make sure it is not smaller than 4
 #        _dotm1f4(a, b, out)
 
-@guvectorize([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],"(m,k,n,n),(n,m,k)->(n,m,k)",target = "cpu", cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),"(m,k,n,n),(n,m,k)->(n,m,k)",target = "cpu", cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmf(a, b, out):
     """dotmf(a, b)
     
@@ -978,14 +983,19 @@ def dotmf(a,b, out = None):
     
 Computes a dot product of an array of 4x4 (or 2x2) matrix with 
 a field array or an E-array (in case of 2x2 matrices).
+
+Matrix a may also be a compact matrix object (e.g. 
+:class:`dtmm.diffract.CompactDiffractionMatrix`) that defines a dotmf method.
 """
+    if hasattr(a, "dotmf"):
+        return a.dotmf(b, out = out)
     a = np.asarray(a)
     b = np.asarray(b)
     a = broadcast_m(a, b)
     return _dotmf(a, b, out)
 
        
-@guvectorize([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])],"(m,k,n,n),(m,k,n),(m,k,n,n),(n,m,k)->(n,m,k)",target = "cpu", cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),"(m,k,n,n),(m,k,n),(m,k,n,n),(n,m,k)->(n,m,k)",target = "cpu", cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _dotmdmf(a, d,b,f, out):
     if f.shape[0] == 2:
         _dotmdmf2(a, d,b,f, out)
@@ -1037,7 +1047,7 @@ This is equivalent to
 #        _dotmdmv4(a,d, b, f,out)
                 
                 
-@guvectorize([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])],"(n,k),(k,m)->(n,m)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]),"(n,k),(k,m)->(n,m)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def dotmm(a, b, out):
     """dotmm(a, b)
     
@@ -1092,28 +1102,42 @@ or a less efficient general matrix multiplication.
 #                    out[i,j] += tmp
 
 
+def bmat2mat(m):
+    """Converts a block matrix of shape (...,n,n,k,k) to a matrix of shape 
+    (...,n*k,n*k)."""
+    m = np.asarray(m)
+    shape = m.shape
+    m = np.swapaxes(m, -2,-3)
+    return m.reshape(shape[:-4] + (shape[-4]*shape[-2],shape[-3]*shape[-1]))
+
+def mat2bmat(m, k = 4):
+    """Converts a matrix of shape (...,n*k,n*k) to a block matrix of shape 
+    (...,n,n,k,k), with blocks of size kxk."""
+    m = np.asarray(m)
+    shape = m.shape
+    m = m.reshape(shape[:-2] + (shape[-2]//k,k,shape[-1]//k,k))
+    return np.swapaxes(m, -2,-3)
+
 def bdotmm(m1,m2, out = None):
     """Performs a dot product of two nxn block matrices of blocks of size 4x4.
     Matrices must be of shape nxnx4x4 that describe two mxm matrices
-    (m = 4*n) of blocks of size 4x4. 
+    (m = 4*n) of blocks of size 4x4. The product is computed as a single 
+    (BLAS-backed) mxm matrix product.
     """
     assert m1.shape == m2.shape
     assert m2 is not out
+    k = m1.shape[-1]
+    m = np.matmul(bmat2mat(np.asarray(m1, conf.CDTYPE)),bmat2mat(np.asarray(m2, conf.CDTYPE)))
     if out is None:
-        out = np.empty(shape = m1.shape, dtype = CDTYPE)
-        
-    tmp = np.empty(shape = m1.shape, dtype = CDTYPE)
-
-    for j in range(m1.shape[0]):
-        dotmm(m1[j][:,None,:,:],m2, out = tmp)
-        out[j] = tmp.sum(-4, out = out[j])
+        out = np.empty(shape = m1.shape, dtype = conf.CDTYPE)
+    out[...] = mat2bmat(m, k)
     return out
 
 def _bdotmm_ref(m1,m2, out = None):
     """same as bdotmm, but slower, for testing"""
     m1,m2 = np.broadcast_arrays(m1,m2)
     if out is None:
-        out = np.zeros(m1.shape, CDTYPE)
+        out = np.zeros(m1.shape, conf.CDTYPE)
     else:
         out[...] = 0.
     n = m1.shape[-3] 
@@ -1132,7 +1156,7 @@ def bdotmd(m1,m2, out = None):
     (m = 4*n) of blocks of size 4x4.
     """
     if out is None:
-        out = np.empty(shape = m1.shape, dtype = CDTYPE)
+        out = np.empty(shape = m1.shape, dtype = conf.CDTYPE)
 
     for j in range(m1.shape[-3]):
         dotmm(m1[j],m2,out[j])
@@ -1155,7 +1179,7 @@ def bdotdm(m1,m2, out = None):
     """
     assert m2 is not out
     if out is None:
-        out = np.empty(shape = m2.shape, dtype = CDTYPE)
+        out = np.empty(shape = m2.shape, dtype = conf.CDTYPE)
 
     for j in range(m2.shape[-3]):
         dotmm(m1,m2[:,j],out[:,j])
@@ -1197,7 +1221,7 @@ def _bdotmv_ref(m,v):
 
 
         
-@guvectorize([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])],"(n,n),(n)->(n,n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]),"(n,n),(n)->(n,n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def dotmd(a, d, out):
      """dotmd(a, d)
      
@@ -1210,7 +1234,7 @@ matrix represented by a vector of shape 4 (or 2).
          assert a.shape[0] >= 4 #make sure it is not smaller than 4
          _dotmd4(a, d, out)
 
-@guvectorize([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])],"(n,n),(n)->(n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]),"(n,n),(n)->(n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def dotmv(a, b, out):
     """dotmv(a, b)
     
@@ -1224,7 +1248,7 @@ Computes a dot product of a 4x4 or 2x2 matrix with a vector.
     else:
         _dotmv(a, b, out)
     
-@guvectorize([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:,:])],"(n,n),(n),(n,n)->(n,n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:,:])]),"(n,n),(n),(n,n)->(n,n)",target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def dotmdm(a, d, b, out):
     """dotmdm(a, d, b)
     
@@ -1241,31 +1265,303 @@ and another 4x4 (or 2x2) matrix.
         _dotmm4(out,b,out)        
     
 
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NU32DTYPE[:,:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _dotrbf4(blocks, index, ay, ax, f, out):
+    for i in prange(f.shape[1]):
+        y = ay[i]
+        for j in range(f.shape[2]):
+            x = ax[j]
+            r = (x*x + y*y)**0.5
+            if r == 0.:
+                #phi = 0 at beta = 0, avoid division by zero
+                r = 1.
+                x = 1.
+            c = x/r
+            s = y/r
+            b = blocks[index[i,j]]
+            
+            #rotate to the plane of incidence
+            g0 = c * f[0,i,j] + s * f[2,i,j]
+            g1 = c * f[1,i,j] - s * f[3,i,j]
+            g2 = c * f[2,i,j] - s * f[0,i,j]
+            g3 = c * f[3,i,j] + s * f[1,i,j]
+            
+            #p and s block 
+            h0 = b[0,0,0] * g0 + b[0,0,1] * g1
+            h1 = b[0,1,0] * g0 + b[0,1,1] * g1
+            h2 = b[1,0,0] * g2 + b[1,0,1] * g3
+            h3 = b[1,1,0] * g2 + b[1,1,1] * g3
+            
+            #rotate back
+            out[0,i,j] = c * h0 - s * h2
+            out[1,i,j] = c * h1 + s * h3
+            out[2,i,j] = c * h2 + s * h0
+            out[3,i,j] = c * h3 - s * h1
+
+@guvectorize(numba_signatures([(NCDTYPE[:,:,:,:],NU32DTYPE[:,:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:,:,:],NCDTYPE[:,:,:])]),"(r,l,l,l),(m,k),(m),(k),(n,m,k)->(n,m,k)",target = "cpu", cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def dotrbf(blocks, index, ay, ax, f, out):
+    """dotrbf(blocks, index, ay, ax, f)
+    
+Computes a dot product of a rotationally symmetric, block diagonal 4x4 matrix 
+with a field array. 
+
+The matrix at each of the plane waves is R.B.R^T, where R is the rotation by
+the plane wave's phi angle, computed from the ay and ax frequencies, and B is
+one of the (2,2,2,2) blocks array, taken at the given index. The first block 
+acts on the (Ex,Hy) and the second block acts on the (Ey,Hx) components 
+of the rotated field.
+"""
+    assert f.shape[0] == 4
+    _dotrbf4(blocks, index, ay, ax, f, out)
+        
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NU32DTYPE[:,:],NCDTYPE[:,:,:],NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _dotmw4(m, index, a, wy, wx, out):
+    for i in prange(out.shape[2]):
+        for j in range(out.shape[3]):
+            ind = index[i,j]
+            for l in range(a.shape[0]):
+                out0 = out[l,0,i,j]
+                out1 = out[l,1,i,j]
+                out2 = out[l,2,i,j]
+                out3 = out[l,3,i,j]
+                for k in range(m.shape[0]):
+                    w = wy[k,i] * wx[k,j]
+                    f0 = a[l,0,k] * w
+                    f1 = a[l,1,k] * w
+                    f2 = a[l,2,k] * w
+                    f3 = a[l,3,k] * w
+                    b = m[k,ind]
+                    out0 += b[0,0] * f0 + b[0,1] * f1 + b[0,2] * f2 + b[0,3] * f3
+                    out1 += b[1,0] * f0 + b[1,1] * f1 + b[1,2] * f2 + b[1,3] * f3
+                    out2 += b[2,0] * f0 + b[2,1] * f1 + b[2,2] * f2 + b[2,3] * f3
+                    out3 += b[3,0] * f0 + b[3,1] * f1 + b[3,2] * f2 + b[3,3] * f3
+                out[l,0,i,j] = out0
+                out[l,1,i,j] = out1
+                out[l,2,i,j] = out2
+                out[l,3,i,j] = out3
+
+@njit(numba_signatures([(NCDTYPE[:,:,:,:],NU32DTYPE[:,:],NCDTYPE[:,:,:],NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:,:,:])]),parallel = NUMBA_PARALLEL, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _dotmw2(m, index, a, wy, wx, out):
+    for i in prange(out.shape[2]):
+        for j in range(out.shape[3]):
+            ind = index[i,j]
+            for l in range(a.shape[0]):
+                out0 = out[l,0,i,j]
+                out1 = out[l,1,i,j]
+                for k in range(m.shape[0]):
+                    w = wy[k,i] * wx[k,j]
+                    f0 = a[l,0,k] * w
+                    f1 = a[l,1,k] * w
+                    b = m[k,ind]
+                    out0 += b[0,0] * f0 + b[0,1] * f1 
+                    out1 += b[1,0] * f0 + b[1,1] * f1 
+                out[l,0,i,j] = out0
+                out[l,1,i,j] = out1
+
+def dotmw(m, amplitude, ii, jj, out, index = None):
+    """Computes a sum of dot products of 4x4 (or 2x2) mode matrices with
+    plane eigenwaves. 
+    
+    This is equivalent to summing dotmf(m[k], eigenwave(shape, ii[k], jj[k], amplitude[...,k]))
+    over all modes k, but the plane waves are never built in full size.
+    
+    Parameters
+    ----------
+    m : ndarray
+        Mode matrices of shape (nmodes, nmat, n, n) if index is given, or 
+        of shape (nmodes, ny, nx, n, n) or (nmodes, n, n) otherwise.
+    amplitude : ndarray
+        Fourier coefficients of the modes of shape (..., n, nmodes).
+    ii, jj : ndarray
+        Fourier coefficient indices of the modes.
+    out : ndarray
+        A C-contiguous array of shape (..., n, ny, nx) to which the results are added.
+    index : ndarray, optional
+        An integer array of shape (ny, nx) that maps pixels to the second axis 
+        of m, e.g. to distinct materials (see :func:`.data.unique_epsva`).
+        
+    Returns
+    -------
+    out : ndarray
+        Output array.
+    """
+    if not out.flags["C_CONTIGUOUS"]:
+        raise ValueError("Output array must be C-contiguous.")
+    ny, nx = out.shape[-2:]
+    n = out.shape[-3]
+    m = np.asarray(m, dtype = conf.CDTYPE)
+    if index is None:
+        if m.ndim == 3:
+            m = m[:,None]
+            index = np.zeros((ny,nx), U32DTYPE)
+        else:
+            if m.shape[1:3] != (ny,nx):
+                m = np.broadcast_to(m, (m.shape[0],ny,nx,n,n)).copy()
+            m = m.reshape((m.shape[0],ny*nx,n,n))
+            index = np.arange(ny*nx, dtype = U32DTYPE).reshape((ny,nx))
+    index = np.asarray(index, dtype = U32DTYPE)
+    amplitude = np.asarray(amplitude, dtype = conf.CDTYPE).reshape((-1,n,len(ii)))
+    wy = np.exp((2j*np.pi/ny) * np.outer(ii, np.arange(ny))).astype(conf.CDTYPE)/(ny*nx)
+    wx = np.exp((2j*np.pi/nx) * np.outer(jj, np.arange(nx))).astype(conf.CDTYPE)
+    if n == 2:
+        _dotmw2(m, index, amplitude, wy, wx, out.reshape((-1,n,ny,nx)))
+    else:
+        _dotmw4(m, index, amplitude, wy, wx, out.reshape((-1,n,ny,nx)))
+    return out
+
+def _groups(seq, fanin):
+    return [seq[i:i+fanin] for i in range(0, len(seq), fanin)]
+
+def _tree_reduce(mats, mul, fanin, parallel):
+    """Reduces a sequence of matrices level by level. Groups of fanin matrices 
+    of each level are multiplied independently (in parallel)."""
+    _map = pool_map if parallel else lambda f, seq : [f(x) for x in seq]
+    while len(mats) > 1:
+        mats = _map(lambda group : reduce(mul, group), _groups(mats, fanin))
+    return mats[0]
+
+def _tree_prefix(mats, mul, fanin, parallel):
+    """Computes all prefix products of a sequence of matrices. Group products 
+    are computed and scanned recursively, then group prefixes are completed
+    independently (in parallel)."""
+    if len(mats) <= 1:
+        return list(mats)
+    _map = pool_map if parallel else lambda f, seq : [f(x) for x in seq]
+    groups = _groups(mats, fanin)
+    totals = _tree_prefix(_map(lambda group : reduce(mul, group), groups), mul, fanin, parallel)
+    
+    def _complete(k):
+        group = groups[k]
+        if len(group) == 1:
+            return [totals[k]]
+        out = [group[0] if k == 0 else mul(totals[k-1], group[0])]
+        for m in group[1:-1]:
+            out.append(mul(out[-1], m))
+        out.append(totals[k])
+        return out
+    
+    return [m for out in _map(_complete, range(len(groups))) for m in out]
+
+def _stream_reduce(mats, mul, fanin):
+    """Reduces an iterable of matrices with the same grouping as the tree 
+    reduction, but keeping at most fanin pending matrices per tree level."""
+    levels = []
+    for m in mats:
+        for level in levels:
+            level.append(m)
+            if len(level) < fanin:
+                break
+            m = reduce(mul, level)
+            del level[:]
+        else:
+            levels.append([m])
+    pending = [m for level in reversed(levels) for m in level]
+    if len(pending) == 0:
+        raise ValueError("No matrices to multiply.")
+    return reduce(mul, pending)
+
+def _buffered(mats, n):
+    """Returns a list of the n matrices generated by mats if they fit in the memory
+    budget (DTMMConfig.max_memory), so that they can be multiplied in parallel
+    by :func:`tree_dot`, else it returns an iterator over the generated matrices."""
+    mats = iter(mats)
+    first = next(mats)
+    if _result_nbytes(first) * n <= DTMMConfig.max_memory * 1024**2:
+        return [first] + list(mats)
+    return itertools.chain((first,), mats)
+
+def tree_dot(mats, reverse = False, fanin = 2, prefix = False, dot = None, parallel = True):
+    """Computes a product of a sequence of matrices M1.M2...Mn (or Mn...M2.M1
+    if reverse is specified) by tree reduction.
+    
+    Instead of a serial chain of n-1 products, matrices are multiplied in 
+    groups of fanin matrices, level by level, so there are only about 
+    log(n)/log(fanin) dependent steps. Group products of each level are 
+    independent and are computed in the thread pool if DTMMConfig.nthreads > 1
+    (see :func:`.conf.set_nthreads`).
+    
+    Parameters
+    ----------
+    mats : sequence or iterable
+        Matrices to multiply. If it is an iterable (e.g. a generator), matrices 
+        are multiplied as they are generated, keeping at most fanin matrices 
+        of each tree level in memory, and products are computed sequentially.
+    reverse : bool
+        Specifies whether the product is computed in reversed order.
+    fanin : int
+        Number of matrices multiplied in each group (at least 2).
+    prefix : bool
+        If specified, it returns a list of all prefix products M1, M1.M2, ..., 
+        M1.M2...Mn (or M1, M2.M1, ..., Mn...M2.M1 if reverse is specified), 
+        e.g. to compute the field at every interface of a stack.
+    dot : callable, optional
+        A function dot(a, b) that multiplies two matrices (defaults to
+        :func:`dotmm`). Any objects that dot can multiply can be used.
+    parallel : bool
+        Specifies whether independent products can be computed in the thread pool.
+        
+    Returns
+    -------
+    out : ndarray or list
+        Product of the matrices or a list of prefix products.
+    """
+    fanin = int(fanin)
+    if fanin < 2:
+        raise ValueError("fanin must be at least 2.")
+    dot = dotmm if dot is None else dot
+    mul = (lambda a, b : dot(b, a)) if reverse else dot
+    if not hasattr(mats, "__len__") and not prefix:
+        return _stream_reduce(mats, mul, fanin)
+    mats = list(mats)
+    if len(mats) == 0:
+        raise ValueError("No matrices to multiply.")
+    if prefix:
+        return _tree_prefix(mats, mul, fanin, parallel)
+    return _tree_reduce(mats, mul, fanin, parallel)
+
+def matrix_power(mat, n, dot = None):
+    """Computes the n-th power (n >= 1) of a matrix by repeated squaring, 
+    with O(log n) matrix products.
+    
+    Parameters
+    ----------
+    mat : ndarray
+        Input matrix, or any object that dot can multiply.
+    n : int
+        The exponent.
+    dot : callable, optional
+        A function dot(a, b) that multiplies two matrices (defaults to
+        :func:`dotmm`).
+    
+    Returns
+    -------
+    out : ndarray
+        The n-th power of the matrix.
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError("Exponent must be a positive integer.")
+    dot = dotmm if dot is None else dot
+    out = None
+    while True:
+        if n & 1:
+            out = mat if out is None else dot(out, mat)
+        n >>= 1
+        if n == 0:
+            return out
+        mat = dot(mat, mat)
+
 def multi_dot(arrays,  axis = 0, reverse = False):
     """Computes dot product of multiple 2x2 or 4x4 matrices. If reverse is 
     specified, it is performed in reversed order. Axis defines the axis over 
-    which matrices are multiplied."""
-    out = None
+    which matrices are multiplied. The product is computed by tree reduction,
+    see :func:`tree_dot`."""
     if axis != 0:
         arrays = np.asarray(arrays)
-        indices = range(arrays.shape[axis])
         arrays = np.rollaxis(arrays, axis)
-        #arrays = np.moveaxis(arrays, axis)
-    else:
-        indices = range(len(arrays))
-    if reverse == True:
-        indices = reversed(indices)
-    for i in indices:
-        if out is None:
-            out = np.asarray(arrays[i]).copy()
-        else:
-            b = np.broadcast(out, arrays[i])
-            if b.shape == out.shape:
-                out = dotmm(out, arrays[i], out = out)
-            else:
-                out = dotmm(out, arrays[i])
-    return out
+    out = tree_dot([np.asarray(a) for a in arrays], reverse = reverse)
+    return out.copy() if len(arrays) == 1 else out
     
     
-__all__ = ["inv", "dotmm","dotmf","dotmv","dotmdm","dotmd","multi_dot","eig","tensor_eig"]
+__all__ = ["inv", "dotmm","dotmf","dotmv","dotmdm","dotmd","dotmw","multi_dot","tree_dot","matrix_power","eig","tensor_eig"]
 
@@ -6,7 +6,8 @@ Diffraction matrices used in the difraction step of the layer propagation functi
 
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import cached_function, BETAMAX,FDTYPE,CDTYPE
+from dtmm.conf import cached_function, BETAMAX
+import dtmm.conf as conf
 from dtmm.tmm import alphaffi, alphaEEi, alphaf,  E_mat, phase_mat
 from dtmm.linalg import dotmdm, dotmm,  inv
 from dtmm.diffract import diffraction_alphaffi, E_diffraction_matrix, phase_matrix, diffraction_alphaf
@@ -108,9 +109,9 @@ def second_field_diffraction_matrix(shape, ks, beta,phi, d=1.,
 
 @cached_function
 def first_Epn_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.),  betamax = BETAMAX, out = None):
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
     alpha, f, fi= diffraction_alphaffi(shape, ks, epsv = epsv, epsa = epsa, betamax = betamax)
     kd = ks * d
     e = E_mat(f, mode = None)
@@ -119,9 +120,9 @@ def first_Epn_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0
 
 @cached_function
 def second_Epn_diffraction_matrix(shape, ks,  d = 1., epsv = (1,1,1), epsa = (0,0,0.),  betamax = BETAMAX, out = None):
-    ks = np.asarray(ks, dtype = FDTYPE)
-    epsv = np.asarray(epsv, dtype = CDTYPE)
-    epsa = np.asarray(epsa, dtype = FDTYPE)
+    ks = np.asarray(ks, dtype = conf.FDTYPE)
+    epsv = np.asarray(epsv, dtype = conf.CDTYPE)
+    epsa = np.asarray(epsa, dtype = conf.FDTYPE)
     alpha, f = diffraction_alphaf(shape, ks, epsv = epsv, epsa = epsa, betamax = betamax)
     kd = ks * d
     e = E_mat(f, mode = None)
@@ -5,10 +5,11 @@ FFT mode selection
 """
 import numpy as np
 from dtmm.wave import betaxy
-from dtmm.conf import cached_result, BETAMAX, FDTYPE, NFDTYPE, NUMBA_CACHE,NUMBA_TARGET
+from dtmm.conf import cached_result, BETAMAX, NFDTYPE, NUMBA_CACHE,NUMBA_TARGET, DTMMConfig, numba_signatures
+import dtmm.conf as conf
 import numba as nb
 
-@nb.guvectorize([(NFDTYPE[:,:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:,:])], 
+@nb.guvectorize(numba_signatures([(NFDTYPE[:,:],NFDTYPE[:,:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:,:])]), 
                  "(i,j),(i,j),(),(),(),(),(),(),()->(i,j)",
                  target = NUMBA_TARGET, cache = NUMBA_CACHE)
 def fft_window(fftbetax, fftbetay,betax, betay, stepx,stepy, xtyp, ytyp, betamax, out):
@@ -102,7 +103,7 @@ def fft_windows(betax, betay, n, betax_off = 0., betay_off = 0., betamax = BETAM
     return out
 
 def fft_betaxy(shape, k0):
-    bx,by = betaxy(shape[-2:], np.asarray(k0,FDTYPE)[...,None])
+    bx,by = betaxy(shape[-2:], np.asarray(k0,conf.FDTYPE)[...,None])
     return bx,by #np.broadcast_to(bx,shape),np.broadcast_to(by,shape)
 
 def fft_betaxy_mean(betax, betay, fft_windows):
@@ -138,6 +139,28 @@ def fft_mask(shape, k0, n, betax_off = 0., betay_off = 0., betamax = BETAMAX):
     return windows[nonzero], (bs[nonzero], ps[nonzero])
     
     
+def mode_slices(n, nbytes, max_memory = None):
+    """Splits n modes into batches so that the temporary data of each batch 
+    fits in the memory budget.
+    
+    Parameters
+    ----------
+    n : int
+        Number of modes.
+    nbytes : int
+        Size of the temporary data (in bytes) needed for a single mode.
+    max_memory : float, optional
+        Memory budget in MB. Defaults to DTMMConfig.max_memory.
+        
+    Returns
+    -------
+    slices : list of slice
+        Slices of mode indices, one for each batch.
+    """
+    max_memory = DTMMConfig.max_memory if max_memory is None else max_memory
+    size = max(1, int(max_memory * 1024**2 // max(nbytes,1)))
+    return [slice(i, i + size) for i in range(0, n, size)]
+
 if __name__ == "__main__":
     w,bp = fft_mask_full((64,1), (1,), 3, betax_off = 0.)
     import matplotlib.pyplot as plt
@@ -149,5 +172,3 @@ if __name__ == "__main__":
             axes[i,j].axis('off')
 
     plt.show()
-    
-    
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+Parallel execution of independent computations (wavelengths, rays).
+
+Jobs are executed either in a thread pool or in a process pool. With processes,
+input and output arrays are placed in shared memory blocks that are inherited by
+worker processes when the pool is created, so arrays are not pickled for each
+job. Workers write results directly into the shared output arrays, which are
+copied back to the caller's arrays when all jobs are done.
+"""
+from __future__ import absolute_import, print_function, division
+
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from dtmm.conf import DTMMConfig, set_precision
+
+#: arrays of the worker process, set by :func:`_init_worker`
+_worker_arrays = {}
+
+def share_array(array):
+    """Copies array to a shared memory block.
+
+    Parameters
+    ----------
+    array : ndarray
+        Input array.
+
+    Returns
+    -------
+    shared : tuple
+        A (buffer, shape, dtype) tuple that can be passed to worker processes
+        at pool creation. Use :func:`shared2array` to obtain the array.
+    """
+    array = np.asarray(array)
+    buffer = RawArray("b", max(array.nbytes,1))
+    shared = buffer, array.shape, array.dtype.str
+    shared2array(shared)[...] = array
+    return shared
+
+def shared2array(shared):
+    """Returns a numpy array view of the shared memory block. See :func:`share_array`."""
+    buffer, shape, dtype = shared
+    size = int(np.prod(shape))
+    return np.frombuffer(buffer, dtype = dtype, count = size).reshape(shape)
+
+def _init_worker(config, shared):
+    DTMMConfig.__dict__.update(config)
+    #dtypes of the worker must match the precision of the config
+    set_precision(DTMMConfig.precision)
+    #each process computes a single job at a time
+    DTMMConfig.nthreads = 1
+    _worker_arrays.clear()
+    _worker_arrays.update({key : shared2array(value) for key, value in shared.items()})
+    #import compute functions so that numba functions are loaded from cache once per worker
+    import dtmm.transfer
+
+def _run_job(args):
+    func, job = args
+    return func(_worker_arrays, job)
+
+def map_jobs(func, jobs, arrays, outputs = None, workers = None, executor = "thread", nbytes = None,
+             precision = None):
+    """Runs func(arrays, job) for all jobs in parallel.
+
+    Parameters
+    ----------
+    func : callable
+        A module-level function that takes a dict of arrays and a job
+        description. It should write the results to the arrays.
+    jobs : list
+        A list of job descriptions (picklable objects if executor is "process").
+    arrays : dict
+        A dict of arrays that are shared between jobs. With the "process"
+        executor, arrays are copied to shared memory.
+    outputs : list, optional
+        Keys of arrays that are written by the jobs. With the "process" executor,
+        these are copied back to the original arrays when all jobs are done.
+    workers : int, optional
+        Number of workers. Defaults to the number of CPU cores.
+    executor : str
+        Either "thread" or "process".
+    nbytes : int, optional
+        Size of the temporary data (in bytes) needed by a single job. If 
+        specified, the number of workers is limited so that the temporary data
+        of all running jobs fits in the memory budget (DTMMConfig.max_memory).
+    precision : str, optional
+        Precision of the computation in worker processes (see 
+        :func:`.conf.set_precision`). Defaults to the current precision. Only
+        the "process" executor supports a different precision.
+
+    Returns
+    -------
+    results : list
+        Values returned by func for each job.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if nbytes is not None:
+        workers = min(workers, int(DTMMConfig.max_memory * 1024**2 // max(nbytes,1)))
+    workers = max(1,min(int(workers),len(jobs)))
+    if executor == "thread":
+        if precision not in (None, DTMMConfig.precision):
+            raise ValueError("Thread executor computes in the current precision.")
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(lambda job : func(arrays, job), jobs))
+    elif executor == "process":
+        shared = {key : share_array(value) for key, value in arrays.items()}
+        config = dict(DTMMConfig.__dict__)
+        if precision is not None:
+            config["precision"] = precision
+        with ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (config, shared)) as pool:
+            results = list(pool.map(_run_job, [(func, job) for job in jobs]))
+        for key in (outputs or []):
+            arrays[key][...] = shared2array(shared[key])
+        return results
+    else:
+        raise ValueError("Unknown executor '{}', use 'thread' or 'process'.".format(executor))
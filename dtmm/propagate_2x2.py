@@ -4,23 +4,28 @@ The 2x2 layer propagation functions
 from __future__ import absolute_import, print_function, division
 
 from dtmm.conf import BETAMAX
+import dtmm.conf as conf
 from dtmm.wave import eigenwave, betaphi
 from dtmm.tmm import alphaf, E2H_mat, E_mat, Eti_mat, phase_mat, Etri_mat, tr_mat
 
-from dtmm.linalg import dotmf, dotmdmf, inv, dotmd
+from dtmm.linalg import dotmf, dotmdmf, inv, dotmd, dotmm, dotmdm, dotmw
+from dtmm.field import _dotmf, _pack, _unpack
 from dtmm.diffract import diffract, E_tr_matrix
+from dtmm.data import unique_epsva
 from dtmm.fft import fft2, ifft2
 import numpy as np
 
 from dtmm.matrix import corrected_E_diffraction_matrix,second_E_diffraction_matrix,first_E_diffraction_matrix
-from dtmm.mode import fft_mask
+from dtmm.mode import fft_mask, mode_slices
 
 
 def _transfer_ray_2x2_1(fft_field, wavenumbers, layer, effective_layer_in,effective_layer_out, dmat1, dmat2, beta = 0, phi=0,
-                    nsteps = 1, mode = +1, reflection = True, betamax = BETAMAX, refl = None, bulk = None, out = None, tmpdata = None):
+                    nsteps = 1, mode = +1, reflection = True, betamax = BETAMAX, refl = None, bulk = None, out = None, tmpdata = None, mask = None):
+    """If mask is given, fft_field (and refl) are the packed modes of the 
+    fft field, see :func:`.field.ffield2modes`."""
     _out = {} if tmpdata is None else tmpdata
     #fft_field = fft2(fft_field, out = out)
-    shape = fft_field.shape[-2:]
+    shape = fft_field.shape[-2:] if mask is None else mask.shape
     d_in, epsv_in,epsa_in = effective_layer_in     
     
     d_out, epsv_out,epsa_out = effective_layer_out    
@@ -38,48 +43,70 @@ def _transfer_ray_2x2_1(fft_field, wavenumbers, layer, effective_layer_in,effect
     kd = wavenumbers * d   
     p = phase_mat(alpha,kd[...,None,None], mode = mode, out = _out.get("p"))
     
+    #per-pixel layer operator e.p.ei, formed once and reused in all steps
+    lmat = dotmdm(e,p,ei, out = _out.get("lmat"))
+    
+    if nsteps > 1 and dmat1 is not None:
+        #dmat2 of a step and dmat1 of the next step merged in a single multiply
+        dmat = dotmm(dmat1, dmat2, out = _out.get("dmat"))
+    else:
+        dmat = None
+    
     if tmpdata is not None:
         _out["alphaf"] = alpha, fmat
         _out["ei"] = ei
         _out["p"] = p
+        _out["lmat"] = lmat
+        if dmat is not None:
+            _out["dmat"] = dmat
     
     for j in range(nsteps):
         if j == 0 and reflection:
             #reflect only at the beginning
             if refl is not None:
                 trans = refl.copy()
-                refl = dotmf(rmat, fft_field, out = refl)
-                fft_field = dotmf(tmat, fft_field, out = out)
+                refl = _dotmf(rmat, fft_field, mask, out = refl)
+                fft_field = _dotmf(tmat, fft_field, mask, out = out)
                 fft_field = np.add(fft_field,trans, out = fft_field)
                 
                 if mode == -1 and bulk is not None:
-                    field = ifft2(fft_field)
+                    field = ifft2(_unpack(fft_field, mask))
                     e2h = E2H_mat(fmat, mode = mode)
                     bulk[...,::2,:,:] += field 
                     bulk[...,1::2,:,:] +=  dotmf(e2h, field, out = field)
-
-                fft_field = dotmf(dmat1, fft_field, out = fft_field)
+                if dmat1 is not None:
+                    fft_field = _dotmf(dmat1, fft_field, mask, out = fft_field)
                 out = fft_field
             else:
-                fft_field = dotmf(tmat, fft_field, out = out)
+                fft_field = _dotmf(tmat, fft_field, mask, out = out)
                 if dmat1 is not None:
-                    fft_field = dotmf(dmat1, fft_field, out = fft_field)
+                    fft_field = _dotmf(dmat1, fft_field, mask, out = fft_field)
                 out = fft_field
-        else:
+        elif j == 0:
             if dmat1 is not None:
-                fft_field = dotmf(dmat1, fft_field, out = out)
+                fft_field = _dotmf(dmat1, fft_field, mask, out = out)
             out = fft_field
-        field = ifft2(fft_field, out = out)
-        field = dotmdmf(e,p,ei,field, out = field)
+        elif dmat is not None:
+            fft_field = _dotmf(dmat, fft_field, mask, out = fft_field)
+        if mask is None:
+            field = ifft2(fft_field, out = out)
+        else:
+            #scatter modes to the full grid for the real space step
+            field = _unpack(fft_field, mask, out = _out.get("work"))
+            field = ifft2(field, out = field)
+            if tmpdata is not None:
+                _out["work"] = field
+        field = dotmf(lmat,field, out = field)
         fft_field = fft2(field, out = field)
-        if dmat2 is not None:
-            fft_field = dotmf(dmat2, fft_field, out = fft_field)
+        fft_field = _pack(fft_field, mask, out = out)
+        if dmat2 is not None and j == nsteps - 1:
+            fft_field = _dotmf(dmat2, fft_field, mask, out = fft_field)
     #return fft_field, refl  
     
     #out = ifft2(fft_field, out = out)
    
     if mode == +1 and bulk is not None:
-        field = ifft2(fft_field)
+        field = ifft2(_unpack(fft_field, mask))
         e2h = E2H_mat(fmat, mode = mode)
         bulk[...,1::2,:,:] +=  dotmf(e2h, field)
         bulk[...,::2,:,:] += field
@@ -194,9 +221,9 @@ def propagate_2x2_effective_1(field, wavenumbers, layer_in, layer_out, effective
                             effective_layer_out, beta = 0, phi = 0,
                             nsteps = 1, diffraction = True, reflection = True, 
                             betamax = BETAMAX,  mode = +1,  tmpdata = None, split_diffraction = False,
-                            refl = None, bulk = None, out = None):
+                            refl = None, bulk = None, out = None, mask = None):
     d_out, epsv_out,epsa_out = effective_layer_out    
-    shape = field.shape[-2:]
+    shape = field.shape[-2:] if mask is None else mask.shape
     
     if diffraction <= 1:
         if diffraction == 1:
@@ -208,7 +235,7 @@ def propagate_2x2_effective_1(field, wavenumbers, layer_in, layer_out, effective
             dmat1, dmat2 = None,None
         return _transfer_ray_2x2_1(field, wavenumbers, layer_out, effective_layer_in, effective_layer_out,dmat1, dmat2,
                                 beta = beta, phi = phi, nsteps =  nsteps,reflection = reflection,
-                                betamax = betamax, mode = mode, refl = refl, bulk = bulk, out = out, tmpdata = tmpdata)            
+                                betamax = betamax, mode = mode, refl = refl, bulk = bulk, out = out, tmpdata = tmpdata, mask = mask)            
     elif diffraction > 1:
         fout = np.zeros_like(field)
         reflpart = None
@@ -227,7 +254,7 @@ def propagate_2x2_effective_1(field, wavenumbers, layer_in, layer_out, effective
         except IndexError:
             broadcast_shape = ()
             
-        windows, (betas, phis) = fft_mask(field.shape, wavenumbers, int(diffraction), 
+        windows, (betas, phis) = fft_mask(shape, wavenumbers, int(diffraction), 
                  betax_off = beta*np.cos(phi), betay_off = beta*np.sin(phi), betamax = betamax)    
 
         n = len(windows)
@@ -256,6 +283,7 @@ def propagate_2x2_effective_1(field, wavenumbers, layer_in, layer_out, effective
                                         epsa =  epsa_out, mode = mode, betamax = betamax) 
                         
             
+            window = _pack(window, mask)
             fpart = np.multiply(field, window, out = fpart)
             
             if refl is not None:
@@ -268,7 +296,7 @@ def propagate_2x2_effective_1(field, wavenumbers, layer_in, layer_out, effective
                             beta = beta, phi = phi, 
                             nsteps =  nsteps,reflection = reflection,
                             betamax = betamax, mode = mode, bulk = bulk,
-                            out = _out,  refl = reflpart, tmpdata = tmpdata)
+                            out = _out,  refl = reflpart, tmpdata = tmpdata, mask = mask)
              
             np.add(fout, _out, fout)
             if refl is not None and reflection != 0:
@@ -379,7 +407,11 @@ def propagate_2x2_effective_2(field, wavenumbers, layer_in, layer_out, effective
 def propagate_2x2_full(field, wavenumbers, layer, input_layer = None, 
                     nsteps = 1,  mode = +1, reflection = True,
                     betamax = BETAMAX, refl = None, bulk = None, out = None):
-
+    """Propagates field through a layer using full diffraction calculation.
+    
+    Eigensystems of all propagating modes are computed in batches, the size of
+    a batch is limited by DTMMConfig.max_memory (see :func:`.conf.set_max_memory`).
+    """
     shape = field.shape[-2:]
    
     d, epsv, epsa = layer
@@ -393,10 +425,19 @@ def propagate_2x2_full(field, wavenumbers, layer, input_layer = None,
         
     ii,jj = np.meshgrid(range(shape[0]), range(shape[1]),copy = False, indexing = "ij") 
     
+    #eigensystems are computed for distinct materials only
+    if input_layer is not None:
+        (epsv, epsa, epsv_in, epsa_in), index = unique_epsva(shape, epsv, epsa, epsv_in, epsa_in)
+    else:
+        (epsv, epsa), index = unique_epsva(shape, epsv, epsa)
+    
+    #temporary data per mode: input and output eigensystems and the 2x2 matrices
+    nbytes = len(epsv) * (2*(4 + 16) + 10*4) * np.dtype(conf.CDTYPE).itemsize
+    
     for step in range(nsteps):
         for i in range(len(wavenumbers)):
             ffield = fft2(field[...,i,:,:,:])
-            ofield = np.zeros_like(out[...,i,:,:,:])
+            ofield = np.zeros(ffield.shape, dtype = conf.CDTYPE)
 
             b,p = betaphi(shape,wavenumbers[i])
             mask = b < betamax
@@ -410,52 +451,52 @@ def propagate_2x2_full(field, wavenumbers, layer, input_layer = None,
             
             if bulk is not None:
                 obulk = bulk[...,i,:,:,:]
+                hfield = np.zeros_like(ofield)
             
             if refl is not None:
                 tampl = fft2(refl[...,i,:,:,:])[...,mask]
                 orefl = refl[...,i,:,:,:]
-                orefl[...] = 0.
+                rfield = np.zeros_like(ofield)
               
-            for bp in sorted(zip(range(len(betas)),betas,phis,iind,jind),key = lambda el : el[1], reverse = False):     
-                #for j,bp in enumerate(zip(betas,phis,iind,jind)):     
-                              
-                j, beta, phi, ieig, jeig = bp
-
-                out_af = alphaf(beta,phi,epsv,epsa)
-                alpha,fmat_out = out_af 
+            for s in mode_slices(len(betas), nbytes):
+                beta, phi = betas[s,None], phis[s,None]
+                
+                alpha,fmat_out = alphaf(beta,phi,epsv,epsa)
                 e = E_mat(fmat_out, mode = mode)
                 ei0 = inv(e)
-                ei = ei0                        
-                pm = phase_mat(alpha,kd[i,None,None],mode = mode)
-                w = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = amplitude[...,j])
+                pm = phase_mat(alpha,kd[i],mode = mode)
+                
+                #list of (mode matrix, mode amplitudes) pairs to sum
+                terms = []
                 if step == 0 and reflection != False:
                     alphain, fmat_in = alphaf(beta,phi,epsv_in,epsa_in)
+                    ep = dotmd(e,pm)
                     if refl is not None:
                         ei,eri = Etri_mat(fmat_in, fmat_out, mode = mode)
                         ein =  E_mat(fmat_in, mode = -1*mode)
-                        t = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = tampl[...,j])
-                        r = dotmf(eri, w)
-                        r = dotmf(ein,r, out = r)
-                        np.add(orefl,r,orefl)
-                    
-                        w = dotmf(ei, w, out = w)
-                        t = dotmf(ei0,t, out = t)
-                        w = np.add(t,w,out = w)
-  
+                        dotmw(dotmm(ein,eri), amplitude[...,s], iind[s], jind[s], rfield, index = index)
+                        terms.append((dotmm(ep,ei), amplitude[...,s]))
+                        terms.append((dotmm(ep,ei0), tampl[...,s]))
                     else:
                         ei = Eti_mat(fmat_in, fmat_out, mode = mode)
-                        w = dotmf(ei, w, out = w)
-                    w = dotmf(dotmd(e,pm),w, out = w)
-                    np.add(ofield,w,ofield)                         
-                    
+                        terms.append((dotmm(ep,ei), amplitude[...,s]))
                 else:
-                    w = dotmdmf(e,pm,ei,w, out = w)
-                    np.add(ofield,w,ofield)
-
+                    terms.append((dotmdm(e,pm,ei0), amplitude[...,s]))
+                    
                 if bulk is not None:
                     e2h = E2H_mat(fmat_out, mode = mode)
-                    obulk[...,1::2,:,:] +=  dotmf(e2h, w)
-                    obulk[...,::2,:,:] += w
+                    
+                for m, a in terms:
+                    dotmw(m, a, iind[s], jind[s], ofield, index = index)
+                    if bulk is not None:
+                        dotmw(dotmm(e2h,m), a, iind[s], jind[s], hfield, index = index)
+            
+            if refl is not None:
+                orefl[...] = rfield
+            
+            if bulk is not None:
+                obulk[...,1::2,:,:] += hfield
+                obulk[...,::2,:,:] += ofield
                 
             out[...,i,:,:,:] = ofield
                     
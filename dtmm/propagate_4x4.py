@@ -3,18 +3,65 @@ The 4x4 layer propagation functions
 """
 from __future__ import absolute_import, print_function, division
 
-from dtmm.conf import BETAMAX
+from dtmm.conf import BETAMAX, DTMMConfig
+import dtmm.conf as conf
 from dtmm.wave import eigenwave, betaphi
 from dtmm.tmm import alphaffi, phasem,  alphaf,  E_mat
-from dtmm.linalg import dotmf, dotmdmf, inv, dotmdm,dotmf
+from dtmm.linalg import dotmf, dotmdmf, inv, dotmdm,dotmf, dotmw, dotmm
 from dtmm.diffract import diffract
+from dtmm.data import unique_epsva
 from dtmm.fft import fft2, ifft2
+from dtmm.field import _dotmf, _pack, _unpack
 import numpy as np
-from dtmm.mode import fft_mask
+from dtmm.mode import fft_mask, mode_slices
 from dtmm.matrix import corrected_Epn_diffraction_matrix, corrected_field_diffraction_matrix, \
          first_corrected_Epn_diffraction_matrix, second_corrected_Epn_diffraction_matrix, \
          first_field_diffraction_matrix, second_field_diffraction_matrix
 
+class LayerOperators(object):
+    """Storage of the real-space layer operators of the 4x4 effective propagation.
+    
+    The eigenvalues and eigenvector matrices of the layers are computed on first 
+    use and are reused in the later passes (and substeps) of the same layer. 
+    Operators are stored as long as their total size fits in the memory budget,
+    the rest are recomputed on each use.
+    
+    Parameters
+    ----------
+    max_memory : float, optional
+        Memory budget in MB. Defaults to DTMMConfig.max_memory.
+    """
+    def __init__(self, max_memory = None):
+        self.max_memory = DTMMConfig.max_memory if max_memory is None else max_memory
+        self.nbytes = 0
+        self._data = {}
+        
+    def __len__(self):
+        return len(self._data)
+        
+    def get(self, key, func, *args):
+        """Returns the operators stored under key or computes them with func(*args)."""
+        try:
+            return self._data[key]
+        except KeyError:
+            result = func(*args)
+            nbytes = sum((r.nbytes for r in result))
+            if self.nbytes + nbytes <= self.max_memory * 1024**2:
+                self._data[key] = result
+                self.nbytes += nbytes
+            return result
+        
+def _alpha_e_ei(beta, phi, epsv, epsa):
+    alpha, f = alphaf(beta,phi,epsv,epsa)
+    e = E_mat(f, mode = None)
+    return alpha, e, inv(e)
+
+def _layer_operators(func, beta, phi, epsv, epsa, operators = None, key = None):
+    """Returns func(beta, phi, epsv, epsa), reused from operators if given."""
+    if operators is None:
+        return func(beta, phi, epsv, epsa)
+    return operators.get(key, func, beta, phi, epsv, epsa)
+
 def _transfer_ray_4x4_2(field, wavenumbers, layer,  beta = 0, phi=0,
                     nsteps = 1, dmatpn = None,
                     out = None, tmpdata = None):
@@ -79,24 +126,40 @@ def _transfer_ray_4x4_4(field, wavenumbers, layer,  beta = 0, phi=0,
 
 def _transfer_ray_4x4_1(field, wavenumbers, layer, dmat1, dmat2, beta = 0, phi=0,
                     nsteps = 1, 
-                    betamax = BETAMAX, out = None):
+                    betamax = BETAMAX, out = None, mask = None, operators = None, key = None):
+    """If mask is given, field is the packed modes of the fft field, 
+    see :func:`.field.ffield2modes`. If operators is given, the layer operators
+    are taken from (or stored to) the :class:`LayerOperators` under key."""
         
     d, epsv, epsa = layer
 
     kd = wavenumbers*d 
 
-    alpha, f = alphaf(beta,phi,epsv,epsa)
+    alpha, e, ei = _layer_operators(_alpha_e_ei, beta, phi, epsv, epsa, operators, key)
     p = phasem(alpha,kd[...,None,None])
     
-    e = E_mat(f, mode = None)
-    ei = inv(e)
+    if nsteps > 1:
+        #layer operator and merged dmat2, dmat1 of consecutive steps, formed once
+        lmat = dotmdm(e,p,ei)
+        dmat = dotmm(dmat1, dmat2)
+    
+    work = None
 
     for j in range(nsteps):
-        field = dotmf(dmat1,field, out = out)
-        field = ifft2(field, out = field)
-        field = dotmdmf(e,p,ei,field, out = field)  
-        field = fft2(field, out = field)
-        field = dotmf(dmat2,field, out = out)
+        field = _dotmf(dmat1 if j == 0 else dmat,field, mask, out = out)
+        if mask is None:
+            work = field
+        else:
+            #scatter modes to the full grid for the real space step
+            work = _unpack(field, mask, out = work)
+        work = ifft2(work, out = work)
+        if nsteps > 1:
+            work = dotmf(lmat, work, out = work)
+        else:
+            work = dotmdmf(e,p,ei,work, out = work)  
+        work = fft2(work, out = work)
+        field = _pack(work, mask, out = field)
+    field = _dotmf(dmat2,field, mask, out = out)
                   
     return field
 
@@ -134,21 +197,28 @@ def _transfer_ray_4x4_1_windows(windows, field, wavenumbers, layer, dmat1, dmat2
 
 def _transfer_ray_4x4_3(field, wavenumbers, layer, dmat1, dmat2, beta = 0, phi=0,
                     nsteps = 1, 
-                    betamax = BETAMAX, out = None):
+                    betamax = BETAMAX, out = None, operators = None, key = None):
         
     d, epsv, epsa = layer
 
     kd = wavenumbers*d 
 
-    alpha, f, fi = alphaffi(beta,phi,epsv,epsa)
+    alpha, f, fi = _layer_operators(alphaffi, beta, phi, epsv, epsa, operators, key)
     p = phasem(alpha,kd[...,None,None])
+    
+    if nsteps > 1:
+        lmat = dotmdm(f,p,fi)
+        dmat = dotmm(dmat1, dmat2)
 
     for j in range(nsteps):
-        field = dotmf(dmat1,field, out = out)
+        field = dotmf(dmat1 if j == 0 else dmat,field, out = out)
         field = ifft2(field, out = field)
-        field = dotmdmf(f,p,fi,field, out = field)  
+        if nsteps > 1:
+            field = dotmf(lmat, field, out = field)
+        else:
+            field = dotmdmf(f,p,fi,field, out = field)  
         field = fft2(field, out = field)
-        field = dotmf(dmat2,field, out = out)
+    field = dotmf(dmat2,field, out = out)
                   
     return field
 
@@ -375,18 +445,21 @@ def propagate_4x4_effective_1(field, wavenumbers, layer, effective_layer, beta =
 
 def propagate_4x4_effective_1(field, wavenumbers, layer, effective_layer, beta = 0, phi=0,
                     nsteps = 1, diffraction = True, 
-                    betamax = BETAMAX,out = None,_reuse = False ):
+                    betamax = BETAMAX,out = None,_reuse = False, mask = None, 
+                    operators = None, key = None):
     d_eff, epsv_eff, epsa_eff = effective_layer
+    shape = field.shape[-2:] if mask is None else mask.shape
 
     
     if diffraction == 1:
-        dmat1 = first_corrected_Epn_diffraction_matrix(field.shape[-2:], wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
+        dmat1 = first_corrected_Epn_diffraction_matrix(shape, wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
                                         epsa =  epsa_eff,betamax = betamax) 
-        dmat2 = second_corrected_Epn_diffraction_matrix(field.shape[-2:], wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
+        dmat2 = second_corrected_Epn_diffraction_matrix(shape, wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
                                         epsa =  epsa_eff,betamax = betamax) 
         return _transfer_ray_4x4_1(field, wavenumbers, layer,dmat1, dmat2, 
                                 beta = beta, phi = phi, nsteps =  nsteps, 
-                                betamax = betamax,  out = out)
+                                betamax = betamax,  out = out, mask = mask,
+                                operators = operators, key = key)
     elif diffraction > 1:
         fout = np.zeros_like(field)
         _out = None
@@ -398,24 +471,25 @@ def propagate_4x4_effective_1(field, wavenumbers, layer, effective_layer, beta =
         except IndexError:
             broadcast_shape = ()
             
-        windows, (betas, phis) = fft_mask(field.shape, wavenumbers, int(diffraction), 
+        windows, (betas, phis) = fft_mask(shape, wavenumbers, int(diffraction), 
                  betax_off = beta*np.cos(phi), betay_off = beta*np.sin(phi), betamax = betamax)    
 
         n = len(windows)
         betas = betas.reshape((n,) + broadcast_shape)
         phis = phis.reshape((n,) + broadcast_shape)
 
-        dmats1 = first_corrected_Epn_diffraction_matrix(field.shape[-2:], wavenumbers, betas, phis,d_eff/2, epsv = epsv_eff, 
+        dmats1 = first_corrected_Epn_diffraction_matrix(shape, wavenumbers, betas, phis,d_eff/2, epsv = epsv_eff, 
                                         epsa =  epsa_eff,betamax = betamax) 
-        dmats2 = second_corrected_Epn_diffraction_matrix(field.shape[-2:], wavenumbers, betas, phis,d_eff/2, epsv = epsv_eff, 
+        dmats2 = second_corrected_Epn_diffraction_matrix(shape, wavenumbers, betas, phis,d_eff/2, epsv = epsv_eff, 
                                         epsa =  epsa_eff,betamax = betamax) 
 
-        for window, beta, phi, dmat1, dmat2  in zip(windows, betas, phis, dmats1, dmats2):
-            fpart = np.multiply(field, window, out = _out)
+        for i, (window, beta, phi, dmat1, dmat2)  in enumerate(zip(windows, betas, phis, dmats1, dmats2)):
+            fpart = np.multiply(field, _pack(window, mask), out = _out)
             
             _out =  _transfer_ray_4x4_1(fpart, wavenumbers, layer, dmat1,dmat2,
                                 beta = beta, phi = phi, nsteps =  nsteps,
-                                betamax = betamax, out = _out)                       
+                                betamax = betamax, out = _out, mask = mask,
+                                operators = operators, key = (key, i))                       
             fout = np.add(fout, _out, out = fout)
 
 
@@ -425,9 +499,9 @@ def propagate_4x4_effective_1(field, wavenumbers, layer, effective_layer, beta =
 #            beta = b.reshape(broadcast_shape)
 #            phi = p.reshape(broadcast_shape)
 #
-#            dmat1 = second_field_diffraction_matrix(field.shape[-2:], wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
+#            dmat1 = second_field_diffraction_matrix(shape, wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
 #                                            epsa =  epsa_eff,betamax = betamax) 
-#            dmat2 = first_field_diffraction_matrix(field.shape[-2:], wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
+#            dmat2 = first_field_diffraction_matrix(shape, wavenumbers, beta, phi,d_eff/2, epsv = epsv_eff, 
 #                                            epsa =  epsa_eff,betamax = betamax) 
 #
 #            _out =  _transfer_ray_4x4_1(fpart, wavenumbers, layer, dmat1,dmat2,
@@ -446,7 +520,7 @@ def propagate_4x4_effective_1(field, wavenumbers, layer, effective_layer, beta =
 
 def propagate_4x4_effective_3(field, wavenumbers, layer, effective_layer, beta = 0, phi=0,
                     nsteps = 1, diffraction = True, 
-                    betamax = BETAMAX,out = None):
+                    betamax = BETAMAX,out = None, operators = None, key = None):
     d_eff, epsv_eff, epsa_eff = effective_layer
     
     if diffraction == 1:
@@ -456,7 +530,8 @@ def propagate_4x4_effective_3(field, wavenumbers, layer, effective_layer, beta =
                                         epsa =  epsa_eff,betamax = betamax) 
         return _transfer_ray_4x4_3(field, wavenumbers, layer,dmat1, dmat2, 
                                 beta = beta, phi = phi, nsteps =  nsteps, 
-                                betamax = betamax,  out = out)
+                                betamax = betamax,  out = out, 
+                                operators = operators, key = key)
     elif diffraction > 1:
         fout = np.zeros_like(field)
         _out = None
@@ -480,12 +555,13 @@ def propagate_4x4_effective_3(field, wavenumbers, layer, effective_layer, beta =
         dmats2 = first_field_diffraction_matrix(field.shape[-2:], wavenumbers, betas, phis,d_eff/2, epsv = epsv_eff, 
                                         epsa =  epsa_eff,betamax = betamax) 
 
-        for window, beta, phi, dmat1, dmat2  in zip(windows, betas, phis, dmats1, dmats2):
+        for i, (window, beta, phi, dmat1, dmat2)  in enumerate(zip(windows, betas, phis, dmats1, dmats2)):
             fpart = np.multiply(field, window, out = _out)
             
             _out =  _transfer_ray_4x4_3(fpart, wavenumbers, layer, dmat1,dmat2,
                                 beta = beta, phi = phi, nsteps =  nsteps,
-                                betamax = betamax, out = _out)                       
+                                betamax = betamax, out = _out, 
+                                operators = operators, key = (key, i))                       
             fout = np.add(fout, _out, out = fout)
 
 
@@ -514,7 +590,11 @@ def propagate_4x4_effective_3(field, wavenumbers, layer, effective_layer, beta =
  
 def propagate_4x4_full(field, wavenumbers, layer, 
                     nsteps = 1,  betamax = BETAMAX, out = None):
-
+    """Propagates field through a layer using full diffraction calculation.
+    
+    Eigensystems of all propagating modes are computed in batches, the size of
+    a batch is limited by DTMMConfig.max_memory (see :func:`.conf.set_max_memory`).
+    """
     shape = field.shape[-2:]
 
     d, epsv, epsa = layer
@@ -524,15 +604,18 @@ def propagate_4x4_full(field, wavenumbers, layer,
     if out is None:
         out = np.empty_like(field)
     
-    out_af = None
-    pm = None
-    
     ii,jj = np.meshgrid(range(shape[0]), range(shape[1]),copy = False, indexing = "ij") 
     
+    #eigensystems are computed for distinct materials only
+    (epsv, epsa), index = unique_epsva(shape, epsv, epsa)
+    
+    #temporary data per mode: alpha, f, fi, phase and the mode matrix 
+    nbytes = len(epsv) * (3*16 + 2*4) * np.dtype(conf.CDTYPE).itemsize
+    
     for step in range(nsteps):
         for i in range(len(wavenumbers)):
             ffield = fft2(field[...,i,:,:,:])
-            ofield = np.zeros_like(out[...,i,:,:,:])
+            ofield = np.zeros(ffield.shape, dtype = conf.CDTYPE)
             b,p = betaphi(shape,wavenumbers[i])
             mask = b < betamax
             
@@ -542,22 +625,12 @@ def propagate_4x4_full(field, wavenumbers, layer,
             phis = p[mask]
             iind = ii[mask]
             jind = jj[mask]
-              
-            for bp in sorted(zip(range(len(betas)),betas,phis,iind,jind),key = lambda el : el[1], reverse = False):     
-                        
-                #for j,bp in enumerate(zip(betas,phis,iind,jind)):     
-                              
-                j, beta, phi, ieig, jeig = bp
-
-                out_af = alphaffi(beta,phi,epsv,epsa, out = out_af)
-                alpha,f,fi = out_af                      
-                        
-                pm = phasem(alpha,kd[i], out = pm)
-                w = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = amplitude[...,j])
-                w = dotmdmf(f,pm,fi,w, out = w)
-                #m = dotmdm(f,pm,fi)
-                #w = dotmf(m,w, out = w)
-                np.add(ofield,w,ofield)
+            
+            for s in mode_slices(len(betas), nbytes):
+                alpha,f,fi = alphaffi(betas[s,None],phis[s,None],epsv,epsa)
+                pm = phasem(alpha,kd[i])
+                m = dotmdm(f,pm,fi)
+                dotmw(m, amplitude[...,s], iind[s], jind[s], ofield, index = index)
                 
             out[...,i,:,:,:] = ofield
         field = out
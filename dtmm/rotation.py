@@ -29,8 +29,9 @@ from numba import jit
 import numba as nb
 
 
-from dtmm.conf import NCDTYPE, NFDTYPE, NF32DTYPE, NF64DTYPE, NC64DTYPE,NC128DTYPE, \
-       CDTYPE, FDTYPE, NUMBA_TARGET, NUMBA_CACHE, NUMBA_FASTMATH
+from dtmm.conf import NCDTYPE, NFDTYPE, NF32DTYPE, NF64DTYPE, NC64DTYPE,NC128DTYPE, numba_signatures, \
+       NUMBA_TARGET, NUMBA_CACHE, NUMBA_FASTMATH
+import dtmm.conf as conf
 
 
 def rotation_vector2(angle, out=None):
@@ -53,7 +54,7 @@ def rotation_vector2(angle, out=None):
 
     # Create <out> if not provided
     if out is None:
-        out = np.empty(shape=c.shape + (2,), dtype=FDTYPE)
+        out = np.empty(shape=c.shape + (2,), dtype=conf.FDTYPE)
 
     # Store values
     out[..., 0] = c
@@ -68,7 +69,7 @@ def rotation_matrix2(angle, out = None):
     """
     c,s = np.cos(angle), np.sin(angle)
     if out is None:
-        out = np.empty(shape = c.shape + (2,2), dtype = FDTYPE)
+        out = np.empty(shape = c.shape + (2,2), dtype = conf.FDTYPE)
     out[...,0,0] = c
     out[...,1,1] = c
     out[...,0,1] = -s
@@ -82,7 +83,7 @@ def rotation_matrix_z(angle, out = None):
     """
     c,s = np.cos(angle), np.sin(angle)
     if out is None:
-        out = np.zeros(shape = c.shape + (3,3), dtype = FDTYPE)
+        out = np.zeros(shape = c.shape + (3,3), dtype = conf.FDTYPE)
     out[...,0,0] = c
     out[...,0,1] = -s
     out[...,1,0] = s
@@ -97,7 +98,7 @@ def rotation_matrix_y(angle, out = None):
     """
     c,s = np.cos(angle), np.sin(angle)
     if out is None:
-        out = np.zeros(shape = c.shape + (3,3), dtype = FDTYPE)
+        out = np.zeros(shape = c.shape + (3,3), dtype = conf.FDTYPE)
     out[...,0,0] = c
     out[...,0,2] = s
     out[...,1,1] = 1.
@@ -112,7 +113,7 @@ def rotation_matrix_x(angle, out = None):
     """
     c,s = np.cos(angle), np.sin(angle)
     if out is None:
-        out = np.zeros(shape = c.shape + (3,3), dtype = FDTYPE)
+        out = np.zeros(shape = c.shape + (3,3), dtype = conf.FDTYPE)
     out[...,0,0] = 1.
     out[...,1,1] = c
     out[...,1,2] = -s
@@ -281,7 +282,7 @@ def rotate_diagonal_tensor(R,diagonal,out = None):
 
 
         
-@jit([NCDTYPE[:](NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])],nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@jit(numba_signatures([NCDTYPE[:](NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]),nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _rotate_diagonal_tensor(R,diagonal,out):
     """Calculates out = R.diagonal.RT of a diagonal tensor"""
     for i in range(3):
@@ -292,7 +293,7 @@ def _rotate_diagonal_tensor(R,diagonal,out):
     return out
 
 
-@nb.guvectorize([(NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])], "(m,m),(n)->(n)", 
+@nb.guvectorize(numba_signatures([(NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:])]), "(m,m),(n)->(n)", 
                  target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def rotate_tensor(R,tensor,out):
     """Calculates out = R.tensor.RT of a tensor"
@@ -386,7 +387,7 @@ def rotate_vector(rotation_matrix, vector, out):
     _rotate_vector(rotation_matrix, vector, out)
     
 
-@jit([NFDTYPE[:,:](NFDTYPE,NFDTYPE[:],NFDTYPE[:,:])],nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH) 
+@jit(numba_signatures([NFDTYPE[:,:](NFDTYPE,NFDTYPE[:],NFDTYPE[:,:])]),nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH) 
 def _calc_rotations_uniaxial(phi0,element,R):
     theta = element[1]
     phi = element[2] -phi0
@@ -394,7 +395,7 @@ def _calc_rotations_uniaxial(phi0,element,R):
     return R    
 
 
-@jit([NFDTYPE[:,:](NFDTYPE,NFDTYPE[:],NFDTYPE[:,:])],nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH) 
+@jit(numba_signatures([NFDTYPE[:,:](NFDTYPE,NFDTYPE[:],NFDTYPE[:,:])]),nopython = True, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH) 
 def _calc_rotations(phi0,element,R):
     psi = element[0]
     theta = element[1]
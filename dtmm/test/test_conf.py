@@ -0,0 +1,137 @@
+import unittest, tempfile, os
+import numpy as np
+import dtmm.conf as conf
+
+@conf.cached_function
+def _ones(n):
+    return np.ones((n,), "int8")
+
+_ncalls = [0]
+
+@conf.cached_function(disk = True)
+def _arange(n):
+    _ncalls[0] += 1
+    return np.arange(n), np.ones(n)
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        conf.clear_cache(_ones)
+        _ones.cache.maxsize = 2
+        _ones.cache.maxbytes = None
+
+    def test_lru(self):
+        _ones(1)
+        _ones(2)
+        _ones(1) #hit, 2 is now least recently used
+        _ones(3) #evicts 2
+        self.assertTrue((1,) in _ones.cache and (3,) in _ones.cache)
+        self.assertFalse((2,) in _ones.cache)
+        info = _ones.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions, info.currsize, info.nbytes), (1,3,1,2,4))
+
+    def test_maxbytes(self):
+        _ones.cache.maxbytes = 10
+        _ones(6)
+        _ones(5) #evicts 6
+        self.assertEqual(len(_ones.cache), 1)
+        self.assertEqual(_ones.cache.nbytes, 5)
+        _ones(11) #too big to be cached
+        self.assertEqual(len(_ones.cache), 0)
+
+    def test_memory(self):
+        _ones.cache.maxsize = 10
+        memory = conf.DTMMConfig.cache_memory
+        conf.clear_cache()
+        conf.set_cache(1, memory = 20/1024**2)
+        try:
+            for n in (6,7,8):
+                _ones(n)
+        finally:
+            conf.set_cache(1, memory = memory)
+        self.assertEqual(_ones.cache.nbytes, 15)
+        self.assertTrue(conf.cache_info().nbytes <= 20)
+
+    def test_memory_large(self):
+        #result larger than the memory limit is kept until a new result is stored
+        memory = conf.DTMMConfig.cache_memory
+        conf.clear_cache()
+        conf.set_cache(1, memory = 20/1024**2)
+        try:
+            a = _ones(30)
+            hits = _ones.cache_info().hits
+            self.assertTrue(_ones(30) is a)
+            self.assertEqual(_ones.cache_info().hits, hits + 1)
+            _ones(31) #evicts 30
+            self.assertFalse((30,) in _ones.cache)
+            self.assertTrue((31,) in _ones.cache)
+        finally:
+            conf.set_cache(1, memory = memory)
+
+    def test_threads(self):
+        #cache hits in worker threads while results are evicted globally
+        from multiprocessing.pool import ThreadPool
+        _ones.cache.maxsize = 100
+        memory = conf.DTMMConfig.cache_memory
+        conf.set_cache(1, memory = 200/1024**2)
+        try:
+            with ThreadPool(4) as pool:
+                out = pool.map(lambda i : _ones(i % 40 + 1).sum(), range(4000))
+        finally:
+            conf.set_cache(1, memory = memory)
+        self.assertEqual(out, [i % 40 + 1 for i in range(4000)])
+        self.assertTrue(conf.cache_info().nbytes <= 200)
+
+    def test_array_key(self):
+        a = np.random.rand(100)
+        b = a.copy()
+        self.assertEqual(conf._array_key(a), conf._array_key(b))
+        self.assertNotEqual(conf._array_key(a), conf._array_key(a[::2]))
+        #read-only view of a writable array is not frozen
+        view = a[...]
+        view.setflags(write = False)
+        self.assertFalse(conf._is_frozen(view))
+        #read-only array that owns its data can be made writeable again
+        b.setflags(write = False)
+        self.assertFalse(conf._is_frozen(b))
+        key = conf._array_key(b)
+        b.setflags(write = True)
+        b[...] = 0.
+        b.setflags(write = False)
+        self.assertNotEqual(conf._array_key(b), key)
+        #immutable buffer
+        c = np.frombuffer(a.tobytes())
+        self.assertTrue(conf._is_frozen(c))
+        key = conf._array_key(c)
+        self.assertTrue(conf._array_keys[id(c)][1] is key)
+        self.assertTrue(conf._array_key(c) is key)
+
+class TestDiskCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = conf.DISK_CACHE_DIR
+        conf.DISK_CACHE_DIR = tempfile.mkdtemp()
+        self.disk_cache = conf.set_disk_cache(True, size = 1024)
+        
+    def tearDown(self):
+        conf.clear_disk_cache()
+        conf.DISK_CACHE_DIR = self.cache_dir
+        conf.set_disk_cache(self.disk_cache)
+    
+    def test_disk_cache(self):
+        a, b = _arange(10)
+        ncalls = _ncalls[0]
+        conf.clear_cache(_arange)
+        c, d = _arange(10)
+        self.assertEqual(_ncalls[0], ncalls)
+        self.assertTrue(isinstance(c, np.memmap))
+        self.assertTrue(np.allclose(a,c) and np.allclose(b,d))
+        
+    def test_disk_cache_size(self):
+        conf.set_disk_cache(True, size = 0)
+        _arange(11)
+        root = os.path.join(conf.DISK_CACHE_DIR, os.listdir(conf.DISK_CACHE_DIR)[0])
+        self.assertEqual(os.listdir(root), [])
+
+if __name__ == "__main__":
+    unittest.main()
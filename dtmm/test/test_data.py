@@ -50,6 +50,32 @@ class TestData(unittest.TestCase):
              rotated_data = data.rotate_director(rotation_matrix, test_data, norm = False)
              # Compare inner data, without boundaries 
              self.assertTrue(np.allclose(rotated_data_goal[1:-1,1:-1,1:-1], rotated_data[1:-1,1:-1,1:-1]))
+
+    def test_filter_eps(self):
+        #real input is filtered in the half spectrum, complex input in the full spectrum
+        for shape in ((8,9), (9,8), (8,8), (7,9)):
+            a = np.random.randn(2,*shape,6)
+            b = np.random.randn(2,*shape,6)
+            out_real = data.filter_eps(a, 1., betamax = 0.8)
+            out_imag = data.filter_eps(b, 1., betamax = 0.8)
+            out = data.filter_eps(a + 1j * b, 1., betamax = 0.8)
+            self.assertTrue(np.allclose(out_real.imag, 0.))
+            self.assertTrue(np.allclose(out, out_real + 1j * out_imag))
+            #frequencies above betamax are removed
+            self.assertFalse(np.allclose(out_real, a))
+
+    def test_read_director_precision(self):
+        import tempfile, os
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "director.raw")
+            for name in ("single", "double"):
+                with conf.precision(name):
+                    np.ones((2,3,4,3), conf.FDTYPE).tofile(fname)
+                    out = data.read_director(fname, (2,3,4,3))
+                    self.assertEqual(out.dtype, conf.FDTYPE)
+                    self.assertTrue(np.allclose(out, 1.))
+        #precision is looked up in conf, not patched into other modules
+        self.assertFalse(hasattr(data, "FDTYPE"))
         
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,10 @@
 """Tests for fft"""
 
-import unittest
+import unittest, tempfile, os
 import numpy as np
-from dtmm.fft import fft2, ifft2
+from dtmm.fft import fft2, ifft2, rfft2, irfft2, get_pool, save_fftw_wisdom, load_fftw_wisdom
 import dtmm.conf
-from dtmm.conf import MKL_FFT_INSTALLED
+from dtmm.conf import MKL_FFT_INSTALLED, SCIPY_FFT_INSTALLED, PYFFTW_INSTALLED
 
 class TestFFT(unittest.TestCase):
     
@@ -73,6 +73,62 @@ class TestFFT(unittest.TestCase):
         for a,out in self._fiarrays:
             self._assert_fft(ifft2, a, out)
 
+    def test_scfft_fft2(self):
+        if SCIPY_FFT_INSTALLED:
+            dtmm.conf.set_fftlib("scipy.fft")
+            for a,out in self._farrays:
+                self._assert_fft(fft2, a, out)
+
+    def test_scfft_ifft2(self):
+        if SCIPY_FFT_INSTALLED:
+            dtmm.conf.set_fftlib("scipy.fft")
+            for a,out in self._fiarrays:
+                self._assert_fft(ifft2, a, out)
+
+    def test_fftw_fft2(self):
+        if PYFFTW_INSTALLED:
+            dtmm.conf.set_fftlib("pyfftw")
+            for a,out in self._farrays:
+                self._assert_fft(fft2, a, out)
+                #second call reuses the plan
+                self._assert_fft(fft2, a, out)
+
+    def test_fftw_ifft2(self):
+        if PYFFTW_INSTALLED:
+            dtmm.conf.set_fftlib("pyfftw")
+            for a,out in self._fiarrays:
+                self._assert_fft(ifft2, a, out)
+                
+    def test_fftw_wisdom(self):
+        if PYFFTW_INSTALLED:
+            fname = os.path.join(tempfile.mkdtemp(), "wisdom.pickle")
+            save_fftw_wisdom(fname)
+            self.assertTrue(load_fftw_wisdom(fname))
+
+    def test_rfft2(self):
+        libs = ["numpy", "scipy"] + (["scipy.fft"] if SCIPY_FFT_INSTALLED else []) + \
+                (["pyfftw"] if PYFFTW_INSTALLED else [])
+        for lib in libs:
+            dtmm.conf.set_fftlib(lib)
+            for a, _ in self._farrays + [(np.random.randn(3,45,63),None)]:
+                a = a.real
+                af = np.fft.rfft2(a)
+                self.assertTrue(np.allclose(rfft2(a), af))
+                out = rfft2(a, out = np.empty_like(af))
+                self.assertTrue(np.allclose(out, af))
+                out = irfft2(af, s = a.shape[-2:], out = np.empty_like(a))
+                self.assertTrue(np.allclose(out, a))
+                
+    def test_threaded_fft2(self):
+        dtmm.conf.set_fftlib("scipy")
+        nthreads = dtmm.conf.set_nthreads(2)
+        try:
+            for a,out in self._farrays:
+                self._assert_fft(fft2, a, out)
+            pool = get_pool()
+            self.assertTrue(pool is get_pool())
+        finally:
+            dtmm.conf.set_nthreads(nthreads)
                 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import unittest
 import numpy as np
 import dtmm.linalg as linalg
+import dtmm.conf
 
 
 def vector2diagonal_matrix(vector):
@@ -65,6 +66,34 @@ class TestLinalg2(unittest.TestCase):
         matrices = [self.a, vector2diagonal_matrix(e), self.b, self.f]
         self.compare_results(out,matrices)        
 
+    def test_bdotmm(self):
+        m1 = np.random.randn(5,5,4,4)+1j*np.random.randn(5,5,4,4)
+        m2 = np.random.randn(5,5,4,4)+1j*np.random.randn(5,5,4,4)
+        out = linalg.bdotmm(m1,m2)
+        self.assertTrue(np.allclose(out,linalg._bdotmm_ref(m1,m2)))
+        self.assertTrue(np.allclose(linalg.mat2bmat(linalg.bmat2mat(m1)),m1))
+
+    def test_tree_dot(self):
+        ms = [np.random.randn(3,4,4)+1j*np.random.randn(3,4,4) for i in range(11)]
+        nthreads = dtmm.conf.set_nthreads(2)
+        try:
+            for reverse in (False, True):
+                seq = ms[::-1] if reverse else ms
+                ref = np.linalg.multi_dot([m[0] for m in seq])
+                for fanin in (2,3):
+                    out = linalg.tree_dot(ms, reverse = reverse, fanin = fanin)
+                    self.assertTrue(np.allclose(out[0],ref))
+                    out = linalg.tree_dot(iter(ms), reverse = reverse, fanin = fanin)
+                    self.assertTrue(np.allclose(out[0],ref))
+                    prefix = linalg.tree_dot(ms, reverse = reverse, fanin = fanin, prefix = True)
+                    self.assertEqual(len(prefix), len(ms))
+                    for i, p in enumerate(prefix):
+                        refp = linalg.multi_dot(ms[:i+1], reverse = reverse)
+                        self.assertTrue(np.allclose(p,refp))
+                self.assertTrue(np.allclose(linalg.multi_dot(ms, reverse = reverse)[0], ref))
+        finally:
+            dtmm.conf.set_nthreads(nthreads)
+
 #    def test_ftransmit(self):
 #        kd = 2.3
 #        out = linalg.ftransmit(kd,self.a,self.d.real,self.b,self.f)
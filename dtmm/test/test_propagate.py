@@ -0,0 +1,302 @@
+"""Tests for full diffraction propagation"""
+
+import unittest
+import os, tempfile
+import numpy as np
+from dtmm.propagate_4x4 import propagate_4x4_full, LayerOperators
+from dtmm.propagate_2x2 import propagate_2x2_full
+from dtmm.wave import eigenwave, betaphi
+from dtmm.tmm import alphaffi, phasem, alphaf, E_mat, E2H_mat, Eti_mat, Etri_mat, phase_mat
+from dtmm.linalg import dotmdmf, dotmf, dotmd, inv
+from dtmm.fft import fft2
+from dtmm.diffract import diffract, field_diffraction_matrix, compact_field_diffraction_matrix
+import dtmm.conf
+import dtmm
+
+def _propagate_4x4_full_ref(field, wavenumbers, layer, nsteps = 1,  betamax = 0.8):
+    """mode-by-mode implementation"""
+    shape = field.shape[-2:]
+    d, epsv, epsa = layer
+    kd = wavenumbers*d/nsteps
+    out = np.empty_like(field)
+    ii,jj = np.meshgrid(range(shape[0]), range(shape[1]),copy = False, indexing = "ij") 
+    for step in range(nsteps):
+        for i in range(len(wavenumbers)):
+            ffield = fft2(field[...,i,:,:,:])
+            ofield = np.zeros_like(out[...,i,:,:,:])
+            b,p = betaphi(shape,wavenumbers[i])
+            mask = b < betamax
+            amplitude = ffield[...,mask]
+            for j, (beta, phi, ieig, jeig) in enumerate(zip(b[mask],p[mask],ii[mask],jj[mask])):
+                alpha,f,fi = alphaffi(beta,phi,epsv,epsa)
+                pm = phasem(alpha,kd[i])
+                w = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = amplitude[...,j])
+                w = dotmdmf(f,pm,fi,w, out = w)
+                np.add(ofield,w,ofield)
+            out[...,i,:,:,:] = ofield
+        field = out
+    return out
+
+def _propagate_2x2_full_ref(field, wavenumbers, layer, input_layer = None, 
+                    nsteps = 1,  mode = +1, reflection = True,
+                    betamax = 0.8, refl = None, bulk = None):
+    """mode-by-mode implementation"""
+    shape = field.shape[-2:]
+    d, epsv, epsa = layer
+    if input_layer is not None:
+        d_in, epsv_in, epsa_in = input_layer
+    kd = wavenumbers*d/nsteps
+    out = np.empty_like(field)
+    ii,jj = np.meshgrid(range(shape[0]), range(shape[1]),copy = False, indexing = "ij") 
+    for step in range(nsteps):
+        for i in range(len(wavenumbers)):
+            ffield = fft2(field[...,i,:,:,:])
+            ofield = np.zeros_like(out[...,i,:,:,:])
+            b,p = betaphi(shape,wavenumbers[i])
+            mask = b < betamax
+            amplitude = ffield[...,mask]
+            if bulk is not None:
+                obulk = bulk[...,i,:,:,:]
+            if refl is not None:
+                tampl = fft2(refl[...,i,:,:,:])[...,mask]
+                orefl = refl[...,i,:,:,:]
+                orefl[...] = 0.
+            for j, (beta, phi, ieig, jeig) in enumerate(zip(b[mask],p[mask],ii[mask],jj[mask])):
+                alpha,fmat_out = alphaf(beta,phi,epsv,epsa)
+                e = E_mat(fmat_out, mode = mode)
+                ei0 = inv(e)
+                pm = phase_mat(alpha,kd[i,None,None],mode = mode)
+                w = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = amplitude[...,j])
+                if step == 0 and reflection != False:
+                    alphain, fmat_in = alphaf(beta,phi,epsv_in,epsa_in)
+                    if refl is not None:
+                        ei,eri = Etri_mat(fmat_in, fmat_out, mode = mode)
+                        ein =  E_mat(fmat_in, mode = -1*mode)
+                        t = eigenwave(amplitude.shape[:-1]+shape, ieig,jeig, amplitude = tampl[...,j])
+                        r = dotmf(eri, w)
+                        r = dotmf(ein,r, out = r)
+                        np.add(orefl,r,orefl)
+                        w = dotmf(ei, w, out = w)
+                        t = dotmf(ei0,t, out = t)
+                        w = np.add(t,w,out = w)
+                    else:
+                        ei = Eti_mat(fmat_in, fmat_out, mode = mode)
+                        w = dotmf(ei, w, out = w)
+                    w = dotmf(dotmd(e,pm),w, out = w)
+                else:
+                    w = dotmdmf(e,pm,ei0,w, out = w)
+                np.add(ofield,w,ofield)
+                if bulk is not None:
+                    e2h = E2H_mat(fmat_out, mode = mode)
+                    obulk[...,1::2,:,:] +=  dotmf(e2h, w)
+                    obulk[...,::2,:,:] += w
+            out[...,i,:,:,:] = ofield
+        field = out
+    return out, refl
+
+class TestFull(unittest.TestCase):
+    
+    def setUp(self):
+        shape = (12,10)
+        self.ks = np.array([5.,6.])
+        epsv = np.empty(shape + (3,))
+        epsv[...] = (2.,2.,2.5)
+        epsv[3:7,2:5] = (2.2,2.4,2.6)
+        epsa = np.zeros(shape + (3,))
+        epsa[...,1] = np.linspace(0,1,shape[1])
+        self.layer = (2., epsv, epsa)
+        self.input_layer = (0., np.ones(shape + (3,)), np.zeros(shape + (3,)))
+        self.field = np.random.randn(2,2,4,*shape) + 1j*np.random.randn(2,2,4,*shape)
+        self.efield = np.random.randn(2,2,2,*shape) + 1j*np.random.randn(2,2,2,*shape)
+        
+    def test_propagate_4x4_full(self):
+        ref = _propagate_4x4_full_ref(self.field, self.ks, self.layer, nsteps = 2)
+        for max_memory in (1024, 0.):
+            mem = dtmm.conf.set_max_memory(max_memory)
+            try:
+                out = propagate_4x4_full(self.field, self.ks, self.layer, nsteps = 2)
+            finally:
+                dtmm.conf.set_max_memory(mem)
+            self.assertTrue(np.allclose(out, ref))
+            
+    def test_propagate_2x2_full(self):
+        for reflection in (True, False):
+            ref, _ = _propagate_2x2_full_ref(self.efield, self.ks, self.layer, self.input_layer, 
+                                          nsteps = 2, reflection = reflection)
+            out, _ = propagate_2x2_full(self.efield, self.ks, self.layer, self.input_layer, 
+                                        nsteps = 2, reflection = reflection)
+            self.assertTrue(np.allclose(out, ref))
+
+    def test_propagate_2x2_full_refl_bulk(self):
+        refl0 = np.random.randn(*self.efield.shape) + 0j
+        refl_ref, refl = refl0.copy(), refl0.copy()
+        bulk_ref = np.zeros(self.field.shape, complex)
+        bulk = np.zeros(self.field.shape, complex)
+        ref, _ = _propagate_2x2_full_ref(self.efield, self.ks, self.layer, self.input_layer, 
+                                         refl = refl_ref, bulk = bulk_ref)
+        out, _ = propagate_2x2_full(self.efield, self.ks, self.layer, self.input_layer, 
+                                    refl = refl, bulk = bulk)
+        self.assertTrue(np.allclose(out, ref))
+        self.assertTrue(np.allclose(refl, refl_ref))
+        self.assertTrue(np.allclose(bulk, bulk_ref))
+
+class TestDiffract(unittest.TestCase):
+    
+    def setUp(self):
+        self.shape = (12,10)
+        self.ks = np.array([0.5,0.8,1.1])
+        self.field = np.random.randn(2,3,4,*self.shape) + 1j*np.random.randn(2,3,4,*self.shape)
+        
+    def test_compact_field_diffraction_matrix(self):
+        epsv = dtmm.refind2eps([1.5]*3)
+        for mode in ("b", "t", "r"):
+            dmat = field_diffraction_matrix(self.shape, self.ks, d = 3., epsv = epsv, mode = mode)
+            cmat = compact_field_diffraction_matrix(self.shape, self.ks, d = 3., epsv = epsv, mode = mode)
+            self.assertTrue(cmat.nbytes < dmat.nbytes)
+            self.assertTrue(np.allclose(np.asarray(cmat), dmat))
+            self.assertTrue(np.allclose(diffract(self.field, cmat), diffract(self.field, dmat)))
+        with self.assertRaises(ValueError):
+            compact_field_diffraction_matrix(self.shape, self.ks, epsv = (2.,2.,2.5))
+
+class TestTransfer(unittest.TestCase):
+    
+    def setUp(self):
+        self.optical_data = dtmm.nematic_droplet_data((4,12,12), radius = 3, profile = "r", 
+                                                       no = 1.5, ne = 1.6, nhost = 1.5)
+        self.wavelengths = dtmm.wavelengths(500,600,3)
+        beta, phi, _ = dtmm.illumination_rays(1,2)
+        self.field = dtmm.illumination_data((12,12), self.wavelengths, pixelsize = 200, 
+                                            beta = beta, phi = phi)[0]
+        
+    def _transfer(self, **kwargs):
+        field_data = self.field.copy(), self.wavelengths, 200
+        return dtmm.transfer_field(field_data, self.optical_data, **kwargs)[0]
+        
+    def test_transfer_field_workers(self):
+        for kwargs in (dict(split_wavelengths = True), dict(split_rays = True), 
+                       dict(split_rays = True, method = "2x2", eff_data = "uniaxial"),
+                       dict(split_wavelengths = True, npass = 2)):
+            ref = self._transfer(**kwargs)
+            out = self._transfer(workers = 2, **kwargs)
+            self.assertTrue(np.allclose(out, ref))
+
+    def test_transfer_field_process(self):
+        #jobs computed in worker processes, arrays in shared memory
+        for kwargs in (dict(split_wavelengths = True, npass = 2), dict(split_rays = True, npass = 2),
+                       dict(split_rays = True, method = "2x2", eff_data = "uniaxial", npass = 3)):
+            ref = self._transfer(**kwargs)
+            out = self._transfer(workers = 2, executor = "process", **kwargs)
+            self.assertTrue(np.allclose(out, ref))
+        #workers compute in the precision of the caller
+        with dtmm.conf.precision("single"):
+            ref = self._transfer(split_wavelengths = True)
+            out = self._transfer(split_wavelengths = True, workers = 2, executor = "process")
+        self.assertEqual(out.dtype, ref.dtype)
+        self.assertTrue(np.allclose(out, ref, atol = 1e-5))
+
+    def test_transfer_field_bulk_memmap(self):
+        fname = os.path.join(tempfile.mkdtemp(), "bulk.dtmf")
+        for method in ("2x2", "4x4"):
+            ref = self._transfer(ret_bulk = True, method = method, npass = 3)
+            out = self._transfer(ret_bulk = True, method = method, npass = 3, out = fname)
+            self.assertTrue(isinstance(out, np.memmap))
+            del out
+            out, wavelengths, pixelsize = dtmm.field.load_field(fname, mmap_mode = "r")
+            self.assertTrue(np.allclose(out, ref))
+            self.assertTrue(np.allclose(wavelengths, self.wavelengths))
+        os.remove(fname)
+
+    def test_memmap_field(self):
+        fname = os.path.join(tempfile.mkdtemp(), "field.dtmf")
+        for name, dtype in (("single", "complex64"), ("mixed", "complex64"), ("double", "complex128")):
+            with dtmm.conf.precision(name):
+                out = dtmm.field.memmap_field(fname, self.field.shape, self.wavelengths, 200)[0]
+            self.assertEqual(out.dtype, np.dtype(dtype))
+            del out
+        os.remove(fname)
+
+    def test_transfer_packed(self):
+        for method in ("2x2", "4x4"):
+            for kwargs in (dict(), dict(npass = 3), dict(ret_bulk = True),
+                           dict(reflection = 1, npass = 3)):
+                ref = self._transfer(method = method, **kwargs)
+                dtmm.conf.DTMMConfig.packed = True
+                try:
+                    out = self._transfer(method = method, **kwargs)
+                finally:
+                    dtmm.conf.DTMMConfig.packed = False
+                self.assertTrue(np.allclose(out, ref))
+
+    def test_transfer_nstep(self):
+        #nstep substeps of a layer are equivalent to nstep thinner layers
+        d, epsv, epsa = self.optical_data
+        split_data = np.repeat(d/3,3), np.repeat(epsv,3,axis = 0), np.repeat(epsa,3,axis = 0)
+        for npass in (1,2):
+            ref = dtmm.transfer_field((self.field.copy(), self.wavelengths, 200), split_data, 
+                                      npass = npass)[0]
+            out = self._transfer(nstep = 3, npass = npass)
+            self.assertTrue(np.allclose(out, ref))
+            
+    def test_transfer_4x4_operators(self):
+        #layer operators reused between passes, or recomputed when out of memory budget
+        for reflection in (1,3):
+            ref = self._transfer(method = "4x4", npass = 3, reflection = reflection)
+            mem = dtmm.conf.set_max_memory(0.)
+            try:
+                out = self._transfer(method = "4x4", npass = 3, reflection = reflection)
+            finally:
+                dtmm.conf.set_max_memory(mem)
+            self.assertTrue(np.allclose(out, ref))
+            
+    def test_layer_operators(self):
+        ops = LayerOperators(max_memory = 1e-3)
+        func = lambda n : (np.zeros((n,)),)
+        a = ops.get(0, func, 10)
+        self.assertTrue(ops.get(0, func, 10) is a)
+        self.assertEqual(ops.nbytes, a[0].nbytes)
+        #does not fit in the budget, computed on each call
+        b = ops.get(1, func, 1000)
+        self.assertFalse(ops.get(1, func, 1000) is b)
+        self.assertEqual(len(ops), 1)
+            
+    def test_transfer_single_precision(self):
+        for method, name in (("2x2", "single"), ("4x4", "single"), ("4x4", "mixed")):
+            ref = self._transfer(method = method, npass = 2)
+            with dtmm.conf.precision(name):
+                self.assertEqual(dtmm.conf.CDTYPE, np.dtype("complex64"))
+                field_data = dtmm.field.validate_field_data((self.field, self.wavelengths, 200))
+                out = dtmm.transfer_field(field_data, self.optical_data, method = method, npass = 2)[0]
+            self.assertEqual(out.dtype, np.dtype("complex64"))
+            self.assertEqual(dtmm.conf.CDTYPE, ref.dtype)
+            self.assertTrue(np.allclose(out, ref, atol = 1e-4))
+
+    def test_transfer_mixed_precision_error(self):
+        #verbose mode estimates the error of mixed precision
+        import io, contextlib
+        for wavelengths, field in ((self.wavelengths, self.field), (self.wavelengths[0], self.field[...,0,:,:,:])):
+            stdout = io.StringIO()
+            with dtmm.conf.precision("mixed"):
+                verbose = dtmm.conf.set_verbose(2)
+                try:
+                    with contextlib.redirect_stdout(stdout):
+                        out = dtmm.transfer_field((field.copy(), wavelengths, 200), self.optical_data, method = "4x4")[0]
+                finally:
+                    dtmm.conf.set_verbose(verbose)
+                #reference is computed without changing the precision
+                self.assertEqual(dtmm.conf.CDTYPE, np.dtype("complex64"))
+            self.assertEqual(out.shape, field.shape)
+            line = [l for l in stdout.getvalue().splitlines() if "Mixed precision error estimate" in l][0]
+            #the reference is computed on the first wavelength only, so it is 
+            #only an estimate of the actual error
+            self.assertTrue(0 < float(line.split(":")[-1]) < 1e-2)
+
+    def test_iter_transfer(self):
+        for method in ("2x2", "4x4"):
+            bulk = self._transfer(ret_bulk = True, method = method)
+            field_data = self.field.copy(), self.wavelengths, 200
+            for i, field in dtmm.iter_transfer(field_data, self.optical_data, method = method):
+                self.assertTrue(np.allclose(field, bulk[i]))
+            self.assertEqual(i, len(bulk) - 1)
+                
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,13 @@
 
 import unittest
 import numpy as np
-from dtmm.tmm import f_iso, fvec, fvec2E, E2fvec
+from dtmm.tmm import f_iso, fvec, fvec2E, E2fvec, stack_mat, stack_mat_sweep, \
+    system_mat, reflection_mat, scattering_mat, star_product
+import dtmm.tmm
+from dtmm.tmm3d import stack_mat3d, layer_mat3d, scattering_mat3d, f_iso3d, system_mat3d, reflection_mat3d, fmat3d
+from dtmm.tmm2d import stack_mat2d, scattering_mat2d, f_iso2d, system_mat2d, reflection_mat2d
+from dtmm.wave import eigenbeta1, betaxy2beta, betaxy2phi
+from dtmm.linalg import bdotmm
 import dtmm.conf
 from dtmm.conf import MKL_FFT_INSTALLED
 
@@ -28,6 +34,243 @@ class TestConversion(unittest.TestCase):
         self.assertTrue(np.allclose(jm, np.asarray((0j,0j)),atol = 1e-6)) 
 
 
+
+class TestAlphaf(unittest.TestCase):
+    
+    def setUp(self):
+        self.epsv = np.empty((4,5,3), complex)
+        self.epsv[...] = (2.,2.2,2.5) #biaxial
+        self.epsv[0] = 2.3 #isotropic
+        self.epsv[1] = (2.,2.,2.4) #uniaxial
+        self.epsv[3,2:] = (2.+0.1j,2.2,2.5) #absorbing biaxial
+        self.epsa = np.random.RandomState(0).rand(4,5,3)
+        self.beta = np.array([0.,0.4])[:,None,None]
+        
+    def test_alphaf_batched(self):
+        alpha, f = dtmm.tmm.alphaf(self.beta, 0.3, self.epsv, self.epsa)
+        for index in np.ndindex(alpha.shape[:-1]):
+            a, fi = dtmm.tmm.alphaf(self.beta[index[0],0,0], 0.3, self.epsv[index[1:]], self.epsa[index[1:]])
+            self.assertTrue(np.allclose(alpha[index], a))
+            self.assertTrue(np.allclose(f[index], fi))
+        #biaxial elements in batches
+        mem = dtmm.conf.set_max_memory(0.)
+        try:
+            out = dtmm.tmm.alphaf(self.beta, 0.3, self.epsv, self.epsa)
+        finally:
+            dtmm.conf.set_max_memory(mem)
+        self.assertTrue(np.allclose(out[0], alpha))
+        self.assertTrue(np.allclose(out[1], f))
+            
+    def test_alphaf_biaxial_real(self):
+        #real and complex eigenvalue solvers, same order and normalization of eigenvectors
+        a0, f0 = dtmm.tmm.alphaf(0.4, 0.3, self.epsv[2], self.epsa[2])
+        a1, f1 = dtmm.tmm.alphaf(0.4, 0.3, self.epsv[2] + 1e-12j, self.epsa[2])
+        self.assertTrue(np.allclose(a0, a1))
+        self.assertTrue(np.allclose(f0, f1))
+
+class TestStack(unittest.TestCase):
+    
+    def setUp(self):
+        n = 9
+        self.epsv = np.random.rand(n,3) + 2.
+        self.epsv[:,1] = self.epsv[:,0]
+        self.epsv[2] = 2.3 #isotropic
+        self.epsv[4] = (2.,2.2,2.5) #biaxial
+        self.epsa = np.random.rand(n,3)
+        self.kd = np.random.rand(n)[:,None] * np.array([5.,6.,7.])
+        self.beta = np.array([0.,0.2,0.5])[:,None,None]
+        
+    def test_stack_mat_sweep(self):
+        for method in ("4x4", "2x2"):
+            ref = stack_mat(self.kd, self.epsv, self.epsa, beta = self.beta, phi = 0.3, method = method)
+            out = stack_mat_sweep(self.kd, self.epsv, self.epsa, beta = self.beta, phi = 0.3, method = method)
+            self.assertEqual(out.shape, ref.shape)
+            self.assertTrue(np.allclose(out, ref))
+            
+    def test_stack_mat_repeat(self):
+        kd, epsv, epsa = (np.concatenate((a,)*5) for a in (self.kd, self.epsv, self.epsa))
+        for method in ("4x4", "2x2"):
+            ref = stack_mat(kd, epsv, epsa, beta = 0.2, method = method)
+            out = stack_mat(self.kd, self.epsv, self.epsa, beta = 0.2, method = method, repeat = 5)
+            self.assertTrue(np.allclose(out, ref))
+            out = stack_mat_sweep(self.kd, self.epsv, self.epsa, beta = 0.2, method = method, repeat = 5)
+            self.assertTrue(np.allclose(out, ref))
+        with self.assertRaises(ValueError):
+            stack_mat(self.kd, self.epsv, self.epsa, method = "2x2_1", repeat = 5)
+            
+    def test_stack_mat_sweep_chunks(self):
+        #layers split into chunks and reduced pairwise, as in parallel mode
+        parallel, nthreads = dtmm.tmm.NUMBA_PARALLEL, dtmm.conf.DTMMConfig.nthreads
+        for method in ("4x4", "2x2"):
+            ref = stack_mat(self.kd[:,0], self.epsv, self.epsa, beta = 0.2, method = method)
+            dtmm.tmm.NUMBA_PARALLEL, dtmm.conf.DTMMConfig.nthreads = True, 4
+            try:
+                out = stack_mat_sweep(self.kd[:,0], self.epsv, self.epsa, beta = 0.2, method = method)
+            finally:
+                dtmm.tmm.NUMBA_PARALLEL, dtmm.conf.DTMMConfig.nthreads = parallel, nthreads
+            self.assertTrue(np.allclose(out, ref))
+
+    def test_scattering_mat(self):
+        fmatin = f_iso(n = 1.5, beta = self.beta, phi = 0.3)
+        fmatout = f_iso(n = 1.2, beta = self.beta, phi = 0.3)
+        for repeat in (1, 3):
+            cmat = stack_mat(self.kd, self.epsv, self.epsa, beta = self.beta, phi = 0.3, repeat = repeat)
+            ref = reflection_mat(system_mat(cmat, fmatin, fmatout))
+            out = scattering_mat(self.kd, self.epsv, self.epsa, beta = self.beta, phi = 0.3, 
+                                 fmatin = fmatin, fmatout = fmatout, repeat = repeat)
+            self.assertEqual(out.shape, ref.shape)
+            self.assertTrue(np.allclose(out, ref))
+        #thick absorbing stack
+        out = scattering_mat(self.kd*1e4, self.epsv + 0.05j, self.epsa, beta = self.beta, phi = 0.3)
+        self.assertTrue(np.all(np.isfinite(out)))
+        self.assertTrue(np.allclose(out[...,0::2,0::2], 0.))
+        
+    def test_transfer4x4(self):
+        #oblique incidence, transfer matrices computed at beta and phi of the field
+        fmatin = f_iso(n = 1.5, beta = 0.2, phi = 0.3)
+        fmatout = f_iso(n = 1.2, beta = 0.2, phi = 0.3)
+        fvec_in = fvec(fmatin, jones = (1,0.5j), mode = +1)
+        cmat = stack_mat(self.kd[:,0], self.epsv, self.epsa, beta = 0.2, phi = 0.3)
+        ref = dtmm.tmm.transmit4x4(fvec_in.copy(), cmat = cmat, fmatin = fmatin, fmatout = fmatout)
+        for method in ("4x4", "4x4_s"):
+            out = dtmm.tmm.transfer4x4(fvec_in.copy(), self.kd[:,0], self.epsv, self.epsa, 
+                                       beta = 0.2, phi = 0.3, nin = 1.5, nout = 1.2, method = method)
+            self.assertTrue(np.allclose(out, ref))
+        
+    def test_star_product(self):
+        a = np.random.randn(3,8,8) + 1j*np.random.randn(3,8,8)
+        b = np.random.randn(3,8,8) + 1j*np.random.randn(3,8,8)
+        out = star_product(a[:,:4,:4],b[:,:4,:4])
+        ref = dtmm.tmm._star_product(a[:,:4,:4],b[:,:4,:4])
+        self.assertTrue(np.allclose(out, ref))
+        #star product of scattering matrices is the product of system matrices
+        ref = reflection_mat(np.matmul(a,b))
+        out = star_product(reflection_mat(a), reflection_mat(b))
+        self.assertTrue(np.allclose(out, ref))
                 
+class TestStack3d(unittest.TestCase):
+    
+    def setUp(self):
+        shape = (12,14)
+        self.epsv = np.ones((3,)+shape+(3,))*2.
+        self.epsv[:,3:6,4:9] = (2.1,2.2,2.4)
+        self.epsa = np.zeros((3,)+shape+(3,))
+        self.epsa[:,3:6,4:9,1] = 0.3
+        self.k = np.array([5.,6.])
+        self.d = np.array([1.,2.,0.5])
+
+    def test_stack_mat3d(self):
+        for method in ("4x4", "2x2"):
+            out = stack_mat3d(self.k, self.d, self.epsv, self.epsa, method = method)
+            out0 = stack_mat3d(self.k[0], self.d, self.epsv, self.epsa, method = method)
+            self.assertTrue(np.allclose(out[0],out0))
+            
+            mem = dtmm.conf.set_max_memory(0.)
+            nthreads = dtmm.conf.set_nthreads(2)
+            progress = []
+            try:
+                out1 = stack_mat3d(self.k, self.d, self.epsv, self.epsa, method = method,
+                                   callback = lambda i, n, eta : progress.append(i))
+            finally:
+                dtmm.conf.set_max_memory(mem)
+                dtmm.conf.set_nthreads(nthreads)
+            self.assertEqual(progress, [1,2,3])
+            for a,b in zip(out, out1):
+                self.assertTrue(np.allclose(a,b))
+
+    def test_stack_mat3d_repeat(self):
+        d, epsv, epsa = (np.concatenate((a,)*3) for a in (self.d, self.epsv, self.epsa))
+        for method in ("4x4", "2x2"):
+            ref = stack_mat3d(self.k[0], d, epsv, epsa, method = method)
+            out = stack_mat3d(self.k[0], self.d, self.epsv, self.epsa, method = method, repeat = 3)
+            self.assertTrue(np.allclose(out, ref))
+
+    def test_scattering_mat3d(self):
+        #homogeneous, repeated and inhomogeneous layers
+        epsv = np.concatenate((self.epsv[0:1]*0+1.5, self.epsv, self.epsv[0:1]*0+2.))
+        epsa = np.concatenate((self.epsa[0:1]*0, self.epsa, self.epsa[0:1]*0))
+        d = np.array([1.,1.,1.,1.,2.])
+        shape = self.epsv.shape[1:3]
+        fmatin = f_iso3d(shape, self.k, n = 1.3)
+        fmatout = f_iso3d(shape, self.k, n = 1.1)
+        ref = reflection_mat3d(system_mat3d(fmatin, stack_mat3d(self.k, d, epsv, epsa), fmatout))
+        out = scattering_mat3d(self.k, d, epsv, epsa, fmatin, fmatout)
+        for a,b in zip(out, ref):
+            self.assertTrue(np.allclose(a,b))
+
+    def test_scattering_mat3d_thick(self):
+        #thick absorbing layers, no light is transmitted
+        epsv, epsa = self.epsv[:,:6,:7] + 0.05j, self.epsa[:,:6,:7]
+        fmatin = f_iso3d((6,7), self.k, n = 1.3)
+        fmatout = f_iso3d((6,7), self.k, n = 1.1)
+        out = scattering_mat3d(self.k, self.d*1e6, epsv, epsa, fmatin, fmatout)
+        for o in out:
+            self.assertTrue(np.all(np.isfinite(o)))
+            self.assertTrue(np.allclose(o[0::2,0::2], 0.))
+        #same as homogeneous layer, computed from the eigensystem of the layer system matrix
+        epsv = epsv[0:1]*0 + epsv[0:1,3,4]
+        ref = scattering_mat3d(self.k, [1e6], epsv, epsa[0:1], fmatin, fmatout)
+        epsv[0,0,0,0] += 1e-13
+        out = scattering_mat3d(self.k, [1e6], epsv, epsa[0:1], fmatin, fmatout)
+        for a,b in zip(out, ref):
+            self.assertTrue(np.allclose(a,b))
+
+    def test_scattering_mat3d_invalid(self):
+        #sublayer splitting is bounded
+        epsv = self.epsv[:,:6,:7].copy()
+        epsv[0,0,0,0] = np.nan
+        fmatin = f_iso3d((6,7), self.k, n = 1.3)
+        with self.assertRaises(ValueError):
+            scattering_mat3d(self.k, self.d, epsv, self.epsa[:,:6,:7], fmatin, fmatin)
+
+    def test_stack_mat3d_homogeneous(self):
+        #homogeneous, repeated and inhomogeneous layers
+        epsv = np.concatenate((self.epsv[0:1]*0+1.5, self.epsv, self.epsv[0:1]*0+2.))
+        epsa = np.concatenate((self.epsa[0:1]*0, self.epsa, self.epsa[0:1]*0))
+        d = np.array([1.,1.,1.,1.,2.])
+        out = stack_mat3d(self.k[0], d, epsv, epsa)
+        ref = layer_mat3d(self.k[0], d[0], epsv[0], epsa[0])
+        for i in range(1,len(d)):
+            ref = bdotmm(ref, layer_mat3d(self.k[0], d[i], epsv[i], epsa[i]))
+        self.assertTrue(np.allclose(out, ref))
+        
+class TestStack2d(unittest.TestCase):
+    
+    def setUp(self):
+        n = 24
+        self.epsv = np.ones((3,n,3))*2.
+        self.epsv[:,5:12] = (2.1,2.2,2.4)
+        self.epsa = np.zeros((3,n,3))
+        self.epsa[:,5:12,1] = 0.3
+        self.k = np.array([5.,6.])
+        self.d = np.array([1.,2.,0.5])
+        self.fmatin = f_iso2d(n, self.k, n = 1.3, betay = 0.1)
+        self.fmatout = f_iso2d(n, self.k, n = 1.1, betay = 0.1)
+
+    def test_scattering_mat2d(self):
+        cmat = stack_mat2d(self.k, self.d, self.epsv, self.epsa, betay = 0.1)
+        ref = reflection_mat2d(system_mat2d(self.fmatin, cmat, self.fmatout))
+        out = scattering_mat2d(self.k, self.d, self.epsv, self.epsa, self.fmatin, self.fmatout, betay = 0.1)
+        for a,b in zip(out, ref):
+            self.assertTrue(np.allclose(a,b))
+        out0 = scattering_mat2d(self.k[0], self.d, self.epsv, self.epsa, self.fmatin[0], self.fmatout[0], betay = 0.1)
+        self.assertTrue(np.allclose(out0, out[0]))
+
+    def test_scattering_mat2d_thick(self):
+        #thick absorbing layers, no light is transmitted
+        epsv = self.epsv + 0.05j
+        out = scattering_mat2d(self.k, self.d*1e6, epsv, self.epsa, self.fmatin, self.fmatout, betay = 0.1)
+        for o in out:
+            self.assertTrue(np.all(np.isfinite(o)))
+            self.assertTrue(np.allclose(o[0::2,0::2], 0.))
+        #homogeneous layer, same as for the modes
+        epsv, epsa = epsv[0:1]*0 + epsv[0,6], self.epsa[0:1]*0 + self.epsa[0,6]
+        out = scattering_mat2d(self.k, [1e6], epsv, epsa, self.fmatin, self.fmatout, betay = 0.1)
+        for k, o, fin, fout in zip(self.k, out, self.fmatin, self.fmatout):
+            betax = eigenbeta1(24, k)
+            beta, phi = betaxy2beta(betax, 0.1), betaxy2phi(betax, 0.1)
+            ref = scattering_mat([k*1e6], epsv[:,0], epsa[:,0], beta = beta, phi = phi, fmatin = fin, fmatout = fout)
+            self.assertTrue(np.allclose(o, fmat3d(ref)))
+        
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -34,7 +34,8 @@ Layer/stack computation
 +++++++++++++++++++++++
 
 * :func:`.layer_mat` for layer matrix calculation Mi=Fi.Pi.Fi^-1
-* :func:`.stack_mat` for stack matrix caluclation M = M1.M2.M3....
+* :func:`.stack_mat` for stack matrix caluclation M = M1.M2.M3.... (or of a periodic stack)
+* :func:`.stack_mat_sweep` for stack matrices of a batch (parameter sweep) of stacks
 * :func:`.system_mat` for system matrix calculation Fin^-1.M.Fout
 
 Transmission/reflection calculation 
@@ -61,13 +62,15 @@ from __future__ import absolute_import, print_function, division
 
 import numpy as np
 
-from dtmm.conf import NCDTYPE,NFDTYPE, CDTYPE, FDTYPE, NUMBA_TARGET, \
-                        NUMBA_PARALLEL, NUMBA_CACHE, NUMBA_FASTMATH, DTMMConfig
+from dtmm.conf import NCDTYPE,NFDTYPE, numba_signatures, NUMBA_TARGET, \
+                        NUMBA_PARALLEL, NUMBA_CACHE, NUMBA_FASTMATH, DTMMConfig, F64DTYPE, C128DTYPE
+import dtmm.conf as conf
 from dtmm.rotation import  _calc_rotations_uniaxial, _calc_rotations, _rotate_diagonal_tensor
-from dtmm.linalg import _dotr2m, dotmdm, dotmm, inv, dotmv, _dotr2v
+from dtmm.linalg import _dotr2m, dotmdm, dotmm, inv, dotmv, _dotr2v, _dotmm2, _dotmm4, _inv2x2, tree_dot, _buffered, matrix_power
 from dtmm.data import refind2eps
 from dtmm.rotation import rotation_vector2
 from dtmm.print_tools import print_progress
+from dtmm.mode import mode_slices
 
 import numba as nb
 from numba import prange
@@ -96,7 +99,7 @@ def _mode_to_int(mode):
         raise ValueError("Invalid propagation mode '{}'.".format(mode))
 
 
-@nb.njit([(NFDTYPE,NCDTYPE[:],NCDTYPE[:,:])])                                                                
+@nb.njit(numba_signatures([(NFDTYPE,NCDTYPE[:],NCDTYPE[:,:])]))                                                                
 def _auxiliary_matrix(beta,eps,Lm):
     """Computes all elements of the auxiliary matrix of shape 4x4."""
     eps2m = 1./eps[2]
@@ -120,7 +123,7 @@ def _auxiliary_matrix(beta,eps,Lm):
     Lm[3,2] = beta * beta + eps[5]*eps5eps2m - eps[1]  
     Lm[3,3] = 0.  
 
-@nb.njit([(NFDTYPE,NCDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@nb.njit(numba_signatures([(NFDTYPE,NCDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _alphaf_iso(beta,eps0,alpha,F):
     """computes eigenvalue alpha and eigenvector field matrix of isotropic material"""
     #n = eps0[0]**0.5
@@ -153,7 +156,7 @@ def _alphaf_iso(beta,eps0,alpha,F):
         F[...]=0.
         alpha[...] = 0.
 
-@nb.njit([(NFDTYPE,NCDTYPE[:],NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+@nb.njit(numba_signatures([(NFDTYPE,NCDTYPE[:],NFDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _alphaf_uniaxial(beta,eps0,R,alpha,F): 
     """computes eigenvalue alpha and eigenvector field matrix of uniaxial material"""
     #uniaxial case
@@ -274,16 +277,41 @@ def _alphaf_uniaxial(beta,eps0,R,alpha,F):
         
         
 
-@nb.njit([NFDTYPE(NCDTYPE[:])], cache = NUMBA_CACHE)
+@nb.njit(numba_signatures([NFDTYPE(NCDTYPE[:])]), cache = NUMBA_CACHE)
 def _poynting(field):
     """Computes poynting vector from the field vector"""
     tmp1 = (field[0].real * field[1].real + field[0].imag * field[1].imag)
     tmp2 = (field[2].real * field[3].real + field[2].imag * field[3].imag)
     return tmp1-tmp2 
 
-@nb.njit([(NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])], cache = NUMBA_CACHE)
+@nb.njit(numba_signatures([NFDTYPE(NCDTYPE[:])]), cache = NUMBA_CACHE)
+def _polarization(field):
+    """Computes degree of x-polarization (1 for x, -1 for y) from the field vector"""
+    ex = field[0].real * field[0].real + field[0].imag * field[0].imag
+    ey = field[2].real * field[2].real + field[2].imag * field[2].imag
+    if ex + ey == 0.:
+        return 0.
+    return (ex - ey) / (ex + ey)
+
+@nb.njit(numba_signatures([(nb.int64,nb.int64,NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE)
+def _sort_pair(i,j,alpha,fmat):
+    """Puts the more x-polarized of modes i and j at index i. Modes of 
+    equal polarization are sorted by the real part of the eigenvalue."""
+    pi = _polarization(fmat[:,i])
+    pj = _polarization(fmat[:,j])
+    if abs(pi - pj) < 1e-6:
+        swap = alpha[j].real > alpha[i].real
+    else:
+        swap = pj > pi
+    if swap:
+        for k in range(4):
+            fmat[k,i], fmat[k,j] = fmat[k,j], fmat[k,i]
+        alpha[i], alpha[j] = alpha[j], alpha[i]
+
+@nb.njit(numba_signatures([(NCDTYPE[:],NCDTYPE[:,:],NCDTYPE[:],NCDTYPE[:,:])]), cache = NUMBA_CACHE)
 def _copy_sorted(alpha,fmat, out_alpha, out_fmat):
-    """Eigen modes sorting based on the computed poynting vector direction"""
+    """Eigen modes sorting based on the computed poynting vector direction.
+    Modes within the forward and backward pairs are sorted by polarization."""
     i = 0
     j = 1
     
@@ -352,68 +380,124 @@ def _copy_sorted(alpha,fmat, out_alpha, out_fmat):
             #indicate that something went wrong, and that sorting was unsucesful
             out_alpha[i] = np.nan
             out_fmat[:,i] = 0
+    else:
+        #order of the modes within the forward and backward pairs should not 
+        #depend on the eigenvalue solver, so sort them by polarization
+        _sort_pair(0,2,out_alpha,out_fmat)
+        _sort_pair(1,3,out_alpha,out_fmat)
+
             
             
-@nb.guvectorize([(NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])],
+@nb.guvectorize(numba_signatures([(NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])]),
                  "(),(),(m),(l),(k),(n)->(n),(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _alphaf_vec(beta,phi,rv,epsv,epsa,dummy,alpha,F):
-    """eigenvalue solver. Depending on the material parameter
-    we choose isotropic, uniaxial  or a biaxial solver.
+    """eigenvalue solver of isotropic and uniaxial material. Biaxial elements
+    are not computed, see :func:`_alphaf_biaxial`.
     
     Becaue the auxiliary matrix is written in the rotated frame (in the plane of incidence with phi = 0)
     We need to rotate the computed vectors using _dotr2m 
     """
-    #F is a 4x4 matrix... we can use 3x3 part for Rotation matrix and F[3] for eps  temporary data
+    #F is a 4x4 matrix... we can use 3x3 part for Rotation matrix
     
     #isotropic case
     if (epsv[0] == epsv[1] and epsv[1]==epsv[2]):
-        eps = F[3] 
         _alphaf_iso(beta[0],epsv,alpha,F)
         _dotr2m(rv,F,F)
     #uniaxial
     elif (epsv[0] == epsv[1]):
         R = F.real
-        eps = F[3] 
         _calc_rotations_uniaxial(phi[0],epsa,R) #store rotation matrix in Fi.real[0:3,0:3]
         _alphaf_uniaxial(beta[0],epsv,R,alpha,F)
         _dotr2m(rv,F,F)
-    else:#biaxial case
-        R = F.real 
-        eps = F.ravel() #reuse F memory (eps is length 6 1D array)
-        _calc_rotations(phi[0],epsa,R) #store rotation matrix in Fi.real[0:3,0:3]
-        _rotate_diagonal_tensor(R,epsv,eps)
-        _auxiliary_matrix(beta[0],eps,F) #calculate Lm matrix and put it to F
-        alpha0,F0 = np.linalg.eig(F)
-        _copy_sorted(alpha0,F0,alpha,F)#copy data and sort it
-        _dotr2m(rv,F,F)
-        
+
+@nb.guvectorize(numba_signatures([(NFDTYPE[:],NFDTYPE[:],NCDTYPE[:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])]),
+                 "(),(),(l),(k),(n)->(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _auxiliary_matrix_vec(beta,phi,epsv,epsa,dummy,out):
+    """Computes the auxiliary matrix of biaxial material in the rotated frame."""
+    R = np.empty((3,3),beta.dtype)
+    eps = np.empty((6,),out.dtype)
+    _calc_rotations(phi[0],epsa,R)
+    _rotate_diagonal_tensor(R,epsv,eps)
+    _auxiliary_matrix(beta[0],eps,out)
+
+@nb.guvectorize(numba_signatures([(NCDTYPE[:],NCDTYPE[:,:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:,:])]),
+                 "(n),(n,n),(m)->(n),(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _sorted_alphaf_vec(alpha0,F0,rv,alpha,F):
+    """Sorts computed eigenmodes and rotates the eigenvectors back from the rotated frame."""
+    _copy_sorted(alpha0,F0,alpha,F)
+    _dotr2m(rv,F,F)
+
+def _alphaf_biaxial(beta,phi,rv,epsv,epsa,dummy,alpha,F):
+    """Computes eigenvalues and eigenvectors of biaxial elements of alpha and F
+    (inplace) in a separate batched pass. 
+    
+    Auxiliary matrices of biaxial elements are collected and diagonalized 
+    with np.linalg.eig in batches that fit in DTMMConfig.max_memory. With 
+    real dielectric tensors the matrices are real, so the (faster) real 
+    eigenvalue solver is used."""
+    biaxial = epsv[...,0] != epsv[...,1]
+    if not np.any(biaxial):
+        return alpha, F
+    #views of alpha and F, with at least one broadcast dimension
+    shape = alpha.shape[:-1] or (1,)
+    a, f = alpha.reshape(shape + alpha.shape[-1:]), F.reshape(shape + F.shape[-2:])
+    indices = np.nonzero(np.broadcast_to(biaxial, shape))
+    beta, phi = np.broadcast_to(beta, shape), np.broadcast_to(phi, shape)
+    rv, epsv, epsa = (np.broadcast_to(x, shape + x.shape[-1:]) for x in (rv,epsv,epsa))
+    #auxiliary matrices, eigenvectors and sorted eigenvectors are temporary data
+    nbytes = 3 * 16 * f.itemsize
+    for s in mode_slices(len(indices[0]), nbytes):
+        index = tuple((i[s] for i in indices))
+        lm = _auxiliary_matrix_vec(beta[index],phi[index],epsv[index],epsa[index],dummy)
+        if not np.any(lm.imag):
+            alpha0, F0 = np.linalg.eig(lm.real)
+            alpha0, F0 = np.asarray(alpha0, a.dtype), np.asarray(F0, f.dtype)
+            #same normalization as in the complex solver: largest component is real
+            i = np.argmax(np.abs(F0), axis = -2)[...,None,:]
+            v = np.take_along_axis(F0, i, axis = -2)
+            F0 *= np.abs(v)/v
+        else:
+            alpha0, F0 = np.linalg.eig(lm)
+        a[index], f[index] = _sorted_alphaf_vec(alpha0,F0,rv[index])
+    return alpha, F
+
+def _alphaf_solve(beta,phi,rv,epsv,epsa,dummy,out = None):
+    """Eigenvalue solver. Isotropic and uniaxial elements are computed in a 
+    vectorized kernel, biaxial elements in a separate batched pass."""
+    if out is None:
+        alpha, F = _alphaf_vec(beta,phi,rv,epsv,epsa,dummy)
+    else:
+        alpha, F = _alphaf_vec(beta,phi,rv,epsv,epsa,dummy, out = out)
+    return _alphaf_biaxial(beta,phi,rv,epsv,epsa,dummy,alpha,F)
+    
 #dummy arrays for gufuncs    
-_dummy_array = np.empty((4,),CDTYPE)
-_dummy_array2 = np.empty((9,),CDTYPE)
-_dummy_EH = np.empty((2,),CDTYPE)
+def _dummy_array(n = 4):
+    """Returns an array that defines the output size of guvectorized functions.
+    It is created in current precision, see :func:`.conf.precision`."""
+    return np.empty((n,),conf.CDTYPE)
     
 
 def _alphaf(beta,phi,epsv,epsa,out = None):
     rv = rotation_vector2(phi) 
-    return _alphaf_vec(beta,phi,rv,epsv,epsa,_dummy_array, out = out)
+    return _alphaf_solve(beta,phi,rv,epsv,epsa,_dummy_array(), out = out)
 
 def _default_beta_phi(beta, phi):
     """Checks the validity of beta, phi arguments and sets default values if needed"""
-    beta = np.asarray(beta, FDTYPE) if beta is not None else np.asarray(0., FDTYPE)
-    phi = np.asarray(phi, FDTYPE) if phi is not None else np.asarray(0., FDTYPE)
+    beta = np.asarray(beta, conf.FDTYPE) if beta is not None else np.asarray(0., conf.FDTYPE)
+    phi = np.asarray(phi, conf.FDTYPE) if phi is not None else np.asarray(0., conf.FDTYPE)
     return beta, phi
 
 def _default_epsv_epsa(epsv, epsa):
     """Checks the validity of epsv, epsa arguments and sets default values if needed"""
-    epsv = np.asarray(epsv, CDTYPE) if epsv is not None else np.asarray((1.,1.,1.), CDTYPE)
-    epsa = np.asarray(epsa, FDTYPE) if epsa is not None else np.asarray((0.,0.,0.), FDTYPE)
+    epsv = np.asarray(epsv, conf.CDTYPE) if epsv is not None else np.asarray((1.,1.,1.), conf.CDTYPE)
+    epsa = np.asarray(epsa, conf.FDTYPE) if epsa is not None else np.asarray((0.,0.,0.), conf.FDTYPE)
     assert epsv.shape[-1] >= 3
     assert epsa.shape[-1] >= 3
     return epsv, epsa
 
 def _as_field_vec(fvec):
     """converts input to valid field vector"""
-    fvec = np.asarray(fvec, dtype = CDTYPE)
+    fvec = np.asarray(fvec, dtype = conf.CDTYPE)
     assert fvec.shape[-1] == 4
     return fvec
 
@@ -442,11 +526,25 @@ def alphaf(beta = None, phi = None, epsv = None, epsa = None, out = None):
     """
     beta, phi = _default_beta_phi(beta,phi)
     epsv, epsa = _default_epsv_epsa(epsv, epsa)
+    if DTMMConfig.precision == "mixed":
+        return _as_stored(_alphaf_double(beta,phi,epsv,epsa), out)
     rv = rotation_vector2(phi) 
+    return _alphaf_solve(beta,phi,rv,epsv,epsa,_dummy_array(), out = out)
+
+def _alphaf_double(beta,phi,epsv,epsa):
+    """Computes alpha and field arrays in double precision."""
+    beta, phi, epsa = (np.asarray(x, F64DTYPE) for x in (beta, phi, epsa))
+    epsv = np.asarray(epsv, C128DTYPE)
+    rv = rotation_vector2(phi, out = np.empty(phi.shape + (2,), F64DTYPE)) 
+    return _alphaf_solve(beta,phi,rv,epsv,epsa,np.empty((4,),C128DTYPE))
+
+def _as_stored(arrays, out = None):
+    """Converts double precision results to current precision (mixed precision mode)."""
     if out is None:
-        return _alphaf_vec(beta,phi,rv,epsv,epsa,_dummy_array)
-    else:
-        return _alphaf_vec(beta,phi,rv,epsv,epsa,_dummy_array, out = out)
+        return tuple((np.asarray(a, conf.CDTYPE) for a in arrays))
+    for o, a in zip(out, arrays):
+        o[...] = a
+    return out
 
 def alphaffi(beta=None,phi=None,epsv=None,epsa=None,out = None):
     """Computes alpha and field arrays (eigen values and eigen vectors arrays)
@@ -480,6 +578,11 @@ def alphaffi(beta=None,phi=None,epsv=None,epsa=None,out = None):
     >>> alpha,field = alphaf(0,0, [2,2,2], [0.,0.,0.])
     >>> ifield = inv(field)
     """
+    if DTMMConfig.precision == "mixed":
+        beta, phi = _default_beta_phi(beta,phi)
+        epsv, epsa = _default_epsv_epsa(epsv, epsa)
+        a,f = _alphaf_double(beta,phi,epsv,epsa)
+        return _as_stored((a,f,inv(f)), out)
     if out is not None:
         a,f,fi = out
         alphaf(beta,phi,epsv,epsa, out = (a,f))
@@ -566,19 +669,19 @@ def alphaEEi(beta,phi,epsv,epsa, mode = +1, out = None):
 from dtmm.conf import _numba_0_39_or_greater
 
 if _numba_0_39_or_greater:
-    @nb.vectorize([NCDTYPE(NCDTYPE,NFDTYPE)],
+    @nb.vectorize(numba_signatures([NCDTYPE(NCDTYPE,NFDTYPE)], scalars = True),
         target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)       
     def _phase_mat_vec(alpha,kd):
         return np.exp(NCDTYPE(1j)*kd*alpha)
 
     def _phasem(alpha,kd,out = None):
-        kd = np.asarray(kd,FDTYPE)[...,None]
+        kd = np.asarray(kd,conf.FDTYPE)[...,None]
         out = _phase_mat_vec(alpha,kd,out)
         #if out.shape[-1] == 4:
         #    out[...,1::2]=0.
         return out
 else:
-    @nb.guvectorize([(NCDTYPE[:],NFDTYPE[:], NCDTYPE[:])],
+    @nb.guvectorize(numba_signatures([(NCDTYPE[:],NFDTYPE[:], NCDTYPE[:])]),
                     "(n),()->(n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)       
     def _phase_mat_vec(alpha,kd,out):
         for i in range(alpha.shape[0]):
@@ -621,13 +724,13 @@ def phase_mat(alpha, kd, mode = None,  out = None):
         if alpha.shape[-1] != 4:
             raise ValueError("alpha array must be a 4-vector if mode is set.")
     
-    kd = np.asarray(kd, dtype = FDTYPE)
+    kd = np.asarray(kd, dtype = conf.FDTYPE)
     if out is None:
         if mode is None:
             b = np.broadcast(alpha,kd[...,None])
         else:
             b = np.broadcast(alpha[...,::2],kd[...,None])
-        out = np.empty(b.shape, dtype = CDTYPE)
+        out = np.empty(b.shape, dtype = conf.CDTYPE)
         
     if mode == +1:
         phasem(alpha[...,::2],kd, out = out)
@@ -649,7 +752,7 @@ def iphase_mat(alpha, kd, cfact = 0.1, mode = +1,  out = None):
     return phase_mat(alpha, kd, mode = None, out = out)
 
 
-@nb.guvectorize([(NCDTYPE[:], NFDTYPE[:])],
+@nb.guvectorize(numba_signatures([(NCDTYPE[:], NFDTYPE[:])]),
                     "(n)->()", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)       
 def poynting(fvec, out):
     """Calculates a z-component of the poynting vector from the field vector
@@ -690,7 +793,7 @@ def fmat2poynting(fmat, out = None):
     fmat = fmat.transpose(*axes)
     return poynting(fmat, out = out)
     
-@nb.guvectorize([(NCDTYPE[:,:], NCDTYPE[:,:])],
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:], NCDTYPE[:,:])]),
                     "(n,n)->(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)       
 def normalize_f(fmat, out):
     """Normalizes columns of field matrix so that fmat2poytning of the resulted
@@ -791,9 +894,9 @@ def EHz(fvec, beta = None, phi = None, epsv = None, epsa = None, out = None):
     epsv,epsa = _default_epsv_epsa(epsv, epsa)
     rv = rotation_vector2(-phi)
     
-    return _EHz(fvec,beta,phi,rv, epsv,epsa,_dummy_EH,out)
+    return _EHz(fvec,beta,phi,rv, epsv,epsa,_dummy_array(2),out)
     
-@nb.guvectorize([(NCDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:])],
+@nb.guvectorize(numba_signatures([(NCDTYPE[:],NFDTYPE[:],NFDTYPE[:],NFDTYPE[:],NCDTYPE[:],NFDTYPE[:],NCDTYPE[:],NCDTYPE[:])]),
                  "(n),(),(),(m),(l),(k),(o)->(o)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
 def _EHz(fvec, beta,phi,rv,epsv,epsa,dummy,out):
     eps = np.empty(shape = (6,), dtype = epsv.dtype)
@@ -1080,7 +1183,7 @@ def f_iso(beta = 0., phi = 0., n = 1.):
         Refractive index of the medium (1. by default).
     """
     epsv = refind2eps([n]*3)
-    epsa = np.zeros(shape = (3,),dtype= FDTYPE)
+    epsa = np.zeros(shape = (3,),dtype= conf.FDTYPE)
     alpha, f = alphaf(beta,phi,epsv,epsa)    
     return f
 
@@ -1099,7 +1202,7 @@ def ffi_iso(beta=0.,phi = 0., n=1):
         Refractive index of the medium (1. by default).
     """
     epsv = refind2eps([n]*3)
-    epsa = np.zeros(shape = (3,),dtype= FDTYPE)
+    epsa = np.zeros(shape = (3,),dtype= conf.FDTYPE)
     alpha, f, fi = alphaffi(beta,phi,epsv,epsa)    
     return f,fi
 
@@ -1206,13 +1309,14 @@ def layer_mat(kd, epsv,epsa, beta = 0,phi = 0, cfact = 0.1, method = "4x4", fmat
     else:
         return fmat, out 
 
-def stack_mat(kd,epsv,epsa, beta = 0, phi = 0, cfact = 0.01, method = "4x4", out = None):
+def stack_mat(kd,epsv,epsa, beta = 0, phi = 0, cfact = 0.01, method = "4x4", out = None, repeat = 1):
     """Computes a stack characteristic matrix M = M_1.M_2....M_n if method is
     4x4, 4x2(2x4) and a characteristic matrix M = M_n...M_2.M_1 if method is
     2x2.
     
     Note that this function calls :func:`layer_mat`, so numpy broadcasting 
-    rules apply to kd[i], epsv[i], epsa[i], beta and phi. 
+    rules apply to kd[i], epsv[i], epsa[i], beta and phi. Layer matrices are
+    multiplied by tree reduction, see :func:`.linalg.tree_dot`.
     
     Parameters
     ----------
@@ -1235,46 +1339,157 @@ def stack_mat(kd,epsv,epsa, beta = 0, phi = 0, cfact = 0.01, method = "4x4", out
         4x4_r (4x4, incoherent to compute reflection) or 
         4x4_t (4x4, incoherent to compute transmission) 
     out : ndarray, optional
+    repeat : int, optional
+        If specified, the layers define a period of a periodic stack (e.g. a 
+        pitch of a cholesteric) that is repeated this many times. The stack 
+        matrix is computed from the period matrix by repeated squaring.
     
     Returns
     -------
     cmat : ndarray
         Characteristic matrix of the stack.
     """
+    if repeat != 1 and method == "2x2_1":
+        raise ValueError("Periodic stacks are not supported with the 2x2_1 method.")
     t0 = time.time()
-    mat = None
-    tmat = None
-    fmat = None
     n = len(kd)
 
     verbose_level = DTMMConfig.verbose
     if verbose_level > 1:
         print ("Building stack matrix.")
-    for pi,i in enumerate(range(n)):
-        print_progress(pi,n,level = verbose_level) 
-        if method == "2x2_1":
-            fmat, mat = layer_mat(kd[i],epsv[i],epsa[i],beta = beta, phi = phi, cfact = cfact, method = method, fmatin = fmat, out = mat, retfmat = True)
-        else:
-            mat = layer_mat(kd[i],epsv[i],epsa[i],beta = beta, phi = phi, cfact = cfact, method = method, out = mat)
-
-        if pi == 0:
-            if out is None:
-                out = mat.copy()
-            else:
-                out[...] = mat
-        else:
-            if tmat is not None:
-                dotmm(tmat,mat,mat)
-            if method.startswith("2x2"):
-                dotmm(mat,out,out)
+        
+    def _layer_mats():
+        fmat = None
+        for i in range(n):
+            print_progress(i,n,level = verbose_level) 
+            if method == "2x2_1":
+                fmat, mat = layer_mat(kd[i],epsv[i],epsa[i],beta = beta, phi = phi, cfact = cfact, method = method, fmatin = fmat, retfmat = True)
             else:
-                dotmm(out,mat,out)
+                mat = layer_mat(kd[i],epsv[i],epsa[i],beta = beta, phi = phi, cfact = cfact, method = method)
+            yield mat
+            
+    mat = tree_dot(_buffered(_layer_mats(), n), reverse = method.startswith("2x2"))
+    if repeat != 1:
+        mat = matrix_power(mat, repeat)
+    if out is None:
+        out = mat
+    else:
+        out[...] = mat
     print_progress(n,n,level = verbose_level) 
     t = time.time()-t0
     if verbose_level >1:
         print("     Done in {:.2f} seconds!".format(t))  
     return out 
 
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:],NFDTYPE[:],NCDTYPE[:,:])]),
+                "(l,n),(l,n,n),(l,n,n),(l)->(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _stack_mat_vec(alpha, fmat, fmati, kd, out):
+    """Computes the product of layer matrices F.P.Fi, M1.M2...Ml if n == 4, 
+    or Ml...M2.M1 if n == 2."""
+    n = out.shape[0]
+    p = np.empty_like(alpha[0])
+    mat = np.empty_like(out)
+    tmp = np.empty_like(out)
+    for i in range(n):
+        for j in range(n):
+            out[i,j] = 0.
+        out[i,i] = 1.
+    for l in range(alpha.shape[0]):
+        for i in range(n):
+            p[i] = np.exp(1j*kd[l]*alpha[l,i])
+        for i in range(n):
+            for j in range(n):
+                mat[i,j] = 0.
+                for k in range(n):
+                    mat[i,j] += fmat[l,i,k] * p[k] * fmati[l,k,j]
+        if n == 2:
+            _dotmm2(mat, out, tmp)
+        else:
+            _dotmm4(out, mat, tmp)
+        out[...] = tmp
+
+def _layer_axis(kd, epsv, epsa, beta, phi):
+    """Inserts broadcast axes after the layer axis, so that beta and phi broadcast."""
+    kd = np.asarray(kd, conf.FDTYPE)
+    ndim = np.broadcast(kd[0], epsv[0][...,0], epsa[0][...,0], beta, phi).ndim
+    kd = kd.reshape(kd.shape[:1] + (1,)*(ndim - kd.ndim + 1) + kd.shape[1:])
+    epsv = epsv.reshape(epsv.shape[:1] + (1,)*(ndim - epsv.ndim + 2) + epsv.shape[1:])
+    epsa = epsa.reshape(epsa.shape[:1] + (1,)*(ndim - epsa.ndim + 2) + epsa.shape[1:])
+    return kd, epsv, epsa
+
+def stack_mat_sweep(kd, epsv, epsa, beta = 0, phi = 0, method = "4x4", out = None, repeat = 1):
+    """Computes stack characteristic matrices of a batch of stacks, e.g. for 
+    a parameter sweep over wavelengths, beta, phi or material parameters.
+    
+    Same as :func:`stack_mat`, but the eigensystems of all layers are computed
+    at once and the layer matrices and their product are computed in a single 
+    vectorized kernel, without storing the layer matrices. In parallel mode, 
+    if there are fewer stacks than threads, the layers are split into chunks 
+    that are multiplied in parallel and reduced pairwise (tree reduction). The 
+    first axis of kd, epsv and epsa is the layer axis, and numpy broadcasting 
+    rules apply to kd[i], epsv[i], epsa[i], beta and phi.
+    
+    Parameters
+    ----------
+    kd : (n,...) array
+        Phase values (layer thickness times wavenumber in vacuum) of n layers.
+    epsv : (n,...,3) array
+        Dielectric tensor eigenvalues array.
+    epsa : (n,...,3) array
+        Euler rotation angles (psi, theta, phi).
+    beta : float or array, optional
+        The beta parameter of the field (defaults to 0.)
+    phi : float or array, optional
+        The phi parameter of the field (defaults to 0.)
+    method : str
+        Either 4x4 (4x4 berreman) or 2x2 (2x2 jones).
+    out : ndarray, optional
+    repeat : int, optional
+        Number of repetitions of the stack (periodic stacks), see :func:`stack_mat`.
+    
+    Returns
+    -------
+    cmat : ndarray
+        Characteristic matrices of the stacks.
+    """
+    if method not in ("4x4", "2x2"):
+        raise ValueError("Unknown method!")
+    beta, phi = _default_beta_phi(beta,phi)
+    epsv, epsa = _default_epsv_epsa(epsv, epsa)
+    kd, epsv, epsa = _layer_axis(kd, epsv, epsa, beta, phi)
+    
+    alpha, fmat = alphaf(beta, phi, epsv, epsa)
+    if method == "2x2":
+        alpha, fmat = alpha[...,::2], fmat[...,::2,::2]
+    else:
+        kd = -kd
+    fmati = inv(fmat)
+    
+    n = max(len(kd), len(alpha))
+    nstacks = np.broadcast(kd[0], alpha[0][...,0]).size
+    nchunks = min(n, -(-DTMMConfig.nthreads // nstacks)) if NUMBA_PARALLEL else 1
+    size = -(-n // nchunks)
+    
+    def _chunks(a, ndim, pad_value = None):
+        #pad with kd = 0 (identity matrix) layers and move layer axis to core dimensions
+        a = np.broadcast_to(a, (n,) + a.shape[1:])
+        pad = size * nchunks - n
+        if pad > 0:
+            a = np.concatenate((a, np.repeat(a[-1:], pad, axis = 0)))
+            if pad_value is not None:
+                a[n:] = pad_value
+        a = a.reshape((nchunks, size) + a.shape[1:])
+        return np.moveaxis(a, 1, a.ndim - ndim - 1)
+    
+    mats = _stack_mat_vec(_chunks(alpha,1), _chunks(fmat,2), _chunks(fmati,2), _chunks(kd,0,0.))
+    mat = tree_dot(list(mats), reverse = (method == "2x2"))
+    if repeat != 1:
+        mat = matrix_power(mat, repeat)
+    if out is None:
+        return mat.copy()
+    out[...] = mat
+    return out
+
 m1 = np.array([[1.,0,0,0],
          [0,1,0,0],
          [0,0,1,0],
@@ -1350,6 +1565,303 @@ def reflection_mat(smat, out = None):
     m1 = inv(m1)
     return dotmm(m1,m2, out = out)
 
+@nb.njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _system2scattering(smat, out):
+    """Converts a 4x4 system matrix to a scattering matrix (same as reflection_mat).
+
+    Blocks are 2x2 matrices, the (x,y) block of a matrix m is m[x::2,y::2],
+    with index 0 for forward and 1 for backward propagating modes."""
+    a = np.empty((2,2),smat.dtype)
+    ai = np.empty((2,2),smat.dtype)
+    for i in range(2):
+        for j in range(2):
+            a[i,j] = smat[2*i,2*j]
+    _inv2x2(a,ai)
+    for i in range(2):
+        for j in range(2):
+            #S11 = T11^-1, S21 = T21.T11^-1
+            out[2*i,2*j] = ai[i,j]
+            out[2*i+1,2*j] = smat[2*i+1,0] * ai[0,j] + smat[2*i+1,2] * ai[1,j]
+    for i in range(2):
+        for j in range(2):
+            #S12 = -T11^-1.T12
+            a[i,j] = -(ai[i,0] * smat[0,2*j+1] + ai[i,1] * smat[2,2*j+1])
+    for i in range(2):
+        for j in range(2):
+            out[2*i,2*j+1] = a[i,j]
+            #S22 = T22 + T21.S12
+            out[2*i+1,2*j+1] = smat[2*i+1,2*j+1] + smat[2*i+1,0] * a[0,j] + smat[2*i+1,2] * a[1,j]
+
+@nb.njit(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]), cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _star_product4(a, b, out):
+    """Redheffer star product of two 4x4 scattering matrices. Output can be
+    one of the inputs."""
+    c = np.empty((2,2),a.dtype)
+    ci = np.empty((2,2),a.dtype)
+    x1 = np.empty((2,2),a.dtype)
+    x2 = np.empty((2,2),a.dtype)
+    tmp = np.empty((2,2),a.dtype)
+    #c = 1 - A12.B21
+    for i in range(2):
+        for j in range(2):
+            c[i,j] = - a[2*i,1] * b[1,2*j] - a[2*i,3] * b[3,2*j]
+        c[i,i] += 1.
+    _inv2x2(c,ci)
+    #x1 = c^-1.A11, x2 = c^-1.A12.B22
+    for i in range(2):
+        for j in range(2):
+            tmp[i,j] = a[2*i,1] * b[1,2*j+1] + a[2*i,3] * b[3,2*j+1]
+    for i in range(2):
+        for j in range(2):
+            x1[i,j] = ci[i,0] * a[0,2*j] + ci[i,1] * a[2,2*j]
+            x2[i,j] = ci[i,0] * tmp[0,j] + ci[i,1] * tmp[1,j]
+    #c = B21.x1, ci = B22 + B21.x2
+    for i in range(2):
+        for j in range(2):
+            c[i,j] = b[2*i+1,0] * x1[0,j] + b[2*i+1,2] * x1[1,j]
+            ci[i,j] = b[2*i+1,2*j+1] + b[2*i+1,0] * x2[0,j] + b[2*i+1,2] * x2[1,j]
+    #S11 = B11.x1, S12 = B12 + B11.x2, S21 = A21 + A22.c, S22 = A22.ci
+    for i in range(2):
+        for j in range(2):
+            tmp[i,j] = a[2*i+1,2*j] + a[2*i+1,1] * c[0,j] + a[2*i+1,3] * c[1,j]
+    for i in range(2):
+        for j in range(2):
+            c[i,j] = a[2*i+1,1] * ci[0,j] + a[2*i+1,3] * ci[1,j]
+    for i in range(2):
+        for j in range(2):
+            ci[i,j] = b[2*i,2*j+1] + b[2*i,0] * x2[0,j] + b[2*i,2] * x2[1,j]
+    for i in range(2):
+        for j in range(2):
+            x2[i,j] = b[2*i,0] * x1[0,j] + b[2*i,2] * x1[1,j]
+    for i in range(2):
+        for j in range(2):
+            out[2*i,2*j] = x2[i,j]
+            out[2*i,2*j+1] = ci[i,j]
+            out[2*i+1,2*j] = tmp[i,j]
+            out[2*i+1,2*j+1] = c[i,j]
+
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]),
+                "(n,n),(n,n)->(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _star_product_vec(a, b, out):
+    _star_product4(a, b, out)
+
+def _star_product(a, b, out = None):
+    """Redheffer star product of two scattering matrices of any (even) size."""
+    n = a.shape[-1]//2
+    a11, a12, a21, a22 = a[...,0::2,0::2], a[...,0::2,1::2], a[...,1::2,0::2], a[...,1::2,1::2]
+    b11, b12, b21, b22 = b[...,0::2,0::2], b[...,0::2,1::2], b[...,1::2,0::2], b[...,1::2,1::2]
+    c = np.eye(n, dtype = a.dtype) - np.matmul(a12, b21)
+    x = np.concatenate(np.broadcast_arrays(a11, np.matmul(a12, b22)), axis = -1)
+    x = np.linalg.solve(c, x)
+    x1, x2 = x[...,:n], x[...,n:]
+    if out is None:
+        out = np.empty(np.broadcast(a, b).shape, np.result_type(a, b))
+    s11 = np.matmul(b11, x1)
+    s12 = b12 + np.matmul(b11, x2)
+    s21 = a21 + np.matmul(a22, np.matmul(b21, x1))
+    s22 = np.matmul(a22, b22 + np.matmul(b21, x2))
+    out[...,0::2,0::2] = s11
+    out[...,0::2,1::2] = s12
+    out[...,1::2,0::2] = s21
+    out[...,1::2,1::2] = s22
+    return out
+
+def star_product(smat1, smat2, out = None):
+    """Computes the Redheffer star product of two scattering matrices.
+
+    Scattering matrices are given in the layout of :func:`reflection_mat`,
+    that is, they map the incoming amplitudes (forward propagating
+    amplitudes in the input medium at even indices and backward propagating
+    amplitudes in the output medium at odd indices) to the outgoing amplitudes
+    (forward propagating amplitudes in the output medium at even indices and
+    backward propagating amplitudes in the input medium at odd indices). The
+    star product of the scattering matrices of two consecutive stacks is the
+    scattering matrix of the joined stack. Unlike the product of system
+    matrices, the star product involves no growing exponentials.
+
+    Parameters
+    ----------
+    smat1 : (...,n,n) array
+        Scattering matrix of the first (input side) stack.
+    smat2 : (...,n,n) array
+        Scattering matrix of the second (output side) stack.
+    out : ndarray, optional
+        Output array where results are written.
+
+    Returns
+    -------
+    smat : (...,n,n) array
+        Scattering matrix of the joined stack.
+    """
+    smat1, smat2 = np.asarray(smat1), np.asarray(smat2)
+    if smat1.shape[-1] == 4 and smat2.shape[-1] == 4:
+        if out is None:
+            return _star_product_vec(smat1, smat2)
+        return _star_product_vec(smat1, smat2, out)
+    return _star_product(smat1, smat2, out = out)
+
+@nb.guvectorize(numba_signatures([(NCDTYPE[:,:],NCDTYPE[:,:,:],NCDTYPE[:,:,:],NFDTYPE[:],NCDTYPE[:,:],NCDTYPE[:,:],NCDTYPE[:,:])]),
+                "(l,n),(l,n,n),(l,n,n),(l),(n,n),(n,n)->(n,n)", target = NUMBA_TARGET, cache = NUMBA_CACHE, fastmath = NUMBA_FASTMATH)
+def _scattering_mat_vec(alpha, fmat, fmati, kd, fmatini, fmatout, out):
+    """Computes the scattering matrix of a stack as the star product of interface
+    and layer (propagation) scattering matrices."""
+    smat = np.empty_like(out)
+    tmp = np.empty_like(out)
+    p = np.empty_like(alpha[0])
+    for i in range(4):
+        for j in range(4):
+            out[i,j] = 0.
+        out[i,i] = 1.
+    for l in range(alpha.shape[0] + 1):
+        #interface between previous and current layer (or output medium)
+        if l == alpha.shape[0]:
+            if l == 0:
+                _dotmm4(fmatini, fmatout, tmp)
+            else:
+                _dotmm4(fmati[l-1], fmatout, tmp)
+        elif l == 0:
+            _dotmm4(fmatini, fmat[l], tmp)
+        else:
+            _dotmm4(fmati[l-1], fmat[l], tmp)
+        _system2scattering(tmp, smat)
+        _star_product4(out, smat, out)
+        if l == alpha.shape[0]:
+            break
+        #propagation through the layer; only decaying (bounded) exponentials,
+        #forward amplitudes at even, backward amplitudes at odd indices.
+        for i in range(2):
+            p[2*i] = np.exp(1j*kd[l]*alpha[l,2*i])
+            p[2*i+1] = np.exp(-1j*kd[l]*alpha[l,2*i+1])
+        for i in range(4):
+            for j in range(4):
+                if i % 2 == 0:
+                    out[i,j] = out[i,j] * p[i]
+                if j % 2 == 1:
+                    out[i,j] = out[i,j] * p[j]
+
+def scattering_mat(kd, epsv, epsa, beta = 0, phi = 0, fmatin = None, fmatout = None, out = None, repeat = 1):
+    """Computes a 4x4 scattering (reflection) matrix of a stack.
+
+    The result is the same as that of
+    reflection_mat(system_mat(stack_mat(kd, epsv, epsa, beta, phi), fmatin, fmatout)),
+    but it is computed as the Redheffer star product (see :func:`star_product`)
+    of the interface and layer scattering matrices in the eigenmode basis of
+    each layer. Only decaying exponentials are involved, so the computation is
+    numerically stable for arbitrarily thick (or absorbing) stacks, also in
+    single precision. The eigensystems of all layers are computed at once and
+    the star products are computed in a single vectorized kernel. The first
+    axis of kd, epsv and epsa is the layer axis, and numpy broadcasting rules
+    apply to kd[i], epsv[i], epsa[i], beta and phi.
+
+    Parameters
+    ----------
+    kd : (n,...) array
+        Phase values (layer thickness times wavenumber in vacuum) of n layers.
+    epsv : (n,...,3) array
+        Dielectric tensor eigenvalues array.
+    epsa : (n,...,3) array
+        Euler rotation angles (psi, theta, phi).
+    beta : float or array, optional
+        The beta parameter of the field (defaults to 0.)
+    phi : float or array, optional
+        The phi parameter of the field (defaults to 0.)
+    fmatin : (...,4,4) array, optional
+        Input field matrix array (defaults to vacuum).
+    fmatout : (...,4,4) array, optional
+        Output field matrix array (defaults to fmatin).
+    out : ndarray, optional
+        Output array where results are written.
+    repeat : int, optional
+        Number of repetitions of the stack (periodic stacks), see :func:`stack_mat`.
+
+    Returns
+    -------
+    rmat : (...,4,4) array
+        Scattering matrix of the stack, see :func:`transmit4x4`.
+    """
+    beta, phi = _default_beta_phi(beta,phi)
+    epsv, epsa = _default_epsv_epsa(epsv, epsa)
+    kd, epsv, epsa = _layer_axis(kd, epsv, epsa, beta, phi)
+    if fmatin is None:
+        fmatin = f_iso(beta = beta, phi = phi)
+    if fmatout is None:
+        fmatout = fmatin
+    fmatini = inv(fmatin)
+
+    alpha, fmat = alphaf(beta, phi, epsv, epsa)
+    fmati = inv(fmat)
+
+    n = max(len(kd), len(alpha))
+
+    def _layers(a, ndim):
+        #move layer axis to core dimensions
+        a = np.broadcast_to(a, (n,) + a.shape[1:])
+        return np.moveaxis(a, 0, a.ndim - ndim - 1)
+
+    alpha, fmat, fmati, kd = _layers(alpha,1), _layers(fmat,2), _layers(fmati,2), _layers(kd,0)
+    if repeat != 1:
+        #period is a stack between two input media
+        smat = _scattering_mat_vec(alpha, fmat, fmati, kd, fmatini, fmatin)
+        smat = matrix_power(smat, repeat, dot = star_product)
+        return star_product(smat, reflection_mat(dotmm(fmatini, fmatout)), out = out)
+    if out is None:
+        return _scattering_mat_vec(alpha, fmat, fmati, kd, fmatini, fmatout)
+    return _scattering_mat_vec(alpha, fmat, fmati, kd, fmatini, fmatout, out)
+
+def _layer_scattering_mat(system_mat, fmat, nmax = 2**20):
+    """Computes a scattering matrix of a mode-coupling (2D or 3D) layer.
+
+    system_mat(n) returns the system matrix of shape (4*m,4*m) of 1/n of the
+    layer, in the basis of the surrounding medium with field matrix fmat of
+    shape (m,4,4). The system matrix is diagonalized and the scattering matrix
+    is computed from the eigensystem with decaying exponentials only, as in
+    :func:`_scattering_mat_vec`. Layers with large (or overflowing)
+    exponentials are split into n sublayers, and the eigenvalues are raised
+    to the n-th power. Layer matrices of thick sublayers may have more growing
+    than decaying modes (or vice versa), these are split further. Raises 
+    ValueError if more than nmax sublayers are needed.
+    """
+    n = 1
+    while n <= nmax:
+        smat = system_mat(n)
+        #largest exponent of the sublayer, it is bounded to keep the eigensystem accurate
+        limit = -np.log(np.finfo(smat.dtype).eps) / 4
+        if np.all(np.isfinite(smat)):
+            q, w = np.linalg.eig(smat)
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                logq = np.log(np.abs(q))
+            g = np.abs(logq).max()
+            #at most half of the modes may grow (forward) or decay (backward)
+            m = max((logq * n > 1.).sum(), (logq * n < -1.).sum())
+            if g <= limit:
+                if 2 * m <= len(q):
+                    break
+                n = n * 2
+                continue
+            if np.isfinite(g):
+                n = n * int(np.ceil(g / limit))
+                continue
+        n = n * 64
+    else:
+        raise ValueError("Could not compute a stable layer scattering matrix with {} sublayers. Check the layer thickness and dielectric tensor for invalid values.".format(nmax))
+    #forward modes grow in the system matrix and backward modes decay. Modes 
+    #that grow or decay little in the layer are sorted by the direction of the
+    #poynting vector, as in _copy_sorted.
+    field = np.matmul(fmat, w.reshape(fmat.shape[:-1] + w.shape[-1:]))
+    p = (field[:,0] * np.conj(field[:,1])).real - (field[:,2] * np.conj(field[:,3])).real
+    p = p.sum(0) / (np.abs(field)**2).sum((0,1))
+    key = np.where(np.abs(logq) * n > 1., np.sign(logq) * 2., np.clip(p, -1., 1.))
+    order = np.argsort(-key, kind = "stable")
+    m = len(order)//2
+    index = np.empty_like(order)
+    index[0::2], index[1::2] = order[:m], order[m:]
+    q, w = q[index], w[:,index]
+    #interface, propagation through the layer and interface
+    out = reflection_mat(w)
+    out[0::2,:] *= ((1./q[0::2])**n)[:,None]
+    out[:,1::2] *= q[1::2]**n
+    return star_product(out, reflection_mat(inv(w)))
+
 def fvec2E(fvec, fmat = None, fmati = None, mode = +1, inplace = False):
     """Converts field vector to E vector. If inplace == True, also 
     makes input field forward or backward propagating. 
@@ -1482,7 +1994,7 @@ def transmit2x2(fvec_in, cmat, fmatout = None, tmatin = None, tmatout = None, fv
     return fvec_out
 
 
-def transmit4x4(fvec_in, cmat = None, fmatin = None, fmatout = None, fmatini = None, fmatouti = None, fvec_out = None):
+def transmit4x4(fvec_in, cmat = None, fmatin = None, fmatout = None, fmatini = None, fmatouti = None, fvec_out = None, rmat = None):
     """Transmits field vector using 4x4 method.
     
     This functions takes a field vector that describes the input field and
@@ -1508,8 +2020,12 @@ def transmit4x4(fvec_in, cmat = None, fmatin = None, fmatout = None, fmatini = N
     fvec_out : (...,4) array, optional
         The ouptut field vector array. This function will update the output array 
         with the calculated transmitted field.
+    rmat : (...,4,4) array, optional
+        Scattering matrix, as computed by :func:`scattering_mat`. If provided,
+        `cmat` is not used.
     """
-    b = np.broadcast(fvec_in[..., None],cmat[...,0:4,0:4], fmatin, fmatout)
+    mat = cmat if rmat is None else rmat
+    b = np.broadcast(fvec_in[..., None],mat[...,0:4,0:4], fmatin, fmatout)
     
     if fvec_in.shape != b.shape[:-1]:
         raise ValueError("Input field vector should have shape of {}".format(b.shape[:-1]))
@@ -1529,8 +2045,10 @@ def transmit4x4(fvec_in, cmat = None, fmatin = None, fmatout = None, fmatini = N
             fmatouti = inv(fmatout)
     if fmatout is None:
         fmatout = inv(fmatouti)
-        
-    smat = system_mat(cmat = cmat,fmatini = fmatini, fmatout = fmatout)
+     
+    if rmat is None:
+        smat = system_mat(cmat = cmat,fmatini = fmatini, fmatout = fmatout)
+        rmat = reflection_mat(smat)
      
     avec = dotmv(fmatini,fvec_in)
     
@@ -1545,8 +2063,7 @@ def transmit4x4(fvec_in, cmat = None, fmatin = None, fmatout = None, fmatini = N
     else:
         bvec = np.zeros_like(avec)
 
-    r = reflection_mat(smat)
-    out = dotmv(r,a, out = fvec_out)
+    out = dotmv(rmat,a, out = fvec_out)
     
     avec[...,1::2] = out[...,1::2]
     bvec[...,::2] = out[...,::2]
@@ -1581,7 +2098,8 @@ def transfer4x4(fvec_in, kd, epsv, epsa,  beta = 0., phi = 0., nin = 1., nout =
     nout : float
         Output layer refractive index.
     method : str
-        Any of 4x4, 4x4_1, 4x4_2, 4x4_r.
+        Any of 4x4, 4x4_1, 4x4_2, 4x4_r or 4x4_s (4x4, computed with 
+        scattering matrices, stable for thick stacks, see :func:`scattering_mat`).
     reflect_in : bool
         Defines how to treat reflections from the input media and the first layer.
         If specified it does an incoherent reflection from the first interface.
@@ -1595,7 +2113,7 @@ def transfer4x4(fvec_in, kd, epsv, epsa,  beta = 0., phi = 0., nin = 1., nout =
     
 
     
-    if method not in ("4x4", "4x4_1","4x4_r","4x4_2"):
+    if method not in ("4x4", "4x4_1","4x4_r","4x4_2","4x4_s"):
         raise ValueError("Unknown method '{}'!".format(method))
         
         
@@ -1638,8 +2156,12 @@ def transfer4x4(fvec_in, kd, epsv, epsa,  beta = 0., phi = 0., nin = 1., nout =
 #    else:
 #        fmatout = f_iso(n = nout, beta  = beta, phi = phi)
     
-    cmat = stack_mat(kd, epsv, epsa, method = method)
-    fvecf = transmit4x4(fveci, cmat = cmat, fmatin = fmatin, fmatout = fmatout, fvec_out = fvecf)
+    if method == "4x4_s":
+        rmat = scattering_mat(kd, epsv, epsa, beta = beta, phi = phi, fmatin = fmatin, fmatout = fmatout)
+        fvecf = transmit4x4(fveci, fmatin = fmatin, fmatout = fmatout, fvec_out = fvecf, rmat = rmat)
+    else:
+        cmat = stack_mat(kd, epsv, epsa, beta = beta, phi = phi, method = method)
+        fvecf = transmit4x4(fveci, cmat = cmat, fmatin = fmatin, fmatout = fmatout, fvec_out = fvecf)
 
 #    if reflect_in == True:
 #        #make fresnel reflection of the input (backward propagating) field
@@ -1783,7 +2305,7 @@ def avec(jones = (1,0), amplitude = 1., mode = +1, out = None):
     b = np.broadcast(c, amplitude)
     shape = b.shape + (4,)
     if out is None:
-        out = np.empty(shape,CDTYPE)
+        out = np.empty(shape,conf.CDTYPE)
     assert out.shape[-1] == 4
     if mode == +1:
         out[...,0] = c
@@ -1896,7 +2418,8 @@ def avec2fvec(avec, fmat, normalize_fmat = True, out = None):
 __all__ = ["alphaf","alphaffi","phase_mat", "fvec", "avec", "fvec2avec",
            "avec2fvec","f_iso","ffi_iso","layer_mat","poynting","intensity",
            "transfer4x4","transmit4x4","transfer",
-           "layer_mat","system_mat","stack_mat","EHz"]
+           "layer_mat","system_mat","stack_mat","EHz",
+           "star_product","scattering_mat"]
 
 if __name__ == "__main__":
     import doctest
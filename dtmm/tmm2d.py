@@ -5,8 +5,9 @@
 from __future__ import absolute_import, print_function, division
 import numpy as np
 
-from dtmm.conf import  BETAMAX, CDTYPE, DTMMConfig
-from dtmm.linalg import dotmdm, inv, dotmv, bdotmm, bdotmd, bdotdm
+from dtmm.conf import  BETAMAX, DTMMConfig
+import dtmm.conf as conf
+from dtmm.linalg import dotmdm, inv, dotmv, bdotmm, bdotmd, bdotdm, bmat2mat, mat2bmat, tree_dot, _buffered, matrix_power
 from dtmm.print_tools import print_progress
 
 import dtmm.tmm as tmm
@@ -62,7 +63,7 @@ def _layer_mat2d(k0,d,epsv,epsa, mask, betaxs, betay,indices, method):
     n = len(betaxs)
     kd = k0*d
     shape = epsv.shape[-2]
-    out = np.empty(shape = (n, n, 4, 4), dtype = CDTYPE)
+    out = np.empty(shape = (n, n, 4, 4), dtype = conf.CDTYPE)
     beta = betaxy2beta(betaxs,betay)
     phi = betaxy2phi(betaxs,betay)
     for j,(beta,phi) in enumerate(zip(beta, phi)):   
@@ -91,33 +92,80 @@ def _layer_mat2d(k0,d,epsv,epsa, mask, betaxs, betay,indices, method):
 
     return out
 
-def stack_mat2d(k,d,epsv,epsa, betay = 0., method = "4x4" ,mask = None):
+def _bdot(a, b):
+    """Multiplies block matrices, or tuples of block matrices."""
+    if isinstance(a, tuple):
+        return tuple((bdotmm(x,y) for x,y in zip(a,b)))
+    return bdotmm(a,b)
+
+def stack_mat2d(k,d,epsv,epsa, betay = 0., method = "4x4" ,mask = None, repeat = 1):
+    """Computes a stack characteristic matrix. If repeat is specified, the 
+    layers define a period of a periodic stack that is repeated this many times. 
+    The stack matrix is then computed from the period matrix by repeated squaring."""
     n = len(d)
-    indices = range(n)
-    if method.startswith("2x2"):
-        indices = reversed(indices)
     verbose_level = DTMMConfig.verbose
     if verbose_level > 1:
         print ("Building stack matrix.")
-    for i in range(n):
-        print_progress(i,n,level = verbose_level) 
-        mat = layer_mat2d(k,d[i],epsv[i],epsa[i], betay = betay, mask = mask, method = method)
-
-        if i == 0:
-            if isinstance(mat, tuple):
-                out = tuple((m.copy() for m in mat))
-            else:
-                out = mat.copy()
-        else:
-            if isinstance(mat, tuple):
-                out = tuple((bdotmm(o,m) for o,m in zip(out,mat)))
-            else:
-                out = bdotmm(out,mat)
+        
+    def _layer_mats():
+        for i in range(n):
+            print_progress(i,n,level = verbose_level) 
+            yield layer_mat2d(k,d[i],epsv[i],epsa[i], betay = betay, mask = mask, method = method)
+    
+    #layer matrices are multiplied by tree reduction        
+    out = tree_dot(_buffered(_layer_mats(), n), dot = _bdot)
+    if repeat != 1:
+        out = matrix_power(out, repeat, dot = _bdot)
 
     print_progress(n,n,level = verbose_level) 
 
     return out 
 
+def scattering_mat2d(k,d,epsv,epsa, fmatin, fmatout, betay = 0., mask = None):
+    """Computes a stack scattering matrix. 
+    
+    Same as reflection_mat2d(system_mat2d(fmatin, stack_mat2d(k,d,epsv,epsa), fmatout)), 
+    but computed as the Redheffer star product of layer scattering matrices
+    (see :func:`.tmm.star_product`), so it is numerically stable for thick stacks.
+    Layer scattering matrices are computed from the eigensystems of the layer 
+    system matrices with decaying exponentials only."""
+    n = len(d)
+    verbose_level = DTMMConfig.verbose
+    if verbose_level > 1:
+        print ("Building stack scattering matrix.")
+    is_tuple = isinstance(fmatin, tuple)
+    fmatin = fmatin if is_tuple else (fmatin,)
+    fmatout = fmatout if is_tuple else (fmatout,)
+    k = np.asarray(k)
+    if k.ndim == 0:
+        ks, masks = (k,), (mask,)
+    else:
+        ks, masks = tuple(k), ((mask,)*len(k) if mask is None else tuple(mask))
+    
+    def _star(a, b):
+        return tuple((tmm.star_product(x,y) for x,y in zip(a,b)))
+    
+    def _layer_mat(i, j):
+        #layer scattering matrix of j-th wavenumber, with the input medium on both sides
+        def system_mat(nsub):
+            mat = layer_mat2d(ks[j],d[i]/nsub,epsv[i],epsa[i], betay = betay, mask = masks[j], method = "4x4")
+            return bmat2mat(_system_mat2d(fmatin[j], mat, fmatin[j]))
+        return tmm._layer_scattering_mat(system_mat, fmatin[j])
+        
+    def _layer_mats():
+        for i in range(n):
+            print_progress(i,n,level = verbose_level) 
+            yield tuple((_layer_mat(i, j) for j in range(len(ks))))
+    
+    out = tree_dot(_buffered(_layer_mats(), n), dot = _star)
+    #interface between input and output media
+    eye = tuple((mat2bmat(np.eye(4*len(f), dtype = conf.CDTYPE)) for f in fmatin))
+    out = _star(out, tuple((_reflection_mat2d(s) for s in system_mat2d(fmatin, eye, fmatout))))
+
+    print_progress(n,n,level = verbose_level) 
+
+    return out if is_tuple else out[0]
+
 def f_iso2d(shape, k0, n = 1., betay = 0, betamax = BETAMAX):
     k0 = np.asarray(k0)
     betax = eigenbeta1(shape,k0, betamax)
@@ -248,9 +296,12 @@ def transfer2d(field_data_in, optical_data, betay = 0., nin = 1., nout = 1., met
     fmatin = f_iso2d(shape = shape, betay = betay, k0 = k0, n=nin, betamax = betamax)
     fmatout = f_iso2d(shape = shape, betay = betay, k0 = k0, n=nout, betamax = betamax)
     
-    cmat = stack_mat2d(k0,d, epsv, epsa, betay = betay, mask = mask, method = method)
-    smat = system_mat2d(fmatin = fmatin, cmat = cmat, fmatout = fmatout)
-    rmat = reflection_mat2d(smat)
+    if method == "4x4_s":
+        rmat = scattering_mat2d(k0,d, epsv, epsa, fmatin, fmatout, betay = betay, mask = mask)
+    else:
+        cmat = stack_mat2d(k0,d, epsv, epsa, betay = betay, mask = mask, method = method)
+        smat = system_mat2d(fmatin = fmatin, cmat = cmat, fmatout = fmatout)
+        rmat = reflection_mat2d(smat)
     
     fmode_out = reflect2d(fmode_in, rmat = rmat, fmatin = fmatin, fmatout = fmatout, fvecout = fmode_out)
     
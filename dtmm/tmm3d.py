@@ -5,11 +5,15 @@
 from __future__ import absolute_import, print_function, division
 
 import numpy as np
+import time
 
-from dtmm.conf import CDTYPE,DTMMConfig, BETAMAX
+from dtmm.conf import DTMMConfig, BETAMAX
+import dtmm.conf as conf
 
-from dtmm.linalg import dotmm, inv, dotmv,  bdotmm, bdotmd, bdotdm, dotmdm
+from dtmm.linalg import dotmm, inv, dotmv,  bdotmm, bdotmd, bdotdm, dotmdm, bmat2mat, mat2bmat, tree_dot, _buffered, matrix_power
 from dtmm.print_tools import print_progress
+from dtmm.data import unique_epsva
+from dtmm.mode import mode_slices
 
 import dtmm.tmm as tmm
 from dtmm.tmm import alphaf, alphaffi, phase_mat
@@ -17,7 +21,7 @@ from dtmm.wave import eigenbeta, eigenphi,eigenindices, eigenmask, eigenwave,mas
 from dtmm.wave import k0 as wavenumber
 from dtmm.field import field2modes, modes2field
 
-from dtmm.fft import mfft2
+from dtmm.fft import mfft2, pool_map
 
 
 # from dtmm.matrix import corrected_field_diffraction_matrix, second_field_diffraction_matrix,\
@@ -26,7 +30,7 @@ from dtmm.fft import mfft2
 #                             corrected_Epn_diffraction_matrix2
 
 
-def layer_mat3d(k0, d, epsv,epsa, mask = None, method = "4x4"):
+def layer_mat3d(k0, d, epsv,epsa, mask = None, method = "4x4", diagonal = False):
     """Computes characteristic matrix of a single layer M=F.P.Fi,
     
     Numpy broadcasting rules apply
@@ -43,11 +47,16 @@ def layer_mat3d(k0, d, epsv,epsa, mask = None, method = "4x4"):
         Optical axes orientation angles (psi, theta, phi).
     method : str, optional
         Either a 4x4 or 4x4_1
+    diagonal : bool, optional
+        If set, the layer is treated as laterally homogeneous (the values at 
+        the first pixel are used) and only the diagonal blocks of the (block 
+        diagonal) matrix are computed.
     
     Returns
     -------
     cmat : ndarray
-        Characteristic matrix of the layer.
+        Characteristic matrix of the layer, or its diagonal blocks of shape 
+        (n,4,4) if diagonal is set.
     """
     if method not in ("4x4","4x4_1","2x2"):
         raise ValueError("Unsupported method: '{}'".format(method))
@@ -62,90 +71,286 @@ def layer_mat3d(k0, d, epsv,epsa, mask = None, method = "4x4"):
         betas = mask2beta(mask,k0)
         phis = mask2phi(mask,k0)
         indices = mask2indices(mask,k0)
+    func = _layer_mat3d_diag if diagonal else _layer_mat3d
     if k0.ndim == 0:
-        return _layer_mat3d(k0,d,epsv,epsa, mask, betas, phis,indices, method)
+        return func(k0,d,epsv,epsa, mask, betas, phis,indices, method)
     else:
-        out = (_layer_mat3d(k0[i],d,epsv,epsa, mask[i],betas[i], phis[i],indices[i],method) for i in range(len(k0)))
+        out = (func(k0[i],d,epsv,epsa, mask[i],betas[i], phis[i],indices[i],method) for i in range(len(k0)))
         return tuple(out)
 
-def _layer_mat3d(k0,d,epsv,epsa, mask, betas, phis,indices, method):   
-    n = len(betas)
-    kd = k0*d#/2.
-    shape = epsv.shape[-3],epsv.shape[-2]
+def _mode_mat3d(kd, betas, phis, epsv, epsa, method):
+    """Computes layer matrices F.P.Fi of the modes."""
+    if method == "4x4_1":
+        raise ValueError("Unsupported method.")
     if method.startswith("2x2"):
-        out = np.empty(shape = (n, n, 2, 2), dtype = CDTYPE)
+        alpha,fmat = alphaf(betas,phis,epsv,epsa)
+        f = tmm.E_mat(fmat, mode = +1, copy = False)
+        fi = inv(f)
+        pmat = phase_mat(alpha[...,::2],kd)
     else:
-        out = np.empty(shape = (n, n, 4, 4), dtype = CDTYPE)
-
-    for j,(beta,phi) in enumerate(zip(betas,phis)):    
-        if method.startswith("2x2"):
-            alpha,fmat = alphaf(beta,phi,epsv,epsa)
-            f = tmm.E_mat(fmat, mode = +1, copy = False)
-            fi = inv(f)
-            pmat = phase_mat(alpha[...,::2],kd)
-        else:
-            alpha,f,fi = alphaffi(beta,phi,epsv,epsa)
-            pmat = phase_mat(alpha,-kd)
-            if method == "4x4_1":
-                pmat[...,1::2] = 0.
-            if method != "4x4":
-                raise ValueError("Unsupported method.")
-
-        wave = eigenwave(shape, indices[j,0],indices[j,1], amplitude = 1.)
-
-        m = dotmdm(f,pmat,fi) 
-        mw = m*wave[...,None,None]
-                
-        mf = mfft2(mw, overwrite_x = True)
-        
-        #dd = np.linspace(0,1.,10)*d
-        
-        # dmat = 0.
-        
-        # for dm in dd:
-        
-        #     dmat = dmat + second_field_diffraction_matrix(shape, -k0, beta, phi,dm, 
-        #                                   epsv = (1.5,1.5,1.5),
-        #                             epsa = (0.,0.,0.), betamax = 1.4) /len(dd)
-            
-        # mf = dotmm(dmat,mf)
-        
+        alpha,f,fi = alphaffi(betas,phis,epsv,epsa)
+        pmat = phase_mat(alpha,-kd)
+    return dotmdm(f,pmat,fi) 
+
+def _layer_mat3d_diag(k0,d,epsv,epsa, mask, betas, phis,indices, method):  
+    kd = k0*d
+    return _mode_mat3d(kd, betas, phis, epsv[...,0,0,:], epsa[...,0,0,:], method)
+
+def _layer_mat3d_columns(kd, epsv, epsa, index, mask, betas, phis, indices, method, out):
+    """Computes columns of the layer matrix for a subset of modes."""
+    shape = mask.shape
+    m = _mode_mat3d(kd, betas[:,None], phis[:,None], epsv, epsa, method)
+    
+    #plane eigenwaves of unit amplitude, same as eigenwave(shape, i, j, amplitude = 1.)
+    wy = np.exp((2j*np.pi/shape[0]) * np.outer(indices[:,0], np.arange(shape[0])))
+    wx = np.exp((2j*np.pi/shape[1]) * np.outer(indices[:,1], np.arange(shape[1])))
+    wave = (wy[:,:,None] * wx[:,None,:]) / (shape[0]*shape[1])
+    
+    mw = m[:,index] * wave[...,None,None]
+    mf = mfft2(mw, overwrite_x = True)
+    
+    out[...] = np.swapaxes(mf[:,mask,...],0,1)
 
-        mf = mf[mask,...]
-        
-        out[:,j,:,:] = mf
+def _layer_mat3d(k0,d,epsv,epsa, mask, betas, phis,indices, method):  
+    n = len(betas)
+    kd = k0*d#/2.
+    shape = epsv.shape[-3],epsv.shape[-2]
+    m = 2 if method.startswith("2x2") else 4
+    out = np.empty(shape = (n, n, m, m), dtype = conf.CDTYPE)
+    
+    #eigensystems are computed for distinct materials only
+    (epsv, epsa), index = unique_epsva(shape, epsv, epsa)
+    
+    #temporary data per mode: eigensystems and two full-size matrix arrays
+    nbytes = (len(epsv) * (3*16 + 2*4) + 2 * shape[0] * shape[1] * m * m) * np.dtype(conf.CDTYPE).itemsize
+    #memory budget is shared between threads
+    max_memory = DTMMConfig.max_memory / DTMMConfig.nthreads
+    
+    def _compute(s):
+        _layer_mat3d_columns(kd, epsv, epsa, index, mask, betas[s], phis[s], indices[s], method, out[:,s])
+    
+    pool_map(_compute, mode_slices(n, nbytes, max_memory))
 
+    return out
 
+def _is_homogeneous(epsv, epsa):
+    """Checks whether layer material is constant across x and y."""
+    epsv, epsa = np.asarray(epsv), np.asarray(epsa)
+    return bool(np.all(epsv == epsv[...,0:1,0:1,:]) and np.all(epsa == epsa[...,0:1,0:1,:]))
+
+def _layer_runs(d, epsv, epsa):
+    """Groups identical consecutive layers. Returns a list of [index, count]."""
+    runs = []
+    for i in range(len(d)):
+        if runs:
+            j = runs[-1][0]
+            if d[i] == d[j] and np.array_equal(epsv[i], epsv[j]) and np.array_equal(epsa[i], epsa[j]):
+                runs[-1][1] += 1
+                continue
+        runs.append([i,1])
+    return runs
+
+def _dot3d(a, b):
+    """Multiplies two layer matrices, each of them is either a full matrix of
+    shape (n*k,n*k) or a block diagonal matrix given by its blocks of shape (n,k,k)."""
+    if a.ndim == 3 and b.ndim == 3:
+        return dotmm(a,b)
+    elif a.ndim == 2 and b.ndim == 2:
+        return np.matmul(a,b)
+    elif a.ndim == 2:
+        n, k = b.shape[0], b.shape[-1]
+        a = np.swapaxes(a.reshape((n*k, n, k)),0,1)
+        return np.swapaxes(np.matmul(a,b),0,1).reshape((n*k,n*k))
+    else:
+        n, k = a.shape[0], a.shape[-1]
+        return np.matmul(a, b.reshape((n, k, n*k))).reshape((n*k,n*k))
+    
+def _diag2bmat(m):
+    """Converts diagonal blocks of shape (n,k,k) to a block matrix (n,n,k,k)."""
+    n = m.shape[0]
+    out = np.zeros((n,) + m.shape, m.dtype)
+    out[np.arange(n),np.arange(n)] = m
     return out
 
-def stack_mat3d(k,d,epsv,epsa, method = "4x4" ,mask = None):
+def stack_mat3d(k,d,epsv,epsa, method = "4x4" ,mask = None, callback = None, repeat = 1):
+    """Computes a stack characteristic matrix.
+    
+    Laterally homogeneous layers are kept in a compact block diagonal form, 
+    identical consecutive layers are computed by repeated squaring and 
+    inhomogeneous layer matrices are built in chunks of modes, which are 
+    computed in parallel if DTMMConfig.nthreads > 1. Full matrices are 
+    multiplied as (BLAS-backed) matrix products, by tree reduction (see 
+    :func:`.linalg.tree_dot`).
+    
+    Parameters
+    ----------
+    k : float or sequence of floats
+        A scalar or a vector of wavenumbers
+    d : array_like
+        Layer thicknesses.
+    epsv : array_like
+        Epsilon eigenvalues.
+    epsa : array_like
+        Optical axes orientation angles (psi, theta, phi).
+    method : str, optional
+        Either a 4x4 or 2x2.
+    mask : ndarray, optional
+        Mode mask.
+    callback : callable, optional
+        A function that is called after each layer as callback(i, n, eta), 
+        where i is the number of processed layers, n is the number of layers
+        and eta is the estimated remaining time in seconds.
+    repeat : int, optional
+        If specified, the layers define a period of a periodic stack (e.g. a 
+        pitch of a cholesteric) that is repeated this many times. The stack 
+        matrix is computed from the period matrix by repeated squaring.
+    
+    Returns
+    -------
+    cmat : ndarray or tuple of ndarrays
+        Characteristic matrix of the stack.
+    """
     n = len(d)
     verbose_level = DTMMConfig.verbose
     if verbose_level > 1:
         print ("Building stack matrix.")
-    for i in range(n):
-        print_progress(i,n,level = verbose_level) 
-        mat = layer_mat3d(k,d[i],epsv[i],epsa[i], mask = mask, method = method)
-        if i == 0:
-            if isinstance(mat, tuple):
-                out = tuple((m.copy() for m in mat))
-            else:
-                out = mat.copy()
-        else:
-            if isinstance(mat, tuple):
-                if method.startswith("2x2"):
-                    out = tuple((bdotmm(m,o) for o,m in zip(out,mat)))
-                else:
-                    out = tuple((bdotmm(o,m) for o,m in zip(out,mat)))
+    t0 = time.time()
+    runs = _layer_runs(d, epsv, epsa)
+    is_tuple = False
+    
+    def _run_mats():
+        nonlocal is_tuple
+        i = 0
+        for index, count in runs:
+            print_progress(i,n,level = verbose_level) 
+            if _is_homogeneous(epsv[index], epsa[index]):
+                mat = layer_mat3d(k,d[index],epsv[index],epsa[index], mask = mask, method = method, diagonal = True)
+                is_tuple = isinstance(mat, tuple)
+                mat = mat if is_tuple else (mat,)
             else:
-                if method.startswith("2x2"):
-                    out = dotmm(mat,out)
-                else:
-                    out = dotmm(out,mat)
+                mat = layer_mat3d(k,d[index],epsv[index],epsa[index], mask = mask, method = method)
+                is_tuple = isinstance(mat, tuple)
+                mat = tuple((bmat2mat(m) for m in mat)) if is_tuple else (bmat2mat(mat),)
+            if count > 1:
+                mat = tuple((np.linalg.matrix_power(m, count) for m in mat))
+            i += count
+            if callback is not None:
+                t = time.time() - t0
+                callback(i, n, t/i * (n-i))
+            yield mat
+    
+    #full matrices are large, so they are multiplied by tree reduction only if 
+    #all of them fit in the memory budget, else as they are computed
+    dot = lambda a, b : tuple((_dot3d(x,y) for x,y in zip(a,b)))
+    out = tree_dot(_buffered(_run_mats(), len(runs)), reverse = method.startswith("2x2"), dot = dot)
+    if repeat != 1:
+        out = matrix_power(out, repeat, dot = dot)
       
     print_progress(n,n,level = verbose_level) 
-
-    return out 
+    
+    k = 2 if method.startswith("2x2") else 4
+    out = tuple((_diag2bmat(o) if o.ndim == 3 else np.ascontiguousarray(mat2bmat(o, k)) for o in out))
+    return out if is_tuple else out[0]
+
+def _star3d(a, b):
+    """Star product of two scattering matrices, each of them is either a full
+    matrix of shape (n*4,n*4) or a block diagonal matrix given by its blocks of shape (n,4,4)."""
+    if a.ndim != b.ndim:
+        a, b = (fmat3d(m) if m.ndim == 3 else m for m in (a,b))
+    return tmm.star_product(a,b)
+
+def scattering_mat3d(k,d,epsv,epsa, fmatin, fmatout, mask = None, callback = None):
+    """Computes a stack scattering matrix.
+    
+    The result is the same as that of 
+    reflection_mat3d(system_mat3d(fmatin, stack_mat3d(k,d,epsv,epsa, mask = mask), fmatout)),
+    but it is computed as the Redheffer star product (see :func:`.tmm.star_product`)
+    of layer scattering matrices, so it is numerically stable for thick stacks. 
+    Layer scattering matrices are computed from eigensystems with decaying 
+    exponentials only; of the modes for laterally homogeneous layers, and of 
+    the layer system matrix (see :func:`stack_mat3d`) for inhomogeneous layers.
+    
+    Parameters
+    ----------
+    k : float or sequence of floats
+        A scalar or a vector of wavenumbers
+    d : array_like
+        Layer thicknesses.
+    epsv : array_like
+        Epsilon eigenvalues.
+    epsa : array_like
+        Optical axes orientation angles (psi, theta, phi).
+    fmatin : ndarray or tuple of ndarrays
+        Input field matrix, as returned by :func:`f_iso3d`.
+    fmatout : ndarray or tuple of ndarrays
+        Output field matrix, as returned by :func:`f_iso3d`.
+    mask : ndarray, optional
+        Mode mask.
+    callback : callable, optional
+        A function that is called after each layer as callback(i, n, eta), 
+        see :func:`stack_mat3d`.
+    
+    Returns
+    -------
+    rmat : ndarray or tuple of ndarrays
+        Scattering matrix of the stack, see :func:`reflect3d`.
+    """
+    n = len(d)
+    verbose_level = DTMMConfig.verbose
+    if verbose_level > 1:
+        print ("Building stack scattering matrix.")
+    t0 = time.time()
+    runs = _layer_runs(d, epsv, epsa)
+    is_tuple = isinstance(fmatin, tuple)
+    fmatin = fmatin if is_tuple else (fmatin,)
+    fmatout = fmatout if is_tuple else (fmatout,)
+    fmatini = tuple((inv(f) for f in fmatin))
+    k = np.asarray(k)
+    shape = epsv.shape[-3],epsv.shape[-2]
+    if mask is None:
+        betas, phis = eigenbeta(shape, k), eigenphi(shape, k)
+    else:
+        betas, phis = mask2beta(mask,k), mask2phi(mask,k)
+    if k.ndim == 0:
+        ks, betas, phis, masks = (k,), (betas,), (phis,), (mask,)
+    else:
+        ks, masks = tuple(k), ((mask,)*len(k) if mask is None else tuple(mask))
+    
+    def _layer_mat(index, i):
+        #layer scattering matrix of i-th wavenumber, with the input medium on both sides
+        if _is_homogeneous(epsv[index], epsa[index]):
+            #exact, computed from the eigensystems of the modes
+            kd = np.asarray(ks[i]*d[index])[None]
+            return tmm.scattering_mat(kd, epsv[index][None,0,0], epsa[index][None,0,0], beta = betas[i], 
+                                      phi = phis[i], fmatin = fmatin[i], fmatout = fmatin[i])
+        else:
+            def system_mat(nsub):
+                m = layer_mat3d(ks[i],d[index]/nsub,epsv[index],epsa[index], mask = masks[i])
+                return bmat2mat(_system_mat3d(fmatin[i],m,fmatin[i]))
+            return tmm._layer_scattering_mat(system_mat, fmatin[i])
+    
+    def _run_mats():
+        i = 0
+        for index, count in runs:
+            print_progress(i,n,level = verbose_level) 
+            mat = tuple((_layer_mat(index, j) for j in range(len(ks))))
+            if count > 1:
+                mat = tuple((matrix_power(m, count, dot = _star3d) for m in mat))
+            i += count
+            if callback is not None:
+                t = time.time() - t0
+                callback(i, n, t/i * (n-i))
+            yield mat
+
+    dot = lambda a, b : tuple((_star3d(x,y) for x,y in zip(a,b)))
+    out = tree_dot(_buffered(_run_mats(), len(runs)), dot = dot)
+    #interface between input and output media
+    out = dot(out, tuple((tmm.reflection_mat(dotmm(fi,f)) for fi,f in zip(fmatini,fmatout))))
+    
+    print_progress(n,n,level = verbose_level) 
+    
+    out = tuple((fmat3d(o) if o.ndim == 3 else o for o in out))
+    return out if is_tuple else out[0]
 
 def fmat3d(fmat):
     """Converts a sequence of 4x4 matrices to a single large matrix"""
@@ -272,7 +477,7 @@ def reflect3d(fvecin, fmatin, rmat, fmatout, fvecout = None):
         return _reflect3d(fvecin, fmatin, rmat, fmatout, fvecout)
     
 
-def transfer3d(field_data_in, optical_data, nin = 1., nout = 1., method = "4x4", betamax = BETAMAX, field_out = None):
+def transfer3d(field_data_in, optical_data, nin = 1., nout = 1., method = "4x4", betamax = BETAMAX, field_out = None, callback = None):
     
     f,w,p = field_data_in
     shape = f.shape[-2:]
@@ -289,9 +494,12 @@ def transfer3d(field_data_in, optical_data, nin = 1., nout = 1., method = "4x4",
     fmatin = f_iso3d(shape = shape, k0 = k0, n=nin, betamax = betamax)
     fmatout = f_iso3d(shape = shape, k0 = k0, n=nout, betamax = betamax)
     
-    cmat = stack_mat3d(k0,d, epsv, epsa, mask = mask, method = method)
-    smat = system_mat3d(fmatin = fmatin, cmat = cmat, fmatout = fmatout)
-    rmat = reflection_mat3d(smat)
+    if method == "4x4_s":
+        rmat = scattering_mat3d(k0,d, epsv, epsa, fmatin, fmatout, mask = mask, callback = callback)
+    else:
+        cmat = stack_mat3d(k0,d, epsv, epsa, mask = mask, method = method, callback = callback)
+        smat = system_mat3d(fmatin = fmatin, cmat = cmat, fmatout = fmatout)
+        rmat = reflection_mat3d(smat)
     
     fmode_out = reflect3d(fmode_in, rmat = rmat, fmatin = fmatin, fmatout = fmatout, fvecout = fmode_out)
     
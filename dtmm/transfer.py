@@ -5,16 +5,19 @@ Main top level calculation functions for light propagation through optical data.
 """
 from __future__ import absolute_import, print_function, division
 import time
-from dtmm.conf import DTMMConfig,  BETAMAX, SMOOTH, FDTYPE, get_default_config_option
+from dtmm.conf import DTMMConfig,  BETAMAX, SMOOTH, F64DTYPE, C64DTYPE, C128DTYPE, \
+    get_default_config_option
+import dtmm.conf as conf
 from dtmm.wave import k0
 from dtmm.data import uniaxial_order, refind2eps, validate_optical_data
 from dtmm.tmm import E2H_mat, projection_mat, alphaf
 from dtmm.tmm3d import transfer3d
 from dtmm.linalg import  dotmf, dotmv
 from dtmm.print_tools import print_progress
-from dtmm.diffract import diffract, projection_matrix, diffraction_alphaffi
-from dtmm.field import field2intensity, field2betaphi, field2fvec
+from dtmm.diffract import diffract, projection_matrix, diffraction_alphaffi, compact_field_diffraction_matrix
+from dtmm.field import field2intensity, field2betaphi, field2fvec, memmap_field, ffield2modes, modes2ffield
 from dtmm.fft import fft2, ifft2
+from dtmm.parallel import map_jobs
 from dtmm.jones import jonesvec, polarizer
 from dtmm.jones4 import ray_jonesmat4x4
 from dtmm.data import effective_data
@@ -22,7 +25,7 @@ import numpy as np
 from dtmm.denoise import denoise_fftfield, denoise_field
 
 from dtmm.propagate_4x4 import propagate_4x4_full, propagate_4x4_effective_1,\
-    propagate_4x4_effective_2,propagate_4x4_effective_3,propagate_4x4_effective_4
+    propagate_4x4_effective_2,propagate_4x4_effective_3,propagate_4x4_effective_4, LayerOperators
 from dtmm.propagate_2x2 import propagate_2x2_full, propagate_2x2_effective_1,propagate_2x2_effective_2
 
 #norm flags
@@ -41,8 +44,8 @@ def _isotropic_effective_data(data):
 def _validate_betaphi(beta,phi, extendeddim = 0):
     if beta is None or phi is None:
         raise ValueError("Both beta and phi must be defined!")
-    beta = np.asarray(beta, FDTYPE)
-    phi = np.asarray(phi, FDTYPE)  
+    beta = np.asarray(beta, conf.FDTYPE)
+    phi = np.asarray(phi, conf.FDTYPE)  
     
     if beta.ndim != phi.ndim:
         raise ValueError("Beta nad phi should have same dimensions!")
@@ -62,6 +65,14 @@ def _validate_betaphi(beta,phi, extendeddim = 0):
             phi = phi[...,None]        
     return beta, phi
 
+def _field2intensity(field):
+    """Computes field intensity. In mixed precision mode, intensity of a single 
+    precision field is computed in double precision."""
+    field = np.asarray(field)
+    if DTMMConfig.precision == "mixed" and field.dtype == C64DTYPE:
+        return field2intensity(field, signature = (C64DTYPE, F64DTYPE))
+    return field2intensity(field)
+
 def normalize_field(field, intensity_in, intensity_out, out = None):
     m = intensity_out == 0.
     intensity_out[m] = 1.
@@ -76,13 +87,13 @@ def normalize_field(field, intensity_in, intensity_out, out = None):
 def project_normalized_fft(field, dmat, window = None, ref = None, out = None):
     if ref is not None:
         fref = fft2(ref, out = out)
-        intensity1 = field2intensity(fref)
+        intensity1 = _field2intensity(fref)
         f1 = fft2(field, out = out)
     else:
         f1 = fft2(field, out = out)
-        intensity1 = field2intensity(f1)
+        intensity1 = _field2intensity(f1)
     f2 = dotmf(dmat, f1 ,out = f1)
-    intensity2 = field2intensity(f2)
+    intensity2 = _field2intensity(f2)
     f3 = normalize_field(f2, intensity1, intensity2, out = f2)
     out = ifft2(f3, out = out)
     if window is not None:
@@ -112,14 +123,14 @@ def project_normalized_local(field, dmat, window = None, ref = None, out = None)
     pmat2[...,3,3] += 1 #pmat1 + pmat2 = identity by definition
     
     if ref is not None:
-        intensity1 = field2intensity(dotmf(pmat1, ref))
+        intensity1 = _field2intensity(dotmf(pmat1, ref))
         ref = dotmf(pmat2, ref)
         
     else:
-        intensity1 = field2intensity(dotmf(pmat1, field))
+        intensity1 = _field2intensity(dotmf(pmat1, field))
         ref = dotmf(pmat2, field)
 
-    intensity2 = field2intensity(f)
+    intensity2 = _field2intensity(f)
     
     f = normalize_field(f, intensity1, intensity2)
     
@@ -161,14 +172,14 @@ def project_normalized_local(field, dmat, window = None, ref = None, out = None)
     pmat2[...,3,3] += 1 #pmat1 + pmat2 = identity by definition
     
     if ref is not None:
-        intensity1 = field2intensity(dotmf(pmat1, ref))
+        intensity1 = _field2intensity(dotmf(pmat1, ref))
         ref = dotmf(pmat2, ref)
         
     else:
-        intensity1 = field2intensity(dotmf(pmat1, field))
+        intensity1 = _field2intensity(dotmf(pmat1, field))
         ref = dotmf(pmat2, field)
 
-    intensity2 = field2intensity(f)
+    intensity2 = _field2intensity(f)
     
     f = normalize_field(f, intensity1, intensity2)
     
@@ -191,7 +202,7 @@ def normalize_field_total(field, i1, i2, out = None):
 def total_intensity(field):
     """Calculates total intensity of the field. 
     Computes intesity and sums over pixels."""
-    i = field2intensity(field)
+    i = _field2intensity(field)
     return i.sum(tuple(range(i.ndim))[-2:])#sum over pixels
 
 def project_normalized_total(field, dmat, window = None, ref = None, out = None):
@@ -234,7 +245,7 @@ def _projected_field(field, wavenumbers, mode, n = 1, betamax = BETAMAX,  out =
     
 #def jones2H(jones,beta = 0., phi = 0., n = 1., out = None):
 #    eps = refind2eps([n]*3)
-#    layer = np.asarray((0.,0.,0.), dtype = FDTYPE)
+#    layer = np.asarray((0.,0.,0.), dtype = conf.FDTYPE)
 #    alpha, f = alphaf(beta,phi,layer,eps) 
 #    A = f[...,::2,::2]
 #    B = f[...,1::2,::2]
@@ -245,7 +256,7 @@ def _projected_field(field, wavenumbers, mode, n = 1, betamax = BETAMAX,  out =
 def jones2H(jones, wavenumbers, n = 1., betamax = BETAMAX, mode = +1, out = None):  
     eps = refind2eps([n]*3)
     shape = jones.shape[-2:]
-    layer = np.asarray((0.,0.,0.), dtype = FDTYPE)
+    layer = np.asarray((0.,0.,0.), dtype = conf.FDTYPE)
     alpha, f, fi = diffraction_alphaffi(shape, wavenumbers, epsv = eps, 
                             epsa = layer, betamax = betamax)
 #    A = f[...,::2,::2]
@@ -313,7 +324,7 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
            multiray = False,
            norm = DTMM_NORM_FFT, betamax = BETAMAX, smooth = SMOOTH, split_rays = False,
            split_diffraction = False,split_wavelengths = False,
-           eff_data = None, ret_bulk = False, out = None):
+           eff_data = None, ret_bulk = False, out = None, workers = None, executor = "thread"):
     """Tranfers input field data through optical data.
     
     This function calculates transmitted field and possibly (when npass > 1) 
@@ -406,42 +417,28 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
         the :func:`.data.effective_data` function.
     ret_bulk : bool, optional
         Whether to return bulk field instead of the transfered field (default).
-    out : ndarray, optional
-        Output array.
+    out : ndarray, array-like or str, optional
+        Output array. With ret_bulk, this can be any writable array-like object 
+        (e.g. a `np.memmap`, or a h5py dataset) of shape 
+        (len(optical_data[0])+2,) + field.shape. Fields are written to it 
+        layer-by-layer as they are computed, so the bulk data does not need to 
+        fit in memory. If a string is provided, a memory-mapped ``.dtmf`` file 
+        is created, see :func:`.field.memmap_field`.
+    workers : int, optional
+        If specified, wavelengths (with split_wavelengths or with a tuple of 
+        fields) and rays (with split_rays) are computed in parallel by the given 
+        number of workers. Not supported with ret_bulk, in which case the 
+        computation is sequential. 
+    executor : str, optional
+        Either "thread" (default) or "process". With "process", field and 
+        optical data are shared with the worker processes through shared memory.
     
     """
-    nin = get_default_config_option("nin",nin)
-    nout = get_default_config_option("nout",nout)
-    method = get_default_config_option("method",method)
-    npass = get_default_config_option("npass",npass)
-    eff_data = get_default_config_option("eff_data",eff_data)
-    diffraction = get_default_config_option("diffraction",diffraction)
-    reflection = get_default_config_option("reflection",reflection)
-    
+    nin, nout, method, npass, eff_data, diffraction, reflection = \
+        _transfer_options(nin, nout, method, npass, eff_data, diffraction, reflection)
     
     t0 = time.time()
     verbose_level = DTMMConfig.verbose
-    
-    
-    if method == "4x4" and npass > 1 and diffraction == False:
-        import warnings
-        warnings.warn("The 4x4 method with diffraction disabled is not yet supported\
-                      for input fields with beta >0. Use 2x2 method insted.")
-        
-    if npass == -1 or npass == np.inf:
-        method = "4x4"
-        diffraction = np.inf
-        reflection = 2
-        
-    #choose best/supported reflection mode based on other arguments
-    if reflection is None:
-        reflection = 0 if method == "2x2" else 1
-        if method == "4x4" and diffraction == 0:
-            reflection = 2
-        if npass > 1:
-            reflection = 1
-            if diffraction > 1 and method == "2x2":
-                reflection = 2
                 
     if verbose_level > 0:
         print("Transferring input field.")    
@@ -463,6 +460,19 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
     
     
     field_in,wavelengths,pixelsize = field_data
+    
+    estimate_error = verbose_level > 1 and DTMMConfig.precision == "mixed" and \
+        not isinstance(field_in, tuple) and ret_bulk == False
+    if estimate_error:
+        #input of the double precision reference run, first wavelength only
+        if np.ndim(wavelengths) == 0:
+            #single wavelength, field has no wavelength axis
+            ref_index = Ellipsis
+            ref_wavelengths = wavelengths
+        else:
+            ref_index = (Ellipsis, slice(0,1), slice(None), slice(None), slice(None))
+            ref_wavelengths = np.atleast_1d(wavelengths)[0:1]
+        ref_data = (np.array(field_in[ref_index], C128DTYPE), ref_wavelengths, pixelsize)
 
 #    if out is None:
 #        if ret_bulk == True:
@@ -473,10 +483,18 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
 #    else:
 #        field_out = out
     
+    if ret_bulk == True and isinstance(out, str):
+        if isinstance(field_in, tuple):
+            raise ValueError("Output file is not supported for a tuple of fields.")
+        #must have a length of optical data + 2 extra layers
+        shape = (len(optical_data[0])+2,)+field_in.shape
+        out = memmap_field(out, shape, wavelengths, pixelsize, dtype = field_in.dtype)[0]
+    
     splitted_wavelengths = split_wavelengths == True and not isinstance(field_in, tuple) and ret_bulk == False
 
+    parallel = workers is not None and ret_bulk == False
     
-    if splitted_wavelengths:
+    if splitted_wavelengths and not parallel:
         
         if out is None:
             out_field = np.empty_like(field_in) 
@@ -485,7 +503,13 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
         out = [out_field[...,i,:,:,:] for i in range(len(wavelengths))]
         field_in = tuple((field_in[...,i,:,:,:] for i in range(len(wavelengths))))
 
-    if isinstance(field_in, tuple):
+    if parallel:
+        out = _transfer_field_parallel(field_data, optical_data, beta, phi, nin, nout,  
+               npass , nstep, diffraction, reflection , method, 
+               multiray, norm, betamax, smooth, split_rays,
+               split_diffraction, splitted_wavelengths,
+               eff_data, out, workers, executor)
+    elif isinstance(field_in, tuple):
         nwavelengths = len(field_in)
         if out is None:
             out = [None for i in range(len(field_in))]
@@ -493,11 +517,14 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
             if verbose_level >0:
                 print("Wavelength {}/{}".format(i+1,nwavelengths))
             field_data = f,w,pixelsize
-            o = _transfer_field(field_data, optical_data, beta, phi, nin, nout,  
+            field_out = _transfer_field(field_data, optical_data, beta, phi, nin, nout,  
                 npass , nstep, diffraction, reflection , method, 
                 multiray, norm, betamax, smooth, split_rays,
                 split_diffraction, eff_data, ret_bulk, o) 
-            out[i] = o
+            if splitted_wavelengths and not np.shares_memory(field_out[0], o):
+                #transfer3d does not support the out argument
+                o[...] = field_out[0]
+            out[i] = field_out
         out = tuple(out)
     else:
     
@@ -508,21 +535,215 @@ def transfer_field(field_data, optical_data, beta = None, phi = None, nin = None
                eff_data, ret_bulk, out)   
 
     t = time.time()-t0
+    
+    if splitted_wavelengths and not parallel:
+        out = out_field, wavelengths, pixelsize
+        
+    if estimate_error:
+        if verbose_level > 0:
+            print("Computing double precision reference.")
+        #computed in a separate process, so that global precision is not changed
+        args = (beta, phi, nin, nout, npass , nstep, diffraction, reflection , method, 
+               multiray, norm, betamax, smooth, split_rays,
+               split_diffraction, eff_data, False, None)
+        ref = map_jobs(_reference_job, [(ref_data, optical_data, args)], {}, 
+                       workers = 1, executor = "process", precision = "double")[0]
+        error = np.abs(out[0][ref_index] - ref).max() / np.abs(ref).max()
+        
     if verbose_level >1:
         print("------------------------------------")
         print("   Done in {:.2f} seconds!".format(t))  
+        if estimate_error:
+            print("   Mixed precision error estimate: {:.2e}".format(error))  
         print("------------------------------------")
     
-    if splitted_wavelengths:
-        return out_field, wavelengths, pixelsize
+    return out
+
+#: approximate number of field-sized temporary arrays needed by a single job
+_JOB_MEMORY_FACTOR = 8
+
+def _transfer_options(nin, nout, method, npass, eff_data, diffraction, reflection):
+    """Sets default options of transfer_field and chooses best/supported
+    reflection mode."""
+    nin = get_default_config_option("nin",nin)
+    nout = get_default_config_option("nout",nout)
+    method = get_default_config_option("method",method)
+    npass = get_default_config_option("npass",npass)
+    eff_data = get_default_config_option("eff_data",eff_data)
+    diffraction = get_default_config_option("diffraction",diffraction)
+    reflection = get_default_config_option("reflection",reflection)
+    
+    if method == "4x4" and npass > 1 and diffraction == False:
+        import warnings
+        warnings.warn("The 4x4 method with diffraction disabled is not yet supported\
+                      for input fields with beta >0. Use 2x2 method insted.")
+        
+    if npass == -1 or npass == np.inf:
+        method = "4x4"
+        diffraction = np.inf
+        reflection = 2
+        
+    #choose best/supported reflection mode based on other arguments
+    if reflection is None:
+        reflection = 0 if method == "2x2" else 1
+        if method == "4x4" and diffraction == 0:
+            reflection = 2
+        if npass > 1:
+            reflection = 1
+            if diffraction > 1 and method == "2x2":
+                reflection = 2
+    return nin, nout, method, npass, eff_data, diffraction, reflection
+
+def iter_transfer(field_data, optical_data, beta = None, phi = None, nin = None, nout = None,  
+           npass = None, nstep=1, diffraction = None, reflection = None, method = None, 
+           multiray = False, norm = DTMM_NORM_FFT, betamax = BETAMAX, smooth = SMOOTH, 
+           split_diffraction = False, eff_data = None, out = None):
+    """Transfers input field data through optical data layer-by-layer.
+    
+    This is a generator version of :func:`transfer_field`. Instead of storing
+    the bulk data (see `ret_bulk`), it yields the field after each propagation 
+    step, so that layer quantities (e.g. intensity or Poynting flux) can be 
+    computed on the fly, with memory requirements that do not depend on the 
+    number of layers. Stop iterating to abort the calculation.
+    
+    Parameters
+    ----------
+    field_data : Field data tuple
+        Input field data tuple. A tuple of fields is not supported.
+    optical_data : Optical data tuple
+        Optical data tuple through which input field is transfered.
+    kwargs : optional
+        See :func:`transfer_field` for the rest of the parameters. npass = -1 
+        is not supported.
+    
+    Yields
+    ------
+    index : int
+        Index of the layer as in the bulk data (0 is the input layer, 
+        len(optical_data[0])+1 is the output layer).
+    field : ndarray
+        Field in the layer. It is a work array that may be overwritten in the 
+        next step, so copy it if you need to keep it. With npass > 1, layers are 
+        yielded for each pass in the direction of propagation, and with the 2x2
+        method, the field consists only of the waves of the current pass (the 
+        bulk field is a sum over all passes). The last yielded value is the 
+        output field, which is also written to `out`.
+    """
+    nin, nout, method, npass, eff_data, diffraction, reflection = \
+        _transfer_options(nin, nout, method, npass, eff_data, diffraction, reflection)
+    if npass == -1 or npass == np.inf:
+        raise ValueError("npass = -1 is not supported by iter_transfer.")
+    if isinstance(field_data[0], tuple):
+        raise ValueError("A tuple of fields is not supported by iter_transfer.")
+    if method == "4x4":
+        steps = _transfer_4x4_steps(field_data, optical_data, beta = beta, 
+                       phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
+                  diffraction = diffraction, reflection = reflection, multiray = multiray,norm = norm, smooth = smooth,
+                  betamax = betamax, out = out, steps = True)
+    else:
+        steps = _transfer_2x2_steps(field_data, optical_data, beta = beta, 
+               phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
+          diffraction = diffraction,  multiray = multiray,split_diffraction = split_diffraction,reflection = reflection, 
+          betamax = betamax, out = out, steps = True)
+    for step in steps:
+        yield step
+
+def _transfer_job(arrays, job):
+    """Computes a single wavelength and/or ray of the parallel transfer_field."""
+    key, index, wavelengths, pixelsize, beta, phi, multiray, args = job
+    field = arrays["field{}".format(key)][index]
+    out = arrays["out{}".format(key)][index]
+    optical_data = arrays["d"], arrays["epsv"], arrays["epsa"]
+    nin, nout, npass , nstep, diffraction, reflection , method, norm, betamax, smooth, \
+                split_diffraction = args
+    if "d_eff" in arrays:
+        #layers are views of the shared optical data, no data is copied
+        eff_data = arrays["d_eff"], arrays["epsv_eff"], arrays["epsa_eff"]
+        layers = _layers_list(optical_data, eff_data, nin, nout, nstep, validate = False)
     else:
-        return out
+        eff_data, layers = None, None
+    field_out = _transfer_field((field, wavelengths, pixelsize), optical_data, beta, phi, nin, nout,  
+               npass , nstep, diffraction, reflection , method, 
+               multiray, norm, betamax, smooth, False,
+               split_diffraction, eff_data, False, out, layers)[0]
+    if not np.shares_memory(field_out, out):
+        #transfer3d does not support the out argument
+        out[...] = field_out
+
+def _reference_job(arrays, job):
+    """Computes the double precision reference of the mixed precision error 
+    estimate in transfer_field."""
+    field_data, optical_data, args = job
+    return _transfer_field(field_data, optical_data, *args)[0]
+
+def _transfer_field_parallel(field_data, optical_data, beta, phi, nin, nout,  
+           npass , nstep, diffraction, reflection , method, 
+           multiray, norm, betamax, smooth, split_rays,
+           split_diffraction, split_wavelengths,
+           eff_data, out, workers, executor):
+    """Parallel version of transfer_field. Wavelengths and rays are computed 
+    as independent jobs, see :func:`.parallel.map_jobs`. Optical data is 
+    validated and effective data is computed only once and shared (read-only)
+    by all jobs."""
+    field_in, wavelengths, pixelsize = field_data
+    d, epsv, epsa = validate_optical_data(optical_data)
+    arrays = {"d" : d, "epsv" : epsv, "epsa" : epsa}
+    if not (npass == -1 or npass == np.inf):
+        d_eff, epsv_eff, epsa_eff = _effective_data((d, epsv, epsa), eff_data)
+        arrays.update({"d_eff" : d_eff, "epsv_eff" : epsv_eff, "epsa_eff" : epsa_eff})
+    args = (nin, nout, npass , nstep, diffraction, reflection , method, norm, betamax, smooth, 
+            split_diffraction)
+    
+    #list of (index, wavelengths) for each field array
+    if isinstance(field_in, tuple):
+        if out is None:
+            out = [np.empty_like(f) for f in field_in]
+        else:
+            out = list(out)
+        fields = field_in
+        items = [[((Ellipsis,), w)] for w in wavelengths]
+    else:
+        if out is None:
+            out = np.empty_like(field_in)
+        fields, out = [field_in], [out]
+        if split_wavelengths:
+            items = [[((Ellipsis,i,slice(None),slice(None),slice(None)), w) for i,w in enumerate(wavelengths)]]
+        else:
+            items = [[((Ellipsis,), wavelengths)]]
+            
+    jobs = []
+    nbytes = 0
+    for key, (f, o, item) in enumerate(zip(fields, out, items)):
+        arrays["field{}".format(key)] = f
+        arrays["out{}".format(key)] = o
+        for index, w in item:
+            if split_rays:
+                nrays = len(f)
+                betas = [None] * nrays if beta is None else beta
+                phis = [None] * nrays if phi is None else phi
+                for i in range(nrays):
+                    jobs.append((key, (i,) + index, w, pixelsize, betas[i], phis[i], False, args))
+                nbytes = max(nbytes, f[(0,) + index].nbytes)
+            else:
+                jobs.append((key, index, w, pixelsize, beta, phi, multiray, args))
+                nbytes = max(nbytes, f[index].nbytes)
+    
+    #input field is only modified with multiple passes
+    prefix = ("out",) if npass == 1 else ("field","out")
+    outputs = [key for key in arrays.keys() if key.startswith(prefix)]
+    map_jobs(_transfer_job, jobs, arrays, outputs = outputs, workers = workers, 
+             executor = executor, nbytes = nbytes * _JOB_MEMORY_FACTOR)
+    
+    if isinstance(field_in, tuple):
+        return tuple(((o, w, pixelsize) for o,w in zip(out, wavelengths)))
+    else:
+        return out[0], wavelengths, pixelsize
 
 def _transfer_field(field_data, optical_data, beta, phi, nin, nout,  
            npass , nstep, diffraction, reflection , method, 
            multiray, norm, betamax, smooth, split_rays,
            split_diffraction ,
-           eff_data, ret_bulk, out):
+           eff_data, ret_bulk, out, layers = None):
     verbose_level = DTMMConfig.verbose
  
     if split_rays == False:
@@ -533,11 +754,11 @@ def _transfer_field(field_data, optical_data, beta, phi, nin, nout,
                 out = transfer_4x4(field_data, optical_data, beta = beta, 
                            phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
                       diffraction = diffraction, reflection = reflection, multiray = multiray,norm = norm, smooth = smooth,
-                      betamax = betamax, ret_bulk = ret_bulk, out = out)
+                      betamax = betamax, ret_bulk = ret_bulk, out = out, _layers = layers)
         else:
             out = transfer_2x2(field_data, optical_data, beta = beta, 
                    phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
-              diffraction = diffraction,  multiray = multiray,split_diffraction = split_diffraction,reflection = reflection, betamax = betamax, ret_bulk = ret_bulk, out = out)
+              diffraction = diffraction,  multiray = multiray,split_diffraction = split_diffraction,reflection = reflection, betamax = betamax, ret_bulk = ret_bulk, out = out, _layers = layers)
         
     else:#split input data by rays and compute ray-by-ray
         
@@ -556,6 +777,9 @@ def _transfer_field(field_data, optical_data, beta, phi, nin, nout,
         if phi is None:
             phi = [None] * nrays
         multiray = False
+        if layers is None:
+            #layers and effective data are the same for all rays, build them once
+            layers = _layers_list(optical_data, eff_data, nin, nout, nstep)
         for i, bp in enumerate(zip(beta,phi)):
             if verbose_level >0:
                 print("Ray {}/{}".format(i+1,nrays))
@@ -564,29 +788,58 @@ def _transfer_field(field_data, optical_data, beta, phi, nin, nout,
             beta, phi = bp
             
             if ret_bulk == True:
-                out = field_out[:,i]
+                if isinstance(field_out, np.ndarray):
+                    out = field_out[:,i]
+                else:
+                    out = _BulkRay(field_out, i)
             else:
                 out = field_out[i]
             if method  == "4x4":
                  transfer_4x4(field_data, optical_data, beta = beta, 
                        phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
                   diffraction = diffraction, reflection = reflection,multiray = multiray,norm = norm, smooth = smooth,
-                  betamax = betamax, out = out, ret_bulk = ret_bulk)
+                  betamax = betamax, out = out, ret_bulk = ret_bulk, _layers = layers)
             else:
                 transfer_2x2(field_data, optical_data, beta = beta, 
                    phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
-              diffraction = diffraction,multiray = multiray, split_diffraction = split_diffraction, reflection = reflection, betamax = betamax, out = out, ret_bulk = ret_bulk)
+              diffraction = diffraction,multiray = multiray, split_diffraction = split_diffraction, reflection = reflection, betamax = betamax, out = out, ret_bulk = ret_bulk, _layers = layers)
         
             
         out = field_out, wavelengths, pixelsize
     return out
       
 
+def _run_steps(steps):
+    """Exhausts the steps generator and returns its return value."""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as e:
+            return e.value
+
 def transfer_4x4(field_data, optical_data, beta = 0., 
                    phi = 0., eff_data = None, nin = 1., nout = 1., npass = 1,nstep=1,
               diffraction = True, reflection = 1, multiray = False,norm = DTMM_NORM_FFT, smooth = SMOOTH,
-              betamax = BETAMAX, ret_bulk = False, out = None):
+              betamax = BETAMAX, ret_bulk = False, out = None, packed = None, _layers = None):
     """Transfers input field data through optical data. See transfer_field.
+    
+    If packed is True (defaults to DTMMConfig.packed), the fft field is kept 
+    as a packed array of the modes within the betamax cutoff between the layers
+    and it is scattered to the full grid only for the real space step. This 
+    reduces the work and memory of the Fourier space steps. Applies to 
+    reflection mode 1 with finite diffraction.
+    """
+    return _run_steps(_transfer_4x4_steps(field_data, optical_data, beta = beta, 
+                   phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
+              diffraction = diffraction, reflection = reflection, multiray = multiray,norm = norm, smooth = smooth,
+              betamax = betamax, ret_bulk = ret_bulk, out = out, packed = packed, _layers = _layers))
+
+def _transfer_4x4_steps(field_data, optical_data, beta = 0., 
+                   phi = 0., eff_data = None, nin = 1., nout = 1., npass = 1,nstep=1,
+              diffraction = True, reflection = 1, multiray = False,norm = DTMM_NORM_FFT, smooth = SMOOTH,
+              betamax = BETAMAX, ret_bulk = False, out = None, packed = None, _layers = None, steps = False):
+    """Generator version of transfer_4x4. If steps is True, it yields the layer 
+    index and the field after each propagation step. Returns the transfer_4x4 result.
     """
     if reflection not in (1,2,3,4):
         raise ValueError("Invalid reflection. The 4x4 method is either reflection mode 1 or 2.")
@@ -610,9 +863,11 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
             norm = "total"
     
     #define optical data
-    d, epsv, epsa = validate_optical_data(optical_data)
-       
-    layers, eff_layers = _layers_list(optical_data, eff_data, nin, nout, nstep)
+    if _layers is None:
+        layers, eff_layers = _layers_list(optical_data, eff_data, nin, nout, nstep)
+    else:
+        #prebuilt layers, e.g. when transferring ray-by-ray
+        layers, eff_layers = _layers
             
     #define input field data
     field_in, wavelengths, pixelsize = field_data
@@ -647,8 +902,8 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
         if ret_bulk == True:
             bulk_out = out
             bulk_out[0] = field_in
-            field_in = bulk_out[0]
-            field_out = bulk_out[-1]
+            field_in = _bulk_layer(bulk_out, 0)
+            field_out = _bulk_layer(bulk_out, n-1)
         else:
             bulk_out = None
             field_out = out
@@ -676,7 +931,7 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
         ref = None    
     
     #i0 = field2intensity(transmitted_field(field0, ks, n = nin, betamax = betamax))
-    i0 = field2intensity(field0)
+    i0 = _field2intensity(field0)
     i0 = i0.sum(tuple(range(i0.ndim))[-2:]) 
     
     if reflection not in (2,4) and 0<= diffraction and diffraction < np.inf:
@@ -684,15 +939,24 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
     else:
         work_in_fft = False
         
+    packed = get_default_config_option("packed", packed) and work_in_fft and reflection == 1 and diffraction >= 1
+    
     if work_in_fft:
         field = fft2(field,out = field)
+    if packed:
+        #modes within the cutoff of the largest wavenumber, other modes are zero. 
+        mask, field = ffield2modes(field, np.abs(ks).max(), betamax = betamax)
+    else:
+        mask = None
     _reuse = False
     tmpdata = {}
+    #layer eigensystems are shared between the passes, unless the rays change
+    operators = LayerOperators() if npass > 1 and not ray_tracing else None
     
     #:projection matrices.. set when needed
     if npass > 1:
-        pin_mat = projection_matrix(field.shape[-2:], ks,  epsv = refind2eps([nin]*3), mode = +1, betamax = betamax)
-        pout_mat = projection_matrix(field.shape[-2:], ks,  epsv = refind2eps([nout]*3), mode = +1, betamax = betamax)
+        pin_mat = compact_field_diffraction_matrix(field_in.shape[-2:], ks, d = 0., epsv = refind2eps([nin]*3), mode = +1, betamax = betamax)
+        pout_mat = compact_field_diffraction_matrix(field_in.shape[-2:], ks, d = 0., epsv = refind2eps([nout]*3), mode = +1, betamax = betamax)
 
     
     for i in range(npass):
@@ -737,7 +1001,7 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
                             beta = beta, phi = phi, nsteps = nstep, diffraction = diffraction, reflection = 0, 
                             betamax = _betamax,mode = direction, out = ref[...,::2,:,:])
                 
-            if bulk_out is not None:
+            if isinstance(bulk_out, np.ndarray) and not packed:
                 out_field = _bulk_out[j]
             else:
                 out_field = field
@@ -750,7 +1014,7 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
                 elif reflection == 3:
                     field = propagate_4x4_effective_3(field, ks, output_layer,output_layer_eff, 
                                 beta = beta, phi = phi, nsteps = nstep, diffraction = diffraction, 
-                                betamax = _betamax, out = out_field) 
+                                betamax = _betamax, out = out_field, operators = operators, key = j) 
                 
                 elif reflection ==2:
                     field = propagate_4x4_effective_2(field, ks, output_layer,output_layer_eff, 
@@ -759,11 +1023,21 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
                 else:
                     field = propagate_4x4_effective_1(field, ks, output_layer,output_layer_eff, 
                                 beta = beta, phi = phi, nsteps = nstep, diffraction = diffraction, 
-                                betamax = _betamax, out = out_field, _reuse = _reuse)                    
+                                betamax = _betamax, out = out_field, _reuse = _reuse, mask = mask,
+                                operators = operators, key = j)                    
             else:
                 field = propagate_4x4_full(field, ks, output_layer, 
                             nsteps = nstep, 
                             betamax = _betamax, out = out_field)
+            if bulk_out is not None:
+                #stream the layer to the (array-like) bulk output
+                if packed:
+                    layer_field = modes2ffield(mask, field, out = _bulk_layer(bulk_out, j))
+                else:
+                    layer_field = field
+                _store_bulk_layer(bulk_out, j, layer_field)
+            if steps == True:
+                yield j, ifft2(modes2ffield(mask, field) if packed else field) if work_in_fft else field
             _reuse = True
         if ref is not None:
             ref[...,1::2,:,:] = jones2H(ref2,ks,betamax = _betamax, n = nout)
@@ -772,7 +1046,7 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
         indices.reverse()
         
         if work_in_fft == True:
-            field = ifft2(field)
+            field = ifft2(modes2ffield(mask, field) if packed else field)
 
         
         if npass > 1:
@@ -833,15 +1107,22 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
 
             if work_in_fft == True:
                 field = fft2(field, out = field)
+                if packed:
+                    mask, field = ffield2modes(field, np.abs(ks).max(), betamax = betamax)
                         
         else:
             field_out[...] = field
             #field_in[...] = field0
     #denoise(field_out, ks, nout, smooth*10, out = field_out)           
         
+    if steps == True:
+        yield n-1, field_out
+        
     if ret_bulk == True:
+        _store_bulk_layer(bulk_out, 0, field_in)
+        _store_bulk_layer(bulk_out, n-1, field_out)
         if work_in_fft:
-            ifft2(bulk_out[1:-1],out =bulk_out[1:-1])
+            _bulk_ifft2(bulk_out)
         return bulk_out, wavelengths, pixelsize
     else:
         return field_out, wavelengths, pixelsize
@@ -886,31 +1167,72 @@ def transfer_4x4(field_data, optical_data, beta = 0.,
 
 
 
-def _layers_list(optical_data, eff_data, nin, nout, nstep):
+class _BulkRay(object):
+    """Array-like view of the i-th ray of a bulk array-like object."""
+    def __init__(self, bulk_out, i):
+        self.bulk_out = bulk_out
+        self.i = i
+        
+    def __len__(self):
+        return len(self.bulk_out)
+    
+    def __getitem__(self, j):
+        return self.bulk_out[j, self.i]
+    
+    def __setitem__(self, j, value):
+        self.bulk_out[j, self.i] = value
+
+def _bulk_layer(bulk_out, j):
+    """Returns j-th layer of the bulk output. For ndarrays (and memmaps) this is
+    a view. Other writable array-likes (e.g. h5py or zarr datasets) return a 
+    copy that must be stored back with :func:`_store_bulk_layer`."""
+    if isinstance(bulk_out, np.ndarray):
+        return bulk_out[j]
+    else:
+        return np.asarray(bulk_out[j])
+
+def _store_bulk_layer(bulk_out, j, field):
+    """Stores j-th layer of the bulk output, if it is not an ndarray."""
+    if not isinstance(bulk_out, np.ndarray):
+        bulk_out[j] = field
+        
+def _bulk_ifft2(bulk_out):
+    """Inverse fft of the inner bulk layers, computed layer-by-layer, so that 
+    no temporary arrays of the bulk size are created."""
+    for j in range(1,len(bulk_out)-1):
+        field = _bulk_layer(bulk_out, j)
+        field = ifft2(field, out = field)
+        _store_bulk_layer(bulk_out, j, field)
+
+def _effective_data(optical_data, eff_data):
+    """Returns validated effective data. If eff_data is not a valid optical data
+    tuple, it is computed from the (validated) optical data."""
+    try:
+        return validate_optical_data(eff_data, homogeneous = True)        
+    except (TypeError, ValueError):
+        if eff_data is None:
+            return _isotropic_effective_data(optical_data)
+        else:
+            return effective_data(optical_data, symmetry = eff_data)
+
+def _layers_list(optical_data, eff_data, nin, nout, nstep, validate = True):
     """Build optical data layers list and effective data layers list.
     It appends/prepends input and output layers. A layer consists of
-    a tuple of (n, thickness, epsv, epsa) where n is number of sublayers"""
-    d, epsv, epsa = validate_optical_data(optical_data)  
+    a tuple of (n, thickness, epsv, epsa) where n is number of sublayers. 
+    
+    If validate is False, optical data must be a validated optical data tuple,
+    and layers are views of the optical data arrays."""
+    if validate == True:
+        d, epsv, epsa = validate_optical_data(optical_data)  
+    else:
+        d, epsv, epsa = optical_data
     
     if epsa is not None:
         substeps = np.broadcast_to(np.asarray(nstep),(len(d),))
         layers = [(n,(t/n, ev, ea)) for n,t,ev,ea in zip(substeps, d, epsv, epsa)]
         #add input and output layers
-        layers.insert(0, (1,(0., np.broadcast_to(refind2eps([nin]*3), epsv[0].shape), np.broadcast_to(np.array((0.,0.,0.), dtype = FDTYPE), epsa[0].shape))))
-        layers.append((1,(0., np.broadcast_to(refind2eps([nout]*3), epsv[0].shape), np.broadcast_to(np.array((0.,0.,0.), dtype = FDTYPE), epsa[0].shape))))
-
-        try:
-            d_eff, epsv_eff, epsa_eff = validate_optical_data(eff_data, homogeneous = True)        
-        except (TypeError, ValueError):
-            if eff_data is None:
-                d_eff, epsv_eff, epsa_eff = _isotropic_effective_data(optical_data)
-            else:
-                d_eff, epsv_eff, epsa_eff = effective_data(optical_data, symmetry = eff_data)
-                        
-        eff_layers = [(n,(t/n, ev, ea)) for n,t,ev,ea in zip(substeps, d_eff, epsv_eff, epsa_eff)]
-        eff_layers.insert(0, (1,(0., refind2eps([nin]*3), np.array((0.,0.,0.), dtype = FDTYPE))))
-        eff_layers.append((1,(0., refind2eps([nout]*3), np.array((0.,0.,0.), dtype = FDTYPE))))
-        return layers, eff_layers
+        layers.insert(0, (1,(0., np.broadcast_to(refind2eps([nin]*3), epsv[0].shape), np.broadcast_to(np.array((0.,0.,0.), dtype = conf.FDTYPE), epsa[0].shape))))
+        layers.append((1,(0., np.broadcast_to(refind2eps([nout]*3), epsv[0].shape), np.broadcast_to(np.array((0.,0.,0.), dtype = conf.FDTYPE), epsa[0].shape))))
     else:
         substeps = np.broadcast_to(np.asarray(nstep),(len(d),))
         layers = [(n,(t/n, ev, None)) for n,t,ev in zip(substeps, d, epsv)]
@@ -918,27 +1240,40 @@ def _layers_list(optical_data, eff_data, nin, nout, nstep):
         layers.insert(0, (1,(0., np.broadcast_to(refind2eps([nin,nin,nin,0,0,0]), epsv[0].shape), None)))
         layers.append((1,(0., np.broadcast_to(refind2eps([nout,nout,nout,0,0,0]), epsv[0].shape), None)))
 
-        try:
-            d_eff, epsv_eff, epsa_eff = validate_optical_data(eff_data, homogeneous = True)        
-        except (TypeError,ValueError):
-            if eff_data is None:
-                d_eff, epsv_eff, epsa_eff = _isotropic_effective_data(optical_data)
-            else:
-                d_eff, epsv_eff, epsa_eff = effective_data(optical_data, symmetry = eff_data)
+    d_eff, epsv_eff, epsa_eff = _effective_data((d, epsv, epsa), eff_data)
                     
-        eff_layers = [(n,(t/n, ev, ea)) for n,t,ev,ea in zip(substeps, d_eff, epsv_eff, epsa_eff)]
-        eff_layers.insert(0, (1,(0., refind2eps([nin]*3), np.array((0.,0.,0.), dtype = FDTYPE))))
-        eff_layers.append((1,(0., refind2eps([nout]*3), np.array((0.,0.,0.), dtype = FDTYPE))))
-        return layers, eff_layers       
+    eff_layers = [(n,(t/n, ev, ea)) for n,t,ev,ea in zip(substeps, d_eff, epsv_eff, epsa_eff)]
+    eff_layers.insert(0, (1,(0., refind2eps([nin]*3), np.array((0.,0.,0.), dtype = conf.FDTYPE))))
+    eff_layers.append((1,(0., refind2eps([nout]*3), np.array((0.,0.,0.), dtype = conf.FDTYPE))))
+    return layers, eff_layers       
 
 
 def transfer_2x2(field_data, optical_data, beta = None, 
                    phi = None, eff_data = None, nin = 1., 
                    nout = 1., npass = 1,nstep=1,
               diffraction = True, reflection = True, multiray = False, split_diffraction = False,
-              betamax = BETAMAX, ret_bulk = False, out = None):
+              betamax = BETAMAX, ret_bulk = False, out = None, packed = None, _layers = None):
     """Tranfers input field data through optical data using the 2x2 method
-    See transfer_field for documentation.
+    See transfer_field for documentation. 
+    
+    If packed is True (defaults to DTMMConfig.packed), the fft field is kept 
+    as a packed array of the modes within the betamax cutoff between the layers
+    and it is scattered to the full grid only for the real space step. This 
+    reduces the work and memory of the Fourier space steps. Applies to 
+    the calculation in Fourier space (reflection = 0 or 1).
+    """
+    return _run_steps(_transfer_2x2_steps(field_data, optical_data, beta = beta, 
+                   phi = phi, eff_data = eff_data, nin = nin, nout = nout, npass = npass,nstep=nstep,
+              diffraction = diffraction, reflection = reflection, multiray = multiray, split_diffraction = split_diffraction,
+              betamax = betamax, ret_bulk = ret_bulk, out = out, packed = packed, _layers = _layers))
+
+def _transfer_2x2_steps(field_data, optical_data, beta = None, 
+                   phi = None, eff_data = None, nin = 1., 
+                   nout = 1., npass = 1,nstep=1,
+              diffraction = True, reflection = True, multiray = False, split_diffraction = False,
+              betamax = BETAMAX, ret_bulk = False, out = None, packed = None, _layers = None, steps = False):
+    """Generator version of transfer_2x2. If steps is True, it yields the layer 
+    index and the field after each propagation step. Returns the transfer_2x2 result.
     """
     if reflection not in (0,1,2):
         raise ValueError("Invalid reflection. The 2x2 method supports reflection mode 0,1 or 2.")
@@ -949,7 +1284,10 @@ def transfer_2x2(field_data, optical_data, beta = None,
         print(" * Initializing.")
     
     #create layers lists
-    layers, eff_layers = _layers_list(optical_data, eff_data, nin, nout, nstep)
+    if _layers is None:
+        layers, eff_layers = _layers_list(optical_data, eff_data, nin, nout, nstep)
+    else:
+        layers, eff_layers = _layers
     #define input field data
     field_in, wavelengths, pixelsize = field_data
     #wavenumbers
@@ -977,13 +1315,15 @@ def transfer_2x2(field_data, optical_data, beta = None,
             bulk_out = None
             field_out = np.zeros_like(field_in)   
     else:
-        out[...] = 0.
         if ret_bulk == True:
             bulk_out = out
+            for j in range(1, n+1):
+                bulk_out[j] = 0.
             bulk_out[0] = field_in
-            field_in = bulk_out[0]
-            field_out = bulk_out[-1]
+            field_in = _bulk_layer(bulk_out, 0)
+            field_out = _bulk_layer(bulk_out, n)
         else:
+            out[...] = 0.
             bulk_out = None
             field_out = out
              
@@ -1014,9 +1354,23 @@ def transfer_2x2(field_data, optical_data, beta = None,
     else:   
         work_in_fft = False
         
+    packed = get_default_config_option("packed", packed) and work_in_fft and 0 <= diffraction < np.inf
+        
     if work_in_fft:
         field = fft2(field,out = field)
         
+    if packed:
+        #modes within the cutoff of the largest wavenumber, other modes are zero. 
+        mask, field = ffield2modes(field, np.abs(ks).max(), betamax = betamax)
+        if npass > 1:
+            refl = np.zeros(shape = (n+1,) + field.shape, dtype = field.dtype)
+    else:
+        mask = None
+        
+    if steps == True and bulk_out is None:
+        #work array for the layer fields
+        step_bulk = np.zeros_like(field_in)
+        
     tmpdata = {}
 
     for i in range(npass):
@@ -1057,10 +1411,14 @@ def transfer_2x2(field_data, optical_data, beta = None,
             elif jout == len(indices):
                 bulk = field_out
             else:
-                if bulk_out is None:
-                    bulk = None
+                if bulk_out is not None:
+                    bulk = _bulk_layer(bulk_out, jout)
+                elif steps == True:
+                    #field of the current pass only
+                    bulk = step_bulk
+                    bulk[...] = 0.
                 else:
-                    bulk = bulk_out[jout]
+                    bulk = None
                     
             if ray_tracing == True:
                 if work_in_fft:
@@ -1075,7 +1433,7 @@ def transfer_2x2(field_data, optical_data, beta = None,
                 if work_in_fft:
                     field, refli = propagate_2x2_effective_1(field, ks, input_layer, output_layer ,input_layer_eff, output_layer_eff, 
                             beta = beta, phi = phi, nsteps = nstep, diffraction = diffraction, split_diffraction = split_diffraction, reflection = reflection, 
-                            betamax = betamax,mode = direction, refl = refl[j], bulk = bulk, tmpdata = tmpdata)
+                            betamax = betamax,mode = direction, refl = refl[j], bulk = bulk, tmpdata = tmpdata, mask = mask)
                 
                 else:
                     field, refli = propagate_2x2_effective_2(field, ks, input_layer, output_layer ,input_layer_eff, output_layer_eff, 
@@ -1087,15 +1445,27 @@ def transfer_2x2(field_data, optical_data, beta = None,
                 field, refli = propagate_2x2_full(field, ks, output_layer, input_layer = input_layer, 
                     nsteps = 1,  reflection = reflection, mode = direction,
                     betamax = betamax, refl = refl[j], bulk = bulk)
+            
+            if 0 < jout < len(indices):
+                if bulk_out is not None:
+                    #stream the layer to the (array-like) bulk output
+                    _store_bulk_layer(bulk_out, jout, bulk)
+                if steps == True:
+                    yield jout, bulk
 
         print_progress(n,n,level = verbose_level, suffix = suffix, prefix = prefix) 
         
         indices.reverse()
 
+    if steps == True:
+        yield n, field_out
+        
     if ret_bulk == True:
+        _store_bulk_layer(bulk_out, 0, field_in)
+        _store_bulk_layer(bulk_out, n, field_out)
         return bulk_out, wavelengths, pixelsize
     else:
         return field_out, wavelengths, pixelsize  
     
  
-__all__ = ["transfer_field", "transmitted_field", "reflected_field", "transfer_2x2", "transfer_4x4", "total_intensity"]
+__all__ = ["transfer_field", "iter_transfer", "transmitted_field", "reflected_field", "transfer_2x2", "transfer_4x4", "total_intensity"]
@@ -6,7 +6,8 @@ Wave creation and wave characterization functions.
 from __future__ import absolute_import, print_function, division
 
 import numpy as np
-from dtmm.conf import FDTYPE,CDTYPE, cached_function, BETAMAX
+from dtmm.conf import cached_function, BETAMAX
+import dtmm.conf as conf
 import dtmm.fft as fft
 
 def betax1(n, k0, out = None):
@@ -26,8 +27,8 @@ def betax1(n, k0, out = None):
     array
         beta array  
     """
-    k0 = np.abs(np.asarray(k0, FDTYPE)[...,np.newaxis]) #make it broadcastable
-    xx = np.asarray(np.fft.fftfreq(n), dtype = FDTYPE)
+    k0 = np.abs(np.asarray(k0, conf.FDTYPE)[...,np.newaxis]) #make it broadcastable
+    xx = np.asarray(np.fft.fftfreq(n), dtype = conf.FDTYPE)
     beta = np.multiply((2 * np.pi / k0) , xx, out = out)
     return beta
 
@@ -73,13 +74,40 @@ def betaphi(shape, k0, out = None):
     """
     if out is None:
         out = None, None
-    k0 = np.abs(np.asarray(k0, FDTYPE)[...,np.newaxis,np.newaxis]) #make it broadcastable
-    ay, ax = map(lambda x : np.asarray(np.fft.fftfreq(x), dtype = FDTYPE), shape[-2:])
+    k0 = np.abs(np.asarray(k0, conf.FDTYPE)[...,np.newaxis,np.newaxis]) #make it broadcastable
+    ay, ax = map(lambda x : np.asarray(np.fft.fftfreq(x), dtype = conf.FDTYPE), shape[-2:])
     xx, yy = np.meshgrid(ax, ay,copy = False, indexing = "xy") 
     beta = np.multiply((2 * np.pi / k0) , np.sqrt(xx**2 + yy**2), out = out[0])
     phi  = np.arctan2(yy,xx, out = out[1])
     return beta, phi
 
+@cached_function
+def radial_index(shape):
+    """Returns distinct radial frequencies of all possible plane eigenwaves.
+
+    Plane eigenwaves of an isotropic medium depend on beta only, which is
+    proportional to the radial frequency. Use this to compute quantities
+    for each of the distinct radial frequencies only.
+
+    Parameters
+    ----------
+    shape : (int,int)
+        Shape of the plane eigenwave.
+
+    Returns
+    -------
+    array, array
+        Sorted distinct radial frequencies and an index array of the given
+        shape mapping each of the plane eigenwaves to its radial frequency.
+    """
+    ny, nx = shape[-2:]
+    iy, ix = map(lambda n : np.fft.fftfreq(n, 1./n).astype("int64"), (ny,nx))
+    xx, yy = np.meshgrid(ix*ny, iy*nx, copy = False, indexing = "xy")
+    #: squared radial frequency in units of 1/(nx*ny)**2, integer, so it is exact
+    r2, index = np.unique(xx**2 + yy**2, return_inverse = True)
+    r = np.asarray(np.sqrt(r2) / (nx*ny), conf.FDTYPE)
+    return r, np.asarray(index.reshape(ny, nx), "uint32")
+
 @cached_function
 def betaxy(shape, k0, out = None):
     """Returns betax, betay arrays of plane eigenwaves.
@@ -99,8 +127,8 @@ def betaxy(shape, k0, out = None):
         beta, phi arrays      
     """
     #ax, ay = map(np.fft.fftfreq, shape,(d,)*len(shape))
-    k0 = np.asarray(k0,dtype = FDTYPE)[...,np.newaxis,np.newaxis] #make it broadcastable
-    ay, ax = map(lambda x : np.asarray(np.fft.fftfreq(x), dtype = FDTYPE), shape[-2:])
+    k0 = np.asarray(k0,dtype = conf.FDTYPE)[...,np.newaxis,np.newaxis] #make it broadcastable
+    ay, ax = map(lambda x : np.asarray(np.fft.fftfreq(x), dtype = conf.FDTYPE), shape[-2:])
     xx, yy = np.meshgrid(ax, ay,copy = False, indexing = "xy") 
     if out is None:
         out = None, None
@@ -123,7 +151,7 @@ def k0(wavelength, pixelsize = 1.):
         Wavenumber array     
     """
     out = 2*np.pi/np.asarray(wavelength) * pixelsize
-    return np.asarray(out, dtype = FDTYPE)
+    return np.asarray(out, dtype = conf.FDTYPE)
 
 def wavelengths(start = 380,stop = 780, count = 9):
     """Raturns wavelengths (in nanometers) equaly spaced in wavenumbers between 
@@ -144,7 +172,7 @@ def wavelengths(start = 380,stop = 780, count = 9):
         A wavelength array
     """
     out = 1./np.linspace(1./start, 1./stop, count)
-    return np.asarray(out, dtype = FDTYPE)
+    return np.asarray(out, dtype = conf.FDTYPE)
     
 
 def eigenwave(shape, i, j, amplitude = None, out = None):
@@ -169,7 +197,7 @@ def eigenwave(shape, i, j, amplitude = None, out = None):
         Plane wave array.       
     """    
     if out is None:
-        f = np.zeros(shape, dtype = CDTYPE)
+        f = np.zeros(shape, dtype = conf.CDTYPE)
     else:
         f = np.asarray(out)
         f[...] = 0.
@@ -197,7 +225,7 @@ def eigenwave1(n, i,  amplitude = None):
     array
         Plane wave array.       
     """    
-    f = np.zeros((n,), dtype = CDTYPE)
+    f = np.zeros((n,), dtype = conf.CDTYPE)
     if amplitude is None:
         amplitude = n
     f[...,i] = amplitude
@@ -320,7 +348,7 @@ def eigenindices1(n, k0, betamax = BETAMAX):
 #@cached_function
 #def eigenwaves(shape, k0, betamax = BETAMAX):
 #    ii, jj = eigenindices(shape, k0, betamax)
-#    out = np.empty(shape = (len(ii),) + shape, dtype = CDTYPE)
+#    out = np.empty(shape = (len(ii),) + shape, dtype = conf.CDTYPE)
 #    for n in range(len(ii)):
 #        i = ii[n]
 #        j = jj[n]
@@ -331,7 +359,7 @@ def wave2eigenwave(wave, out = None):
     """Converts any wave to nearest eigenwave"""
     wave = np.asarray(wave)
     if out is None:
-        out = np.empty(shape = wave.shape, dtype = CDTYPE)
+        out = np.empty(shape = wave.shape, dtype = conf.CDTYPE)
     
     shape = wave.shape
     assert wave.ndim >= 2
@@ -387,10 +415,10 @@ def planewave(shape, k0, beta , phi, out = None):
     phi = np.asarray(phi)[...,np.newaxis,np.newaxis]
     ay, ax = [np.arange(-l // 2 + 1., l // 2 + 1.) for l in shape[-2:]]
     xx, yy = np.meshgrid(ax, ay, indexing = "xy", copy = False)
-    xx = np.asarray(xx, dtype = FDTYPE)
-    yy = np.asarray(yy, dtype = FDTYPE)
-    kx = np.asarray(k0*beta*np.cos(phi), dtype = FDTYPE)
-    ky = np.asarray(k0*beta*np.sin(phi), dtype = FDTYPE)
+    xx = np.asarray(xx, dtype = conf.FDTYPE)
+    yy = np.asarray(yy, dtype = conf.FDTYPE)
+    kx = np.asarray(k0*beta*np.cos(phi), dtype = conf.FDTYPE)
+    ky = np.asarray(k0*beta*np.sin(phi), dtype = conf.FDTYPE)
     out = np.exp((1j*(kx*xx+ky*yy)), out = out)
     return np.divide(out,out[...,0,0][...,None,None],out)
 
@@ -414,8 +442,8 @@ def planewave1(n, k0, beta, out = None):
     k0 = np.asarray(k0)[...,np.newaxis] #make it broadcastable
     beta = np.asarray(beta)[...,np.newaxis]
     xx = np.arange(-n // 2 + 1., n // 2 + 1.)
-    xx = np.asarray(xx, dtype = FDTYPE)
-    kx = np.asarray(k0*beta, dtype = FDTYPE)
+    xx = np.asarray(xx, dtype = conf.FDTYPE)
+    kx = np.asarray(k0*beta, dtype = conf.FDTYPE)
     out = np.exp((1j*(kx*xx)), out = out)
     return np.divide(out,out[...,0][...,None],out)
 
@@ -7,7 +7,8 @@ Window functions.
 from __future__ import absolute_import, print_function, division
 
 import numpy as np
-from dtmm.conf import FDTYPE, cached_function
+from dtmm.conf import cached_function
+import dtmm.conf as conf
 
 def _r(shape, scale = 1.):
     """Returns radius array of a given shape."""
@@ -42,7 +43,7 @@ def blackman(shape, out = None):
     """
     r = _r(shape)  
     if out is None:
-        out = np.ones(shape, FDTYPE)
+        out = np.ones(shape, conf.FDTYPE)
     out[...] = 0.42 + 0.5*np.cos(1*np.pi*r)+0.08*np.cos(2*np.pi*r)
     mask = (r>= 1.)
     out[mask] = 0.
@@ -64,7 +65,7 @@ def gaussian(shape, waist):
         Gaussian beam window
     """
     r = _r(shape, waist)
-    out = np.empty(shape, FDTYPE)
+    out = np.empty(shape, conf.FDTYPE)
     return np.exp(-r**2, out = out)
 
 def gaussian_beam(shape, waist, k0, z = 0., n = 1):
@@ -126,10 +127,10 @@ def aperture(shape, diameter = 1., smooth = 0.05, out = None):
 
 def tukey(r,alpha = 0.1, rmax = 1., out =  None):
     if out is None:
-        out = np.ones(r.shape, FDTYPE)
+        out = np.ones(r.shape, conf.FDTYPE)
     else:
         out[...] = 1.
-    r = np.asarray(r, FDTYPE)
+    r = np.asarray(r, conf.FDTYPE)
     alpha = alpha * rmax
     mask = r > rmax -alpha
     if alpha > 0.: